@@ -0,0 +1,100 @@
+"""
+Content-addressed on-disk cache for packaged tarballs of immutable dependencies.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+
+from app.helpers.blob_cache import BlobCache
+
+
+class ArtifactCache(BlobCache):
+    """
+    Stores packaged tarballs by their SHA-256 and maps normalized request keys onto them.
+
+    The cache is bounded by a byte budget; the least recently used blobs are evicted first.
+    """
+
+    def __init__(self):
+        super().__init__(
+            "artifact",
+            os.getenv("ARTIFACT_CACHE_DIR", "/tmp/artifact-cache/"),
+            int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(10 * 1024 ** 3))),  # 10 GiB
+            os.getenv("ARTIFACT_CACHE_ENABLED", "true").lower() == "true",
+        )
+
+    async def fetch(self, key: str, destination: str) -> bool:
+        """
+        Materialize the cached tarball for key at destination.
+
+        :return: True on a cache hit, False on a miss.
+        """
+        if not self.enabled:
+            return False
+
+        entry = self._index["keys"].get(key)
+        if entry is None:
+            self.misses += 1
+            hit = False
+        else:
+            hit = await self.fetch_blob(entry["digest"], destination)
+        print(f"Artifact cache {'hit' if hit else 'miss'} for {key} (hits={self.hits}, misses={self.misses})")
+        return hit
+
+    def metadata(self, key: str) -> dict:
+        """Metadata stored with the tarball for key, empty when the key is unknown"""
+        entry = self._index["keys"].get(key) if self.enabled else None
+        return dict(entry.get("metadata") or {}) if entry else {}
+
+    def digest(self, key: str) -> Optional[str]:
+        """SHA-256 of the tarball cached for key, None when the key is unknown"""
+        entry = self._index["keys"].get(key) if self.enabled else None
+        return entry["digest"] if entry else None
+
+    async def store(self, key: str, tarball_path: str, metadata: Optional[dict] = None, digest: Optional[str] = None):
+        """
+        Add the tarball at tarball_path to the cache under key, with optional metadata such as its codec.
+
+        :param digest: SHA-256 of the tarball when it was hashed while packaging, saves reading it again.
+        """
+        if not self.enabled:
+            return
+
+        try:
+            if digest is None:
+                loop = asyncio.get_event_loop()
+                digest = await loop.run_in_executor(None, self._hash_file, tarball_path)
+        except Exception as e:
+            # Caching is best effort and must never fail the job
+            print(f"Error storing {key} in artifact cache: {e}")
+            return
+
+        await self.add_blob(digest, tarball_path)
+        # The blob may have failed to store or been evicted straight away when larger than the budget
+        if digest in self._index["blobs"]:
+            self._index["keys"][key] = {"digest": digest, "created": time.time(), "metadata": metadata or {}}
+            self._save_index()
+            print(f"Stored {key} in artifact cache as {digest[:12]} ({self._index['blobs'][digest]['size']} bytes)")
+
+    def _hash_file(self, path: str) -> str:
+        """SHA-256 of the file, to be run in thread pool"""
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as source:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _forget_blob(self, digest: str):
+        super()._forget_blob(digest)
+        for key in [k for k, entry in self._index["keys"].items() if entry["digest"] == digest]:
+            del self._index["keys"][key]
+
+    def _empty_index(self) -> dict:
+        return {"keys": {}, "blobs": {}}
+
+
+# Shared instance used by all processors
+artifact_cache = ArtifactCache()
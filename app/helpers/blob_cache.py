@@ -0,0 +1,139 @@
+"""
+Size-bounded, content-addressed blob store with least recently used eviction.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+
+
+class BlobCache:
+    """
+    Keeps blobs on disk under their SHA-256 digest and evicts the least recently used
+    ones once the total size exceeds max_bytes. The index survives restarts.
+    """
+
+    def __init__(self, name: str, cache_dir: str, max_bytes: int, enabled: bool = True):
+        self.name = name
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.blob_dir = os.path.join(self.cache_dir, "blobs")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self._index = self._empty_index()
+
+        if self.enabled:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            self._load_index()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(blob["size"] for blob in self._index["blobs"].values())
+
+    def has_blob(self, digest: str) -> bool:
+        return self.enabled and digest in self._index["blobs"] and os.path.exists(self._blob_path(digest))
+
+    async def fetch_blob(self, digest: str, destination: str) -> bool:
+        """
+        Materialize the blob at destination.
+
+        :return: True on a cache hit, False on a miss.
+        """
+        if not self.has_blob(digest):
+            if self.enabled and digest in self._index["blobs"]:
+                # The blob disappeared underneath us, forget the stale entry
+                self._forget_blob(digest)
+                self._save_index()
+            self.misses += 1
+            return False
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._link_or_copy, self._blob_path(digest), destination)
+        self.touch(digest)
+        self.hits += 1
+        return True
+
+    async def add_blob(self, digest: str, source: str):
+        """Add the file at source, whose content is known to have the given digest"""
+        if not self.enabled:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+            size = await loop.run_in_executor(None, self._place_blob, digest, source)
+        except Exception as e:
+            # Caching is best effort and must never fail the job
+            print(f"Error storing {digest[:12]} in {self.name} cache: {e}")
+            return
+        self._index["blobs"][digest] = {"size": size, "last_used": time.time()}
+        self._evict()
+        self._save_index()
+
+    def touch(self, digest: str):
+        """Mark the blob as recently used"""
+        if digest in self._index["blobs"]:
+            self._index["blobs"][digest]["last_used"] = time.time()
+            self._save_index()
+
+    def _place_blob(self, digest: str, source: str) -> int:
+        """Hard link or copy source into the blob store, to be run in thread pool"""
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            staging_path = f"{blob_path}.{uuid.uuid4().hex}.tmp"
+            self._link_or_copy(source, staging_path)
+            os.replace(staging_path, blob_path)
+        return os.path.getsize(blob_path)
+
+    def _evict(self):
+        """Drop least recently used blobs until the cache fits its byte budget"""
+        blobs = self._index["blobs"]
+        total = self.total_bytes
+        for digest in sorted(blobs, key=lambda d: blobs[d]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= blobs[digest]["size"]
+            print(f"Evicting {digest[:12]} from {self.name} cache")
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+            self._forget_blob(digest)
+
+    def _forget_blob(self, digest: str):
+        self._index["blobs"].pop(digest, None)
+
+    def _blob_path(self, digest: str) -> str:
+        hex_digest = digest.split(":", 1)[-1]
+        return os.path.join(self.blob_dir, hex_digest[:2], hex_digest)
+
+    def _link_or_copy(self, source: str, destination: str):
+        """Hard link when possible so cache hits and stores cost no extra disk space"""
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+
+    def _empty_index(self) -> dict:
+        return {"blobs": {}}
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as index_file:
+                self._index.update(json.load(index_file))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"{self.name.capitalize()} cache index unreadable, starting empty: {e}")
+
+    def _save_index(self):
+        staging_path = f"{self.index_path}.tmp"
+        with open(staging_path, "w") as index_file:
+            json.dump(self._index, index_file)
+        os.replace(staging_path, self.index_path)
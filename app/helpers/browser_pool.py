@@ -0,0 +1,118 @@
+"""
+Long-lived headless browser shared by website renders.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from pyppeteer import launch
+
+
+class _BrowserHandle:
+    """A launched browser together with its usage counters"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.active_pages = 0
+        self.renders = 0
+        self.retired = False
+        self.closed = False
+
+    def is_alive(self) -> bool:
+        process = getattr(self.browser, "process", None)
+        if process is not None and process.poll() is not None:
+            return False
+        connection = getattr(self.browser, "_connection", None)
+        return connection is None or getattr(connection, "_connected", True)
+
+
+class BrowserPool:
+    """
+    Keeps one Chromium instance running and hands out a bounded number of pages.
+
+    Renders for unrelated jobs share the browser, so every page lives in its own incognito
+    context: cookies, storage and cache of one site never reach the next render.
+
+    The browser is recycled after a configurable number of renders or when it crashed;
+    a retired browser is closed once its last page has been released.
+    """
+
+    def __init__(self):
+        self.max_pages = int(os.getenv("BROWSER_POOL_MAX_PAGES", "4"))
+        self.recycle_after = int(os.getenv("BROWSER_RECYCLE_AFTER_RENDERS", "100"))
+        self.launch_options = {
+            'args': ['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage'],
+            'timeout': 60000,  # 1 minute timeout for browser launch
+            # Leave signal handling to the application lifecycle
+            'handleSIGINT': False,
+            'handleSIGTERM': False,
+            'handleSIGHUP': False
+        }
+        self._current = None
+        self._semaphore = asyncio.Semaphore(self.max_pages)
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def page(self):
+        """Yield a fresh page in its own context; the context is always closed afterwards, even on errors"""
+        async with self._semaphore:
+            handle = await self._acquire_browser()
+            handle.active_pages += 1
+            context = None
+            try:
+                context = await handle.browser.createIncognitoBrowserContext()
+                yield await context.newPage()
+            finally:
+                handle.active_pages -= 1
+                handle.renders += 1
+                if context is not None:
+                    try:
+                        # Closes the page along with the context's cookies, storage and cache
+                        await context.close()
+                    except Exception as e:
+                        print(f"Error closing browser context: {e}")
+                if not handle.is_alive() or handle.renders >= self.recycle_after:
+                    self._retire(handle)
+                if handle.retired and handle.active_pages == 0:
+                    await self._close_browser(handle)
+
+    async def _acquire_browser(self) -> _BrowserHandle:
+        async with self._lock:
+            current = self._current
+            if current is not None and not current.is_alive():
+                print("Headless browser crashed, launching a new one")
+                self._retire(current)
+                if current.active_pages == 0:
+                    await self._close_browser(current)
+            if self._current is None or self._current.retired:
+                self._current = _BrowserHandle(await launch(self.launch_options))
+                print("Launched headless browser")
+            return self._current
+
+    def _retire(self, handle: _BrowserHandle):
+        handle.retired = True
+        if self._current is handle:
+            self._current = None
+
+    async def _close_browser(self, handle: _BrowserHandle):
+        if handle.closed:
+            return
+        handle.closed = True
+        try:
+            await handle.browser.close()
+            print(f"Closed headless browser after {handle.renders} renders")
+        except Exception as e:
+            print(f"Error closing headless browser: {e}")
+
+    async def close(self):
+        """Close the current browser, called from the application shutdown hook"""
+        async with self._lock:
+            if self._current is not None:
+                handle = self._current
+                self._retire(handle)
+                await self._close_browser(handle)
+
+
+# Shared instance used by the website processor
+browser_pool = BrowserPool()
@@ -0,0 +1,110 @@
+"""
+Compression codecs for packaged tarballs.
+"""
+
+import gzip
+import os
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+CODECS = ("none", "gzip", "zstd")
+EXTENSIONS = {"none": ".tar", "gzip": ".tar.gz", "zstd": ".tar.zst"}
+
+# Leading bytes of formats that do not shrink any further
+COMPRESSED_MAGIC = (
+    b"\x1f\x8b",            # gzip, tgz, docker layers
+    b"PK\x03\x04",          # zip, jar, war, whl
+    b"\x28\xb5\x2f\xfd",    # zstd
+    b"\xfd7zXZ\x00",        # xz
+    b"BZh",                 # bzip2
+    b"7z\xbc\xaf\x27\x1c",  # 7z
+    b"\x89PNG",             # png
+    b"\xff\xd8\xff",        # jpeg
+)
+
+
+# Codecs that store incompressible blocks as they are, at close to copy speed
+RAW_BLOCK_CODECS = ("zstd",)
+
+
+class CompressionPolicy:
+    """
+    Chooses the codec per download type and skips gzip for payloads that are mostly
+    compressed already (jars, wheels, tgz, image layers).
+
+    The tarball is compressed as one stream, so the choice holds for all of its members.
+    zstd is always kept: it passes compressed members through raw blocks cheaply and
+    still shrinks the compressible rest, while gzip would spend its full cost on them.
+    """
+
+    def __init__(self):
+        self.default_codec = os.getenv("TARBALL_CODEC", "none").lower()
+        self.skip_ratio = float(os.getenv("TARBALL_COMPRESSION_SKIP_RATIO", "0.8"))
+        # Several jobs compress at once, one thread each by default
+        self.threads = int(os.getenv("TARBALL_COMPRESSION_THREADS", "1"))
+        self.levels = {
+            "gzip": int(os.getenv("TARBALL_GZIP_LEVEL", "6")),
+            "zstd": int(os.getenv("TARBALL_ZSTD_LEVEL", "3")),
+        }
+
+    def configured_codec(self, download_type: str) -> str:
+        """Codec from TARBALL_CODEC_<TYPE>, falling back to TARBALL_CODEC"""
+        codec = os.getenv(f"TARBALL_CODEC_{download_type}", self.default_codec).lower()
+        if codec not in CODECS:
+            print(f"Unknown tarball codec {codec} for {download_type}, sending uncompressed")
+            return "none"
+        if codec == "zstd" and zstandard is None:
+            print("zstandard is not installed, falling back to gzip")
+            return "gzip"
+        return codec
+
+    def choose(self, download_type: str, content_path: str) -> str:
+        """Codec for this payload, to be run in thread pool as it samples the content"""
+        codec = self.configured_codec(download_type)
+        if codec == "none" or codec in RAW_BLOCK_CODECS:
+            return codec
+        ratio = compressed_ratio(content_path)
+        if ratio >= self.skip_ratio:
+            print(f"{ratio:.0%} of the {download_type} payload is already compressed, skipping {codec}")
+            return "none"
+        return codec
+
+    @contextmanager
+    def writer(self, fileobj, codec: str):
+        """Wrap fileobj so everything written to it is compressed with codec"""
+        if codec == "gzip":
+            # mtime=0 keeps identical content byte-identical
+            with gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.levels["gzip"], mtime=0) as compressed:
+                yield compressed
+        elif codec == "zstd":
+            compressor = zstandard.ZstdCompressor(level=self.levels["zstd"], threads=self.threads)
+            with compressor.stream_writer(fileobj, closefd=False) as compressed:
+                yield compressed
+        else:
+            yield fileobj
+
+
+def compressed_ratio(content_path: str) -> float:
+    """Fraction of the payload bytes in files that are compressed already, judged by their magic bytes"""
+    total = compressed = 0
+    if os.path.isdir(content_path):
+        paths = (os.path.join(root, name) for root, _, names in os.walk(content_path) for name in names)
+    else:
+        paths = [content_path]
+    for path in paths:
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+        size = os.path.getsize(path)
+        total += size
+        with open(path, "rb") as payload:
+            if payload.read(8).startswith(COMPRESSED_MAGIC):
+                compressed += size
+    return compressed / total if total else 0.0
+
+
+# Shared instance used by the processors
+compression_policy = CompressionPolicy()
@@ -0,0 +1,83 @@
+"""
+SHA-256 bookkeeping that rides along with the bytes being downloaded and packaged.
+"""
+
+import hashlib
+import json
+from typing import Dict, Optional
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file on disk, for content that could not be hashed while it was written"""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class HashingReader:
+    """Read-only file wrapper hashing every byte tarfile reads from it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        chunk = self.fileobj.read(size)
+        self.sha256.update(chunk)
+        return chunk
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+class HashingWriter:
+    """Write-only file wrapper hashing every byte written through it"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def hexdigest(self) -> str:
+        return self.sha256.hexdigest()
+
+
+class ContentManifest:
+    """
+    SHA-256 and size of every file in a tarball, by its path inside the archive.
+
+    The content digest covers paths and file contents only, so the same dependency
+    packaged again, with other mtimes or another codec, gets the same digest.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, dict] = {}
+        self.tarball_sha256: Optional[str] = None
+
+    def add(self, arcname: str, sha256: str, size: int):
+        self.files[arcname] = {"sha256": sha256, "size": size}
+
+    @property
+    def content_sha256(self) -> str:
+        # sha256sum style lines, sorted so the digest does not depend on the packaging order
+        lines = "".join(f"{entry['sha256']}  {arcname}\n" for arcname, entry in sorted(self.files.items()))
+        return hashlib.sha256(lines.encode()).hexdigest()
+
+    def to_dict(self) -> dict:
+        return {
+            "content_sha256": self.content_sha256,
+            "tarball_sha256": self.tarball_sha256,
+            "files": self.files,
+        }
+
+    def write(self, path: str):
+        with open(path, "w") as manifest_file:
+            json.dump(self.to_dict(), manifest_file, indent=2, sort_keys=True)
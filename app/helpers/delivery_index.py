@@ -0,0 +1,74 @@
+"""
+Persisted index of the content hashes already delivered to NiFi.
+"""
+
+import json
+import os
+import time
+from typing import Optional
+
+
+class DeliveryIndex:
+    """
+    Remembers which content, by type and content SHA-256, was uploaded to which endpoint,
+    so byte-identical content is not uploaded again within UPLOAD_DEDUP_TTL_SECONDS.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("UPLOAD_DEDUP_ENABLED", "true").lower() == "true"
+        self.path = os.getenv("DELIVERY_INDEX_PATH", "/tmp/delivery-index.json")
+        # 0 keeps deliveries forever
+        self.ttl = float(os.getenv("UPLOAD_DEDUP_TTL_SECONDS", str(7 * 24 * 3600)))
+        self._entries = self._load() if self.enabled else {}
+
+    def lookup(self, endpoint: str, download_type: str, content_sha256: str) -> Optional[dict]:
+        """The earlier delivery of the content to endpoint, None if it was not delivered or expired"""
+        if not self.enabled:
+            return None
+        entry = self._entries.get(self._key(endpoint, download_type, content_sha256))
+        if entry is None or self._expired(entry):
+            return None
+        return dict(entry)
+
+    def record(self, endpoint: str, download_type: str, content_sha256: str, dependency: str):
+        if not self.enabled:
+            return
+        self._entries[self._key(endpoint, download_type, content_sha256)] = {
+            "dependency": dependency,
+            "delivered": time.time(),
+        }
+        self._entries = {key: entry for key, entry in self._entries.items() if not self._expired(entry)}
+        try:
+            self._save()
+        except OSError as e:
+            # The index only saves uploads, it must never fail the job
+            print(f"Error saving delivery index {self.path}: {e}")
+
+    def _key(self, endpoint: str, download_type: str, content_sha256: str) -> str:
+        return f"{endpoint} {download_type}:{content_sha256}"
+
+    def _expired(self, entry: dict) -> bool:
+        return bool(self.ttl) and time.time() - entry.get("delivered", 0) > self.ttl
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Delivery index {self.path} unreadable, starting empty: {e}")
+        return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        staging_path = f"{self.path}.tmp"
+        with open(staging_path, "w") as index_file:
+            json.dump(self._entries, index_file)
+        os.replace(staging_path, self.path)
+
+
+# Shared instance used by all processors
+delivery_index = DeliveryIndex()
@@ -0,0 +1,121 @@
+"""
+Disk-budget admission control for the processor temp directories.
+"""
+
+import asyncio
+import os
+import shutil
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from app.helpers.metrics import disk_reserved
+
+
+class Reservation:
+    """Disk space held by one admitted job"""
+
+    def __init__(self, download_type: str, size: int):
+        self.download_type = download_type
+        self.size = size
+
+
+class DiskBudget:
+    """
+    Admits a job only when its estimated disk usage fits next to the reservations of the
+    running jobs, keeping DISK_MIN_FREE_BYTES free on the temp file system.
+
+    Running jobs have written an unknown part of their reservation, so both the reservations
+    and the current free space are counted, which errs on the safe side. Jobs that do not fit
+    wait for running jobs to release their space and are handed back to the broker after
+    DISK_ADMISSION_WAIT seconds, instead of failing halfway with ENOSPC. A job whose estimate
+    exceeds the free space even with nothing else running is admitted alone after the wait,
+    since no release can make room for it.
+    """
+
+    # Fallback estimates per type when the processor cannot tell the size up front
+    DEFAULT_ESTIMATES = {
+        "DOCKER": 2 * 1024 ** 3,
+        "MAVEN": 200 * 1024 ** 2,
+        "PYTHON": 200 * 1024 ** 2,
+        "NPM": 100 * 1024 ** 2,
+        "FILE": 100 * 1024 ** 2,
+        "HELM": 100 * 1024 ** 2,
+        "WEBSITE": 20 * 1024 ** 2,
+    }
+
+    def __init__(self):
+        self.enabled = os.getenv("DISK_BUDGET_ENABLED", "true").lower() == "true"
+        self.path = os.getenv("DISK_BUDGET_PATH", "/tmp")
+        # Upper bound of all reservations together, 0 only checks the free space
+        self.budget_bytes = int(os.getenv("DISK_BUDGET_BYTES", "0"))
+        self.min_free_bytes = int(os.getenv("DISK_MIN_FREE_BYTES", str(1024 ** 3)))  # 1 GiB
+        self.admission_wait = float(os.getenv("DISK_ADMISSION_WAIT", "30"))
+        self.default_estimates: Dict[str, int] = {
+            download_type: int(os.getenv(f"DISK_ESTIMATE_{download_type}_BYTES", str(size)))
+            for download_type, size in self.DEFAULT_ESTIMATES.items()
+        }
+        self.reserved = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    async def admit(self, download_type: str, estimate: Optional[int],
+                    on_wait: Optional[Callable[[], Awaitable[None]]] = None) -> Optional[Reservation]:
+        """
+        Reserve the estimated bytes, waiting up to DISK_ADMISSION_WAIT for space to free up.
+
+        :param estimate: Expected peak disk usage of the job, None for the type's default.
+        :param on_wait: Awaited once when the job has to wait, e.g. to publish that it is deferred.
+        :return: The reservation to release when the job ends, None when the job does not fit.
+        """
+        size = estimate if estimate is not None else self.default_estimates.get(download_type, 0)
+        reservation = Reservation(download_type, size)
+        if not self.enabled:
+            return reservation
+
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        deadline = time.monotonic() + self.admission_wait
+        async with self._condition:
+            waiting = False
+            while not self._fits(size):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if self.reserved:
+                        return None
+                    print(f"Estimate of {size} bytes for a {download_type} job exceeds the free space, running it alone")
+                    break
+                if not waiting and on_wait is not None:
+                    waiting = True
+                    await on_wait()
+                try:
+                    # Space is also freed by cache eviction and other processes, so check again now and then
+                    await asyncio.wait_for(self._condition.wait(), timeout=min(remaining, 5))
+                except asyncio.TimeoutError:
+                    pass
+            self._reserve(reservation, 1)
+        return reservation
+
+    async def release(self, reservation: Reservation):
+        if not self.enabled or reservation is None:
+            return
+        self._reserve(reservation, -1)
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _reserve(self, reservation: Reservation, sign: int):
+        self.reserved += sign * reservation.size
+        disk_reserved.labels(reservation.download_type).inc(sign * reservation.size)
+
+    def _fits(self, size: int) -> bool:
+        # The budget caps concurrency, a single job larger than the budget may still run alone
+        if self.budget_bytes and self.reserved and self.reserved + size > self.budget_bytes:
+            return False
+        try:
+            free = shutil.disk_usage(self.path).free
+        except OSError as e:
+            print(f"Cannot check free space of {self.path}, admitting the job: {e}")
+            return True
+        return free - self.min_free_bytes - self.reserved >= size
+
+
+# Shared instance used by the download router
+disk_budget = DiskBudget()
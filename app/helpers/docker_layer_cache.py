@@ -0,0 +1,112 @@
+"""
+Docker layers kept across jobs, bounded by a disk budget instead of being removed after every job.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import List
+
+import docker
+
+from app.helpers.blob_cache import BlobCache
+
+
+class DockerImageCache:
+    """
+    Keeps images pulled through the Docker engine and evicts the least recently used ones
+    once the engine's layer storage exceeds max_bytes.
+
+    Only images pulled by this minion are ever removed; images in use by a running job are pinned.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "images.json")
+        self._images = {}
+        self._pinned = Counter()
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path) as index_file:
+                self._images = json.load(index_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Docker image cache index unreadable, starting empty: {e}")
+
+    def known_layers(self) -> set:
+        """Layer diff ids of every retained image"""
+        with self._lock:
+            return {layer for entry in self._images.values() for layer in entry["layers"]}
+
+    def pin(self, reference: str):
+        with self._lock:
+            self._pinned[reference] += 1
+
+    def unpin(self, reference: str):
+        with self._lock:
+            self._pinned[reference] -= 1
+            if self._pinned[reference] <= 0:
+                del self._pinned[reference]
+
+    def record(self, reference: str, image) -> List[str]:
+        """Remember a pulled image as recently used, returns its layer diff ids"""
+        layers = image.attrs.get("RootFS", {}).get("Layers", [])
+        with self._lock:
+            self._images[reference] = {"id": image.id, "layers": layers, "last_used": time.time()}
+            self._save()
+        return layers
+
+    def evict(self, client):
+        """Remove least recently used images until the engine fits the budget, to be run in thread pool"""
+        # Disk usage is expensive to compute for the engine, query it once and account removals locally
+        usage = client.df()
+        # The engine accounts shared layers only once, unlike the per-image sizes
+        layers_size = usage.get("LayersSize", 0)
+        # A removal frees the layers no other image shares, shared ones may stay behind
+        unique_sizes = {
+            image["Id"]: max(image.get("Size", 0) - max(image.get("SharedSize", 0), 0), 0)
+            for image in usage.get("Images") or []
+        }
+        while layers_size > self.max_bytes:
+            with self._lock:
+                candidates = sorted(
+                    (reference for reference in self._images if reference not in self._pinned),
+                    key=lambda reference: self._images[reference]["last_used"],
+                )
+            if not candidates:
+                return
+
+            reference = candidates[0]
+            image_id = self._images[reference]["id"]
+            try:
+                client.images.remove(reference)
+                print(f"Evicted Docker image {reference} from layer cache")
+            except docker.errors.ImageNotFound:
+                pass
+            except docker.errors.APIError as e:
+                # Most likely still referenced by a container or another tag, stop tracking it
+                print(f"Error evicting Docker image {reference}: {e}")
+            with self._lock:
+                self._images.pop(reference, None)
+                self._save()
+                # Removing one of several tags of an image frees nothing
+                if all(entry["id"] != image_id for entry in self._images.values()):
+                    layers_size -= unique_sizes.pop(image_id, 0)
+
+    def _save(self):
+        staging_path = f"{self.index_path}.tmp"
+        with open(staging_path, "w") as index_file:
+            json.dump(self._images, index_file)
+        os.replace(staging_path, self.index_path)
+
+
+layer_cache_dir = os.getenv("DOCKER_LAYER_CACHE_DIR", "/tmp/docker-layer-cache/")
+layer_cache_max_bytes = int(os.getenv("DOCKER_LAYER_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))  # 20 GiB
+
+# Registry backend: layer blobs hard linked into every job layout that needs them
+registry_layer_cache = BlobCache("Docker layer", layer_cache_dir, layer_cache_max_bytes)
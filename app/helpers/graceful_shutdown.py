@@ -0,0 +1,49 @@
+"""
+Draining of the running jobs when the minion is asked to stop.
+"""
+
+import asyncio
+import os
+from contextlib import contextmanager
+
+
+class GracefulShutdown:
+    """
+    Tracks the tasks running a job. On SIGTERM, FastStream runs the shutdown hooks before it
+    stops the broker, and drain() gives the jobs SHUTDOWN_GRACE_SECONDS to finish. Jobs still
+    running after that are cancelled while the channel is open, so their messages are requeued
+    and the redelivery resumes from the step journal.
+    """
+
+    def __init__(self):
+        self.grace = float(os.getenv("SHUTDOWN_GRACE_SECONDS", "25"))
+        self.draining = False
+        self._tasks = set()
+
+    @contextmanager
+    def track(self):
+        """Register the current task as running a job"""
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            yield
+        finally:
+            self._tasks.discard(task)
+
+    async def drain(self):
+        self.draining = True
+        running = set(self._tasks)
+        if not running:
+            return
+        print(f"Shutting down, waiting up to {self.grace}s for {len(running)} running job(s)")
+        _, pending = await asyncio.wait(running, timeout=self.grace)
+        if pending:
+            print(f"Cancelling {len(pending)} job(s) still running, they resume after redelivery")
+            for task in pending:
+                task.cancel()
+            # Give the cancelled jobs a moment to requeue their messages and keep their workspaces
+            await asyncio.wait(pending, timeout=5)
+
+
+# Shared instance used by the download router and the application shutdown
+graceful_shutdown = GracefulShutdown()
@@ -0,0 +1,53 @@
+"""
+Persisted per-index state used to mirror Helm repositories incrementally.
+"""
+
+import copy
+import hashlib
+import json
+import os
+
+
+class HelmSyncState:
+    """
+    Remembers, per index URL and version selection, the index validators (ETag/Last-Modified)
+    and the digest of every chart version that was already delivered.
+    """
+
+    def __init__(self):
+        self.state_dir = os.getenv("HELM_SYNC_STATE_DIR", "/tmp/helm-sync-state/")
+        if not os.path.exists(self.state_dir):
+            os.makedirs(self.state_dir)
+
+    def state_key(self, index_url: str, selection: dict) -> str:
+        """Different version selections of the same index are tracked separately"""
+        raw = json.dumps({"index_url": index_url, "selection": selection}, sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def load(self, key: str, index_url: str) -> dict:
+        try:
+            with open(self._path(key)) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Helm sync state for {index_url} unreadable, doing a full sync: {e}")
+        return {"index_url": index_url, "etag": None, "last_modified": None, "charts": {}}
+
+    def save(self, key: str, state: dict):
+        staging_path = f"{self._path(key)}.tmp"
+        with open(staging_path, "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(staging_path, self._path(key))
+
+    def merged(self, state: dict, delivered: dict, etag=None, last_modified=None) -> dict:
+        """Return a copy of state with the delivered chart digests and new index validators"""
+        new_state = copy.deepcopy(state)
+        new_state["etag"] = etag
+        new_state["last_modified"] = last_modified
+        for chart_name, versions in delivered.items():
+            new_state["charts"].setdefault(chart_name, {}).update(versions)
+        return new_state
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.state_dir, f"{key}.json")
@@ -0,0 +1,57 @@
+"""
+Application-scoped HTTP client shared by the processors and the NiFi uploader.
+"""
+
+import os
+from typing import Optional
+
+import aiohttp
+
+
+class HttpClient:
+    """Owns a single pooled aiohttp session so connections are reused across jobs"""
+
+    def __init__(self):
+        self.limit = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+        self.limit_per_host = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+        self.dns_cache_ttl = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+        self.keepalive_timeout = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        """Create the pooled session, called from the application startup hook"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        print(f"HTTP client started (limit={self.limit}, limit_per_host={self.limit_per_host})")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it lazily when used outside the app lifecycle"""
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        # No session-wide timeout, callers pass one per request
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None)
+        )
+
+    async def close(self):
+        """Close the pooled session, called from the application shutdown hook"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            print("HTTP client closed")
+        self._session = None
+
+
+# Shared instance used across the application
+http_client = HttpClient()
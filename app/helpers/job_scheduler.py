@@ -0,0 +1,84 @@
+"""
+Per-type concurrency limits for download jobs.
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class JobScheduler:
+    """
+    Gives every download type its own pool of worker slots, so slow ecosystems
+    (Docker pulls, website renders) cannot starve quick FILE or PYTHON jobs.
+    """
+
+    # Default concurrent jobs per type, overridable with SCHEDULER_<TYPE>_CONCURRENCY
+    DEFAULT_LIMITS = {
+        "DOCKER": 2,
+        "MAVEN": 4,
+        "PYTHON": 4,
+        "NPM": 4,
+        "FILE": 8,
+        "HELM": 2,
+        "WEBSITE": 2,
+    }
+
+    def __init__(self):
+        self.limits: Dict[str, int] = {
+            download_type: int(os.getenv(f"SCHEDULER_{download_type}_CONCURRENCY", str(limit)))
+            for download_type, limit in self.DEFAULT_LIMITS.items()
+        }
+        # Jobs of a type that may wait locally for a slot, beyond that they go back to the broker
+        self.max_queued: Dict[str, int] = {
+            download_type: int(os.getenv(f"SCHEDULER_{download_type}_MAX_QUEUED", str(limit)))
+            for download_type, limit in self.limits.items()
+        }
+        self.requeue_delay = float(os.getenv("SCHEDULER_REQUEUE_DELAY", "1"))
+        self.in_flight: Dict[str, int] = {download_type: 0 for download_type in self.limits}
+        self.queued: Dict[str, int] = {download_type: 0 for download_type in self.limits}
+        self._semaphores = {
+            download_type: asyncio.Semaphore(limit) for download_type, limit in self.limits.items()
+        }
+
+    @property
+    def prefetch_count(self) -> int:
+        """RabbitMQ prefetch that lets every type fill its slots and local queue"""
+        default = sum(self.limits[t] + self.max_queued[t] for t in self.limits)
+        return int(os.getenv("RABBITMQ_PREFETCH_COUNT", str(default)))
+
+    def is_saturated(self, download_type: str) -> bool:
+        """True when all slots of the type are busy and its local queue is full"""
+        return (
+            self.in_flight[download_type] >= self.limits[download_type]
+            and self.queued[download_type] >= self.max_queued[download_type]
+        )
+
+    @asynccontextmanager
+    async def slot(self, download_type: str):
+        """Wait for a free slot of the given type and hold it for the duration of the job"""
+        semaphore = self._semaphores[download_type]
+        self.queued[download_type] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.queued[download_type] -= 1
+
+        self.in_flight[download_type] += 1
+        try:
+            yield
+        finally:
+            self.in_flight[download_type] -= 1
+            semaphore.release()
+
+    def gauges(self) -> Dict[str, Dict[str, int]]:
+        """Snapshot of in-flight and queued jobs per type"""
+        return {
+            download_type: {
+                "in_flight": self.in_flight[download_type],
+                "queued": self.queued[download_type],
+                "limit": self.limits[download_type],
+            }
+            for download_type in self.limits
+        }
@@ -0,0 +1,493 @@
+"""
+In-process Maven dependency resolver writing a local repository layout.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import uuid
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+
+from app.helpers.http_client import http_client
+
+# Scopes that make it into the runtime classpath, and what a transitive scope becomes
+RUNTIME_SCOPES = ("compile", "runtime")
+
+# File extension of the artifact for dependency types that differ from their extension
+TYPE_EXTENSIONS = {
+    "bundle": "jar",
+    "maven-plugin": "jar",
+    "ejb": "jar",
+    "ejb-client": "jar",
+    "test-jar": "jar",
+    "java-source": "jar",
+    "javadoc": "jar",
+}
+TYPE_CLASSIFIERS = {"test-jar": "tests", "ejb-client": "client", "java-source": "sources", "javadoc": "javadoc"}
+
+PROPERTY_REFERENCE = re.compile(r"\$\{([^}]+)\}")
+
+
+class ArtifactNotFoundError(Exception):
+    """Raised when the requested artifact does not exist in the repository."""
+    pass
+
+
+class ResolutionError(Exception):
+    """Raised when the dependency graph cannot be resolved."""
+    pass
+
+
+class PomModel:
+    """The parts of an effective POM needed for dependency resolution"""
+
+    def __init__(self, group_id: str, artifact_id: str, version: str):
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.packaging = "jar"
+        self.properties: Dict[str, str] = {}
+        # (groupId, artifactId, type, classifier) -> managed dependency
+        self.managed: Dict[tuple, dict] = {}
+        self.dependencies: List[dict] = []
+        self.relocation: Optional[Tuple[str, str, str]] = None
+        # Declarations including the inherited ones, interpolated by every child with its own properties
+        self.managed_elements: list = []
+        self.dependency_elements: list = []
+
+
+class MavenResolver:
+    """
+    Resolves the runtime closure of an artifact with Maven semantics: parent POMs,
+    imported BOMs, dependencyManagement, exclusions, optional dependencies and
+    nearest-wins version mediation. POMs and artifacts are fetched concurrently.
+
+    The repository may be remote (http, https) or a directory (file://). When a shared
+    local repository is given, files found there are hard linked instead of downloaded
+    and new downloads are added to it.
+    """
+
+    def __init__(self, repository_url: str, local_repository: Optional[str] = None, max_concurrent: int = 8):
+        self.repository_url = repository_url.rstrip("/") + "/"
+        self.local_repository = local_repository
+        self.max_concurrent = max_concurrent
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+
+    async def resolve(self, group_id: str, artifact_id: str, version: str, destination: str) -> int:
+        """
+        Resolve the artifact and its runtime dependencies into destination.
+
+        :return: Number of artifacts written, not counting parent and BOM POMs.
+        """
+        # Per resolution, concurrent jobs share the resolver instance
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        models: Dict[tuple, asyncio.Future] = {}
+        # POMs read during resolution, written out with the artifacts
+        exported_poms: Dict[str, bytes] = {}
+
+        root = (group_id, artifact_id, version)
+        if self._is_range(version):
+            root = (group_id, artifact_id, await self._resolve_range(group_id, artifact_id, version, semaphore))
+        root_model = await self._model(root, models, exported_poms, semaphore, required=True)
+        if root_model.relocation:
+            root_model = await self._model(root_model.relocation, models, exported_poms, semaphore, required=True)
+
+        root_node = {
+            "groupId": root_model.group_id, "artifactId": root_model.artifact_id, "version": root_model.version,
+            "type": root_model.packaging, "classifier": None,
+        }
+        selected = {(root_model.group_id, root_model.artifact_id): root_node}
+        level = [(root_node, root_model, frozenset())]
+
+        # Breadth first, so the first version seen of an artifact is the nearest one
+        while level:
+            candidates = []
+            for node, model, exclusions in level:
+                for dependency in model.dependencies:
+                    key = (dependency["groupId"], dependency["artifactId"])
+                    if (dependency["scope"] not in RUNTIME_SCOPES or dependency["optional"]
+                            or key in selected or self._is_excluded(key, exclusions)):
+                        continue
+                    selected[key] = dependency
+                    candidates.append((dependency, exclusions | dependency["exclusions"]))
+
+            next_models = await asyncio.gather(*(
+                self._model(self._coordinate(dependency), models, exported_poms, semaphore, required=False)
+                for dependency, _ in candidates
+            ))
+            level = []
+            for (dependency, exclusions), model in zip(candidates, next_models):
+                if model is not None and model.relocation:
+                    model = await self._model(model.relocation, models, exported_poms, semaphore, required=False)
+                    if model is not None:
+                        dependency.update(groupId=model.group_id, artifactId=model.artifact_id, version=model.version)
+                if model is not None:
+                    if self._is_range(dependency["version"]):
+                        dependency["version"] = model.version
+                    level.append((dependency, model, exclusions))
+
+        await asyncio.gather(*(self._fetch_artifact(node, destination, semaphore) for node in selected.values()))
+        for path, content in exported_poms.items():
+            self._write_file(content, os.path.join(destination, path))
+        return len(selected)
+
+    def _coordinate(self, dependency: dict) -> Tuple[str, str, str]:
+        return dependency["groupId"], dependency["artifactId"], dependency["version"]
+
+    def _is_excluded(self, key, exclusions) -> bool:
+        group_id, artifact_id = key
+        return any(
+            (pattern_group in ("*", group_id)) and (pattern_artifact in ("*", artifact_id))
+            for pattern_group, pattern_artifact in exclusions
+        )
+
+    async def _model(self, coordinate, models, exported_poms, semaphore, required: bool) -> Optional[PomModel]:
+        """Effective model of a POM, every POM is loaded once per resolution"""
+        if coordinate not in models:
+            models[coordinate] = asyncio.ensure_future(self._load_model(coordinate, models, exported_poms, semaphore))
+        try:
+            return await asyncio.shield(models[coordinate])
+        except ArtifactNotFoundError:
+            if required:
+                raise
+            # Maven carries on without the dependencies of an artifact whose POM is missing
+            print(f"The POM for {':'.join(coordinate)} is missing, no dependency information available")
+            return None
+
+    async def _load_model(self, coordinate, models, exported_poms, semaphore) -> PomModel:
+        group_id, artifact_id, version = coordinate
+        if self._is_range(version):
+            version = await self._resolve_range(group_id, artifact_id, version, semaphore)
+        pom_path = self._artifact_path(group_id, artifact_id, version, "pom")
+        content = await self._read_file(pom_path, semaphore)
+        if content is None:
+            raise ArtifactNotFoundError(f"Maven artifact {group_id}:{artifact_id}:{version} does not exist")
+        exported_poms[pom_path] = content
+
+        try:
+            root = ElementTree.fromstring(content)
+        except ElementTree.ParseError as e:
+            raise ResolutionError(f"Invalid POM {pom_path}: {str(e)}")
+        for element in root.iter():
+            # Namespaces are irrelevant for POMs, strip them once
+            if isinstance(element.tag, str) and element.tag.startswith("{"):
+                element.tag = element.tag.split("}", 1)[1]
+
+        parent = None
+        parent_element = root.find("parent")
+        if parent_element is not None:
+            parent_coordinate = (
+                _text(parent_element, "groupId"), _text(parent_element, "artifactId"), _text(parent_element, "version")
+            )
+            parent = await self._model(parent_coordinate, models, exported_poms, semaphore, required=True)
+
+        model = PomModel(
+            _text(root, "groupId") or (parent.group_id if parent else group_id),
+            _text(root, "artifactId") or artifact_id,
+            _text(root, "version") or (parent.version if parent else version),
+        )
+        model.packaging = _text(root, "packaging") or "jar"
+
+        # Inheritance: parent values first, the child overrides them
+        if parent is not None:
+            model.properties.update(parent.properties)
+        properties_element = root.find("properties")
+        if properties_element is not None:
+            for prop in properties_element:
+                if isinstance(prop.tag, str):
+                    model.properties[prop.tag] = (prop.text or "").strip()
+        model.properties.update({
+            "project.groupId": model.group_id,
+            "project.artifactId": model.artifact_id,
+            "project.version": model.version,
+            "pom.groupId": model.group_id,
+            "pom.version": model.version,
+            "version": model.version,
+        })
+        if parent is not None:
+            model.properties.update({
+                "project.parent.groupId": parent.group_id,
+                "project.parent.version": parent.version,
+            })
+
+        relocation = root.find("distributionManagement/relocation")
+        if relocation is not None:
+            model.relocation = (
+                self._interpolate(_text(relocation, "groupId"), model) or model.group_id,
+                self._interpolate(_text(relocation, "artifactId"), model) or model.artifact_id,
+                self._interpolate(_text(relocation, "version"), model) or model.version,
+            )
+
+        # As in Maven, inherited declarations are interpolated with the properties of the effective POM,
+        # so a child overriding a property changes the versions its parent manages
+        inherited_managed = parent.managed_elements if parent is not None else []
+        inherited_dependencies = parent.dependency_elements if parent is not None else []
+        model.managed_elements = inherited_managed + root.findall("dependencyManagement/dependencies/dependency")
+        model.dependency_elements = inherited_dependencies + root.findall("dependencies/dependency")
+
+        own_managed = {}
+        imports = []
+        for element in model.managed_elements:
+            dependency = self._dependency(element, model)
+            if dependency["scope"] == "import" and dependency["type"] == "pom":
+                imports.append(self._coordinate(dependency))
+            else:
+                own_managed[self._managed_key(dependency)] = dependency
+        imported_models = await asyncio.gather(*(
+            self._model(bom, models, exported_poms, semaphore, required=True) for bom in imports
+        ))
+        # Declared entries win over imported ones, the first import wins among imports
+        for bom in reversed(imported_models):
+            model.managed.update(bom.managed)
+        model.managed.update(own_managed)
+
+        dependencies = [self._dependency(element, model) for element in model.dependency_elements]
+        for dependency in dependencies:
+            self._apply_management(dependency, model)
+            if not dependency["version"]:
+                raise ResolutionError(
+                    f"No version for {dependency['groupId']}:{dependency['artifactId']} in {':'.join(coordinate)}"
+                )
+        model.dependencies = dependencies
+        return model
+
+    def _dependency(self, element, model: PomModel) -> dict:
+        exclusions = frozenset(
+            (self._interpolate(_text(exclusion, "groupId"), model) or "*",
+             self._interpolate(_text(exclusion, "artifactId"), model) or "*")
+            for exclusion in element.findall("exclusions/exclusion")
+        )
+        return {
+            "groupId": self._interpolate(_text(element, "groupId"), model),
+            "artifactId": self._interpolate(_text(element, "artifactId"), model),
+            "version": self._interpolate(_text(element, "version"), model),
+            "type": self._interpolate(_text(element, "type"), model) or "jar",
+            "classifier": self._interpolate(_text(element, "classifier"), model),
+            "scope": self._interpolate(_text(element, "scope"), model),
+            "optional": (self._interpolate(_text(element, "optional"), model) or "false").lower() == "true",
+            "exclusions": exclusions,
+        }
+
+    def _managed_key(self, dependency: dict) -> tuple:
+        return dependency["groupId"], dependency["artifactId"], dependency["type"], dependency["classifier"]
+
+    def _apply_management(self, dependency: dict, model: PomModel):
+        managed = model.managed.get(self._managed_key(dependency))
+        if managed is not None:
+            dependency["version"] = dependency["version"] or managed["version"]
+            dependency["scope"] = dependency["scope"] or managed["scope"]
+            dependency["exclusions"] = dependency["exclusions"] | managed["exclusions"]
+        dependency["scope"] = dependency["scope"] or "compile"
+
+    def _interpolate(self, value: Optional[str], model: PomModel) -> Optional[str]:
+        if not value:
+            return value
+        for _ in range(10):
+            interpolated = PROPERTY_REFERENCE.sub(lambda m: model.properties.get(m.group(1), m.group(0)), value)
+            if interpolated == value:
+                break
+            value = interpolated
+        return value
+
+    def _is_range(self, version: str) -> bool:
+        return bool(version) and version[0] in "[("
+
+    async def _resolve_range(self, group_id: str, artifact_id: str, version_range: str, semaphore) -> str:
+        """Highest released version within a range such as [1.0,2.0) from maven-metadata.xml"""
+        metadata_path = f"{group_id.replace('.', '/')}/{artifact_id}/maven-metadata.xml"
+        content = await self._read_file(metadata_path, semaphore)
+        if content is None:
+            raise ArtifactNotFoundError(f"No versions of {group_id}:{artifact_id} found for {version_range}")
+        versions = [element.text.strip() for element in ElementTree.fromstring(content).iter("version") if element.text]
+        matching = [version for version in versions if _in_range(version, version_range)]
+        if not matching:
+            raise ArtifactNotFoundError(f"No version of {group_id}:{artifact_id} matches {version_range}")
+        return max(matching, key=_version_key)
+
+    async def _fetch_artifact(self, node: dict, destination: str, semaphore):
+        """Fetch the artifact file of a selected dependency, POM-only packaging has none"""
+        dependency_type = node["type"]
+        if dependency_type == "pom":
+            return
+        extension = TYPE_EXTENSIONS.get(dependency_type, dependency_type)
+        classifier = node["classifier"] or TYPE_CLASSIFIERS.get(dependency_type)
+        path = self._artifact_path(node["groupId"], node["artifactId"], node["version"], extension, classifier)
+        if not await self._fetch_file(path, destination, semaphore):
+            raise ResolutionError(f"Could not find artifact {node['groupId']}:{node['artifactId']}:{node['version']}")
+
+    def _artifact_path(self, group_id, artifact_id, version, extension, classifier=None) -> str:
+        suffix = f"-{classifier}" if classifier else ""
+        return f"{group_id.replace('.', '/')}/{artifact_id}/{version}/{artifact_id}-{version}{suffix}.{extension}"
+
+    async def _read_file(self, path: str, semaphore) -> Optional[bytes]:
+        """Content of a repository file, from the shared local repository when present"""
+        if self._is_cacheable(path):
+            local_path = os.path.join(self.local_repository, path)
+            if not os.path.exists(local_path):
+                if not await self._download(path, local_path, semaphore):
+                    return None
+            with open(local_path, "rb") as local_file:
+                return local_file.read()
+        async with semaphore:
+            return await self._get(await self._remote_path(path))
+
+    def _is_cacheable(self, path: str) -> bool:
+        """Released files never change, snapshots and metadata must be fetched again"""
+        return bool(self.local_repository) and "-SNAPSHOT/" not in path and not path.endswith("maven-metadata.xml")
+
+    async def _remote_path(self, path: str) -> str:
+        """Remote repositories store snapshots under timestamped names, listed in the version metadata"""
+        version_dir, file_name = path.rsplit("/", 1)
+        version = version_dir.rsplit("/", 1)[-1]
+        if not version.endswith("-SNAPSHOT"):
+            return path
+        content = await self._get(f"{version_dir}/maven-metadata.xml")
+        if content is None:
+            return path
+        snapshot = ElementTree.fromstring(content).find("versioning/snapshot")
+        timestamp, build_number = _text(snapshot, "timestamp"), _text(snapshot, "buildNumber")
+        if not timestamp or not build_number:
+            return path
+        unique_version = version.replace("SNAPSHOT", f"{timestamp}-{build_number}")
+        return f"{version_dir}/{file_name.replace(version, unique_version, 1)}"
+
+    async def _fetch_file(self, path: str, destination: str, semaphore) -> bool:
+        """Place the repository file under destination, keeping the repository layout"""
+        target = os.path.join(destination, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if self._is_cacheable(path):
+            local_path = os.path.join(self.local_repository, path)
+            if not os.path.exists(local_path) and not await self._download(path, local_path, semaphore):
+                return False
+            if not os.path.exists(target):
+                try:
+                    os.link(local_path, target)
+                except OSError:
+                    shutil.copyfile(local_path, target)
+            return True
+        return os.path.exists(target) or await self._download(path, target, semaphore)
+
+    async def _download(self, path: str, target: str, semaphore) -> bool:
+        """Stream a repository file to target atomically, verifying artifacts against their SHA-1 when available"""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging_path = f"{target}.{uuid.uuid4().hex}.part"
+        try:
+            async with semaphore:
+                remote_path = await self._remote_path(path)
+                digest = await self._get_to_file(remote_path, staging_path)
+                if digest is None:
+                    return False
+                # POMs are validated by parsing them, which saves a request per POM
+                checksum = None if path.endswith(".pom") else await self._get(f"{remote_path}.sha1")
+            if checksum and checksum.strip() and checksum.decode(errors="replace").split()[0].lower() != digest:
+                raise ResolutionError(f"Checksum mismatch for {path}")
+            os.replace(staging_path, target)
+            return True
+        finally:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    async def _get_to_file(self, path: str, target: str) -> Optional[str]:
+        """Repository GET streamed into target, returns the SHA-1 or None when the file does not exist"""
+        url = self.repository_url + path
+        sha1 = hashlib.sha1()
+        if url.startswith("file://"):
+            content = await self._get(path)
+            if content is None:
+                return None
+            sha1.update(content)
+            with open(target, "wb") as target_file:
+                target_file.write(content)
+            return sha1.hexdigest()
+
+        async with http_client.session.get(url, timeout=self.timeout) as response:
+            if response.status == 404:
+                return None
+            if response.status != 200:
+                raise ResolutionError(f"Error fetching {url}: HTTP {response.status}")
+            with open(target, "wb") as target_file:
+                async for chunk in response.content.iter_chunked(1024 * 1024):
+                    sha1.update(chunk)
+                    target_file.write(chunk)
+        return sha1.hexdigest()
+
+    def _write_file(self, content: bytes, target: str):
+        """Write atomically, concurrent jobs may share the local repository"""
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staging_path = f"{target}.{uuid.uuid4().hex}.part"
+        with open(staging_path, "wb") as staging_file:
+            staging_file.write(content)
+        os.replace(staging_path, target)
+
+    async def _get(self, path: str) -> Optional[bytes]:
+        """Raw repository GET, None when the file does not exist"""
+        url = self.repository_url + path
+        if url.startswith("file://"):
+            file_path = unquote(urlparse(url).path)
+            if not os.path.isfile(file_path):
+                return None
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, _read_bytes, file_path)
+
+        async with http_client.session.get(url, timeout=self.timeout) as response:
+            if response.status == 404:
+                return None
+            if response.status != 200:
+                raise ResolutionError(f"Error fetching {url}: HTTP {response.status}")
+            return await response.read()
+
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as source:
+        return source.read()
+
+
+def _text(element, name: str) -> Optional[str]:
+    child = element.find(name) if element is not None else None
+    return child.text.strip() if child is not None and child.text else None
+
+
+_QUALIFIERS = {"alpha": 1, "a": 1, "beta": 2, "b": 2, "milestone": 3, "m": 3, "rc": 4, "cr": 4,
+               "snapshot": 5, "": 6, "ga": 6, "final": 6, "release": 6, "sp": 7}
+
+
+def _version_key(version: str) -> tuple:
+    """Sort key approximating Maven's ComparableVersion"""
+    match = re.match(r"^(\d+(?:\.\d+)*)(.*)$", version.strip().lower())
+    numbers, qualifier = (match.group(1).split("."), match.group(2)) if match else ([], version.lower())
+    # Trailing zeros do not change the version: 1.0 == 1 == 1.0.0
+    while numbers and int(numbers[-1]) == 0:
+        numbers.pop()
+    key = [(2, int(number), "") for number in numbers]
+    for token in re.findall(r"\d+|[a-z]+", qualifier):
+        if token.isdigit():
+            key.append((2, int(token), ""))
+        elif _QUALIFIERS.get(token) != 6:
+            # Unknown qualifiers sort after the known ones, alphabetically
+            key.append((1, _QUALIFIERS.get(token, 8), token))
+    # A release sorts after its pre-releases and before its service packs
+    return tuple(key) + ((1, 6, ""),)
+
+
+def _in_range(version: str, version_range: str) -> bool:
+    """Whether version lies in a Maven range spec, which may join several ranges with commas"""
+    key = _version_key(version)
+    for lower_bracket, bounds, upper_bracket in re.findall(r"([\[(])([^\])]*)([\])])", version_range):
+        if "," not in bounds:
+            # [1.5] pins a single version
+            if key == _version_key(bounds):
+                return True
+            continue
+        lower, upper = (bound.strip() for bound in bounds.split(",", 1))
+        if lower and (key < _version_key(lower) or (lower_bracket == "(" and key == _version_key(lower))):
+            continue
+        if upper and (key > _version_key(upper) or (upper_bracket == ")" and key == _version_key(upper))):
+            continue
+        return True
+    return False
@@ -0,0 +1,99 @@
+"""
+Prometheus metrics of the download pipeline, served on a small local HTTP port.
+"""
+
+import os
+import shutil
+from datetime import datetime
+from typing import Dict
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from app.models.hyperloop_download import HyperloopDownload
+
+# Jobs range from sub-second FILE downloads to hour-long Docker bundles
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+step_duration = Histogram(
+    "hyperloop_step_duration_seconds",
+    "Duration of the pipeline steps",
+    ["type", "step"],
+    buckets=DURATION_BUCKETS,
+)
+transferred_bytes = Counter(
+    "hyperloop_bytes",
+    "Bytes downloaded from upstream, packaged into tarballs, uploaded to NiFi or skipped as already delivered",
+    ["type", "direction"],
+)
+jobs_in_flight = Gauge(
+    "hyperloop_jobs_in_flight",
+    "Jobs holding a worker slot",
+    ["type"],
+)
+messages = Counter(
+    "hyperloop_messages",
+    "Download request messages by how they were settled",
+    ["type", "outcome"],
+)
+disk_reserved = Gauge(
+    "hyperloop_disk_reserved_bytes",
+    "Disk space reserved by admitted jobs",
+    ["type"],
+)
+request_latency = Histogram(
+    "hyperloop_request_latency_seconds",
+    "Time from the request date to its final status",
+    ["type", "status"],
+    buckets=DURATION_BUCKETS,
+)
+
+
+class TempDirCollector:
+    """Reports the bytes in the processor temp directories and the space left on their file systems at scrape time"""
+
+    def __init__(self):
+        self.temp_dirs: Dict[str, str] = {}
+
+    def collect(self):
+        used = GaugeMetricFamily("hyperloop_temp_dir_bytes", "Bytes in the temp directory of a processor", labels=["type"])
+        free = GaugeMetricFamily("hyperloop_temp_fs_free_bytes", "Free bytes on the file system of a temp directory", labels=["type"])
+        for download_type, temp_dir in sorted(self.temp_dirs.items()):
+            used.add_metric([download_type], _directory_size(temp_dir))
+            try:
+                free.add_metric([download_type], shutil.disk_usage(temp_dir).free)
+            except OSError:
+                pass
+        yield used
+        yield free
+
+
+def _directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # Jobs remove their files while we walk
+                pass
+    return total
+
+
+temp_dir_collector = TempDirCollector()
+REGISTRY.register(temp_dir_collector)
+
+
+def observe_completion(download: HyperloopDownload, status: str):
+    """Record the end-to-end latency of a request that reached its final status"""
+    date = download.date
+    now = datetime.now(date.tzinfo) if date.tzinfo else datetime.now()
+    request_latency.labels(download.type, status).observe(max((now - date).total_seconds(), 0.0))
+
+
+def start_metrics_server():
+    """Serve /metrics on METRICS_PORT, 0 disables the endpoint"""
+    port = int(os.getenv("METRICS_PORT", "9102"))
+    if port:
+        start_http_server(port, addr=os.getenv("METRICS_ADDR", "0.0.0.0"))
+        print(f"Metrics served on port {port}")
@@ -1,52 +1,110 @@
+import io
 import os
 import asyncio
+from typing import AsyncIterable, Callable, Optional
 from fastapi import Response
 import aiohttp
 import requests
 
+from app.helpers.http_client import http_client
 from app.models.hyperloop_download import HyperloopDownload
 
+class _CountingReader(io.BufferedReader):
+    """File reader reporting every chunk aiohttp reads for the upload"""
+
+    def __init__(self, path: str, on_chunk: Callable[[int], None]):
+        super().__init__(io.FileIO(path, "rb"))
+        self.on_chunk = on_chunk
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.on_chunk(len(chunk))
+        return chunk
+
+
+async def _counting_stream(chunks: AsyncIterable[bytes], on_chunk: Callable[[int], None]):
+    async for chunk in chunks:
+        on_chunk(len(chunk))
+        yield chunk
+
+
 class NiFiUploader:
     def __init__(self):
         self.endpoint_url = os.getenv("NIFI_LISTEN_HTTP_ENDPONT", "http://localhost:9099/hyperloop")
 
-    async def send_tarball(self, tarball_path: str, dependency: HyperloopDownload) -> Response:
+    async def send_tarball(self, tarball_path: str, dependency: HyperloopDownload,
+                           on_chunk: Optional[Callable[[int], None]] = None) -> Response:
         """
         Sends the tarball to the HTTP endpoint with the specified dependency and type as headers.
-        
+
         :param tarball_path: Path to the tarball file to be sent.
         :param dependency: Dependency information to be sent in the headers.
+        :param on_chunk: Optional callback receiving the size of every chunk sent.
+        :return: Response object from the HTTP request.
+        """
+        print(f"Sending tarball {tarball_path} to {self.endpoint_url}")
+
+        with (_CountingReader(tarball_path, on_chunk) if on_chunk else open(tarball_path, "rb")) as tarball:
+            return await self._post(
+                tarball, os.path.basename(tarball_path), dependency, getattr(dependency, "tarball_sha256", None)
+            )
+
+    async def send_stream(self, chunks: AsyncIterable[bytes], filename: str, dependency: HyperloopDownload,
+                          on_chunk: Optional[Callable[[int], None]] = None) -> Response:
+        """
+        Sends a tarball that is still being produced, reading it chunk by chunk from an async iterable.
+
+        :param chunks: Async iterable yielding the tarball bytes.
+        :param filename: File name reported for the uploaded tarball.
+        :param dependency: Dependency information to be sent in the headers.
+        :param on_chunk: Optional callback receiving the size of every chunk sent.
         :return: Response object from the HTTP request.
         """
+        print(f"Streaming tarball {filename} to {self.endpoint_url}")
+        if on_chunk:
+            chunks = _counting_stream(chunks, on_chunk)
+        # The tarball digest of a stream is only known after its last byte, past the headers
+        return await self._post(chunks, filename, dependency)
+
+    async def _post(self, content, filename: str, dependency: HyperloopDownload,
+                    tarball_sha256: Optional[str] = None) -> Response:
+        """Post the tarball content as a multipart upload"""
         headers = {
             "hyperloop.dependency": dependency.dependency,
-            "hyperloop.type": dependency.type
+            "hyperloop.type": dependency.type,
+            # Compression of the tarball: none, gzip or zstd
+            "hyperloop.codec": getattr(dependency, "codec", "none")
         }
-        print(f"Sending tarball {tarball_path} to {self.endpoint_url} with headers: {headers}")
+        # Digest of the packaged files, independent of codec and mtimes, and of the uploaded bytes
+        content_sha256 = getattr(dependency, "content_sha256", None)
+        if content_sha256:
+            headers["hyperloop.content.sha256"] = content_sha256
+        if tarball_sha256:
+            headers["hyperloop.tarball.sha256"] = tarball_sha256
+        print(f"Uploading {filename} with headers: {headers}")
 
         try:
             timeout = aiohttp.ClientTimeout(total=600)  # 10 minute timeout for large files
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                with open(tarball_path, "rb") as tarball:
-                    filename = os.path.basename(tarball_path)
-                    data = aiohttp.FormData()
-                    data.add_field('file', tarball, filename=filename)
-                    
-                    async with session.post(self.endpoint_url, headers=headers, data=data) as response:
-                        response_text = await response.text()
-                        
-                        # Create a mock response object similar to requests.Response
-                        mock_response = type('MockResponse', (), {
-                            'status_code': response.status,
-                            'text': response_text
-                        })()
-
-                        if response.status == 200:
-                            print(f"Tarball {tarball_path} sent successfully!")
-                            return mock_response
-                        else:
-                            print(f"Failed to send tarball: {response.status}, {response_text}")
-                            return mock_response
+            data = aiohttp.FormData()
+            data.add_field('file', content, filename=filename)
+
+            async with http_client.session.post(
+                self.endpoint_url, headers=headers, data=data, timeout=timeout
+            ) as response:
+                response_text = await response.text()
+
+                # Create a mock response object similar to requests.Response
+                mock_response = type('MockResponse', (), {
+                    'status_code': response.status,
+                    'text': response_text
+                })()
+
+                if response.status == 200:
+                    print(f"Tarball {filename} sent successfully!")
+                    return mock_response
+                else:
+                    print(f"Failed to send tarball: {response.status}, {response_text}")
+                    return mock_response
         except Exception as e:
             print(f"Error sending tarball: {e}")
-            raise
\ No newline at end of file
+            raise
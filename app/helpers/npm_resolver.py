@@ -0,0 +1,317 @@
+"""
+In-process npm dependency tree resolver fetching every tarball of a package's production tree.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import aiohttp
+
+from app.helpers.http_client import http_client
+from app.helpers.semver import Version, VersionRange
+
+# Abbreviated packuments carry everything needed for installs at a fraction of the size
+PACKUMENT_ACCEPT = "application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8, */*"
+
+
+class PackageNotFoundError(Exception):
+    """Raised when the requested package or version does not exist in the registry."""
+    pass
+
+
+class ResolutionError(Exception):
+    """Raised when the dependency tree cannot be resolved or a tarball is corrupt."""
+    pass
+
+
+def parse_spec(spec: str) -> Tuple[str, str]:
+    """Split name@range, the leading @ of scoped packages is part of the name"""
+    spec = spec.strip()
+    at = spec.find("@", 1)
+    if at == -1:
+        return spec, "latest"
+    return spec[:at], spec[at + 1:] or "latest"
+
+
+def tarball_file_name(name: str, version: str) -> str:
+    """File name as npm pack writes it, e.g. @types/node 20.1.0 -> types-node-20.1.0.tgz"""
+    return f"{name.lstrip('@').replace('/', '-')}-{version}.tgz"
+
+
+class NpmResolver:
+    """
+    Resolves the production dependency tree (dependencies, optional and required peer
+    dependencies) from registry packuments and downloads every distinct name@version once.
+
+    Packuments are kept in memory for a short time, the memory_max_entries most recently
+    used ones at most, and on disk with their ETag, so repeated jobs revalidate them with
+    conditional requests.
+    """
+
+    def __init__(self, registry_url: str, cache_dir: Optional[str], max_concurrent: int = 16,
+                 memory_ttl: float = 300.0, memory_max_entries: int = 1000):
+        self.registry_url = registry_url.rstrip("/") + "/"
+        self.cache_dir = cache_dir
+        self.max_concurrent = max_concurrent
+        self.memory_ttl = memory_ttl
+        self.memory_max_entries = memory_max_entries
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+        # Least recently used first
+        self._packuments: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    async def resolve(self, spec: str, destination: str, on_chunk: Optional[Callable[[int], None]] = None,
+                      file_hashes: Optional[Dict[str, str]] = None) -> dict:
+        """
+        Resolve spec and download the tarballs of its tree into destination.
+
+        :param on_chunk: Optional callback receiving the size of every tarball chunk downloaded.
+        :param file_hashes: Optional dict receiving the SHA-256 of every tarball, by its path.
+
+        :return: Dict with the resolved root, the "packages" as name@version and the "unresolved" specs.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        name, version_range = parse_spec(spec)
+        root = await self._select(name, version_range, semaphore, required=True)
+        if root is None:
+            raise PackageNotFoundError(f"Unsupported npm package spec {spec}")
+
+        selected: Dict[Tuple[str, str], dict] = {(name, root["version"]): root}
+        resolved_ranges: Dict[Tuple[str, str], Optional[dict]] = {(name, version_range): root}
+        unresolved: List[str] = []
+        level = [root]
+
+        while level:
+            wanted = []
+            for manifest in level:
+                for dependency_name, dependency_range, optional in self._dependencies(manifest):
+                    key = (dependency_name, dependency_range)
+                    if key not in resolved_ranges:
+                        resolved_ranges[key] = None
+                        wanted.append((dependency_name, dependency_range, optional))
+
+            try:
+                manifests = await asyncio.gather(*(
+                    self._select(dependency_name, dependency_range, semaphore, required=not optional)
+                    for dependency_name, dependency_range, optional in wanted
+                ))
+            except PackageNotFoundError as e:
+                # Only the requested package itself missing means the dependency does not exist
+                raise ResolutionError(f"Broken dependency tree of {spec}: {str(e)}")
+            level = []
+            for (dependency_name, dependency_range, optional), manifest in zip(wanted, manifests):
+                if manifest is None:
+                    unresolved.append(f"{dependency_name}@{dependency_range}")
+                    continue
+                resolved_ranges[(dependency_name, dependency_range)] = manifest
+                # Different ranges often resolve to the same version, which is fetched once
+                if (manifest["name"], manifest["version"]) not in selected:
+                    selected[(manifest["name"], manifest["version"])] = manifest
+                    level.append(manifest)
+
+        os.makedirs(destination, exist_ok=True)
+        tasks = [asyncio.ensure_future(self._download_tarball(manifest, destination, semaphore, on_chunk, file_hashes))
+                 for manifest in selected.values()]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        return {
+            "root": f"{name}@{root['version']}",
+            "packages": sorted(f"{package}@{version}" for package, version in selected),
+            "unresolved": unresolved,
+        }
+
+    def _dependencies(self, manifest: dict):
+        """(name, range, optional) of the production dependencies of a version manifest"""
+        optional = manifest.get("optionalDependencies") or {}
+        for dependency_name, dependency_range in (manifest.get("dependencies") or {}).items():
+            yield dependency_name, dependency_range, dependency_name in optional
+        for dependency_name, dependency_range in optional.items():
+            if dependency_name not in (manifest.get("dependencies") or {}):
+                yield dependency_name, dependency_range, True
+        # npm 7+ installs peer dependencies unless they are marked optional
+        peer_meta = manifest.get("peerDependenciesMeta") or {}
+        for dependency_name, dependency_range in (manifest.get("peerDependencies") or {}).items():
+            if not (peer_meta.get(dependency_name) or {}).get("optional"):
+                yield dependency_name, dependency_range, False
+
+    async def _select(self, name: str, version_range: str, semaphore, required: bool) -> Optional[dict]:
+        """Version manifest best matching the range, None for optional or unsupported specs"""
+        if version_range.startswith("npm:"):
+            # Aliases install another package under this name
+            name, version_range = parse_spec(version_range[len("npm:"):])
+        if ":" in version_range or "/" in version_range:
+            # git, github, file, http and workspace specs cannot be resolved from the registry
+            print(f"Skipping npm dependency {name}@{version_range}: not a registry version")
+            return None
+        try:
+            packument = await self._packument(name, semaphore)
+            return self._match(packument, name, version_range)
+        except PackageNotFoundError:
+            if required:
+                raise
+            print(f"Skipping optional npm dependency {name}@{version_range}: not found")
+            return None
+        except ValueError:
+            print(f"Skipping npm dependency {name}@{version_range}: invalid version range")
+            return None
+
+    def _match(self, packument: dict, name: str, version_range: str) -> dict:
+        versions = packument.get("versions") or {}
+        dist_tags = packument.get("dist-tags") or {}
+
+        if version_range in dist_tags:
+            version = dist_tags[version_range]
+        elif version_range in versions:
+            version = version_range
+        else:
+            selector = VersionRange(version_range)
+            # Like npm, prefer the latest tag whenever it satisfies the range
+            latest = dist_tags.get("latest")
+            if latest in versions and selector.matches(latest):
+                version = latest
+            else:
+                best = selector.best_match(
+                    [parsed for parsed in map(Version.parse, versions) if parsed is not None]
+                )
+                if best is None:
+                    raise PackageNotFoundError(f"No version of {name} matches {version_range}")
+                version = next(v for v in versions if Version.parse(v) == best)
+
+        if version not in versions:
+            raise PackageNotFoundError(f"Version {version} of {name} does not exist")
+        manifest = dict(versions[version])
+        manifest.setdefault("name", name)
+        manifest.setdefault("version", version)
+        return manifest
+
+    async def _packument(self, name: str, semaphore) -> dict:
+        """Packument from memory, from disk after revalidation, or from the registry"""
+        cached = self._packuments.get(name)
+        if cached is not None:
+            if time.monotonic() - cached[0] < self.memory_ttl:
+                self._packuments.move_to_end(name)
+                return cached[1]
+            del self._packuments[name]
+        # Concurrent lookups of the same package share one request
+        if name not in self._pending:
+            self._pending[name] = asyncio.ensure_future(self._fetch_packument(name, semaphore))
+        future = self._pending[name]
+        try:
+            packument = await asyncio.shield(future)
+        finally:
+            if future.done() and self._pending.get(name) is future:
+                del self._pending[name]
+        self._packuments[name] = (time.monotonic(), packument)
+        self._packuments.move_to_end(name)
+        while len(self._packuments) > self.memory_max_entries:
+            self._packuments.popitem(last=False)
+        return packument
+
+    async def _fetch_packument(self, name: str, semaphore) -> dict:
+        cache_path = self._packument_cache_path(name)
+        cached = None
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path) as cache_file:
+                    cached = json.load(cache_file)
+            except (OSError, ValueError):
+                cached = None
+
+        headers = {"Accept": PACKUMENT_ACCEPT}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        elif cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        # Scoped names keep their @ but the slash must be escaped
+        url = self.registry_url + quote(name, safe="@")
+        async with semaphore:
+            async with http_client.session.get(url, headers=headers, timeout=self.timeout) as response:
+                if response.status == 304 and cached:
+                    return cached["packument"]
+                if response.status == 404:
+                    raise PackageNotFoundError(f"NPM package {name} does not exist")
+                if response.status != 200:
+                    raise ResolutionError(f"Error fetching packument of {name}: HTTP {response.status}")
+                packument = await response.json(content_type=None)
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+        if cache_path and (etag or last_modified):
+            staging_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+            with open(staging_path, "w") as cache_file:
+                json.dump({"etag": etag, "last_modified": last_modified, "packument": packument}, cache_file)
+            os.replace(staging_path, cache_path)
+        return packument
+
+    def _packument_cache_path(self, name: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, quote(name, safe="") + ".json")
+
+    async def _download_tarball(self, manifest: dict, destination: str, semaphore, on_chunk=None, file_hashes=None):
+        """Stream the tarball to destination and check it against the published integrity"""
+        dist = manifest.get("dist") or {}
+        url = dist.get("tarball")
+        if not url:
+            raise ResolutionError(f"No tarball published for {manifest['name']}@{manifest['version']}")
+
+        target = os.path.join(destination, tarball_file_name(manifest["name"], manifest["version"]))
+        staging_path = f"{target}.part"
+        # sha256 is not published by the registry, it identifies the content for upload deduplication
+        hashes = {algorithm: hashlib.new(algorithm) for algorithm in ("sha512", "sha256", "sha1")}
+        async with semaphore:
+            async with http_client.session.get(url, timeout=self.timeout) as response:
+                if response.status != 200:
+                    raise ResolutionError(
+                        f"Error fetching {manifest['name']}@{manifest['version']} tarball: HTTP {response.status}"
+                    )
+                with open(staging_path, "wb") as tarball_file:
+                    async for chunk in response.content.iter_chunked(1024 * 1024):
+                        for digest in hashes.values():
+                            digest.update(chunk)
+                        tarball_file.write(chunk)
+                        if on_chunk is not None:
+                            on_chunk(len(chunk))
+
+        if not self._verify(dist, hashes):
+            os.remove(staging_path)
+            raise ResolutionError(f"Integrity check failed for {manifest['name']}@{manifest['version']}")
+        os.replace(staging_path, target)
+        if file_hashes is not None:
+            file_hashes[target] = hashes["sha256"].hexdigest()
+
+    def _verify(self, dist: dict, hashes: dict) -> bool:
+        """Check the Subresource Integrity string, falling back to the legacy sha1 shasum"""
+        integrity = dist.get("integrity")
+        if integrity:
+            checked = False
+            for entry in integrity.split():
+                algorithm, _, expected = entry.partition("-")
+                if algorithm in hashes:
+                    checked = True
+                    if base64.b64encode(hashes[algorithm].digest()).decode() == expected:
+                        return True
+            if checked:
+                return False
+        shasum = dist.get("shasum")
+        if shasum:
+            return hashes["sha1"].hexdigest() == shasum.lower()
+        return True
@@ -0,0 +1,288 @@
+"""
+Minimal client for the OCI distribution API, used to fetch images without a Docker daemon.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+import aiohttp
+
+from app.helpers.http_client import http_client
+
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+
+MANIFEST_LIST_TYPES = (
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+)
+MANIFEST_TYPES = (
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+)
+
+
+class RegistryNotFoundError(Exception):
+    """Raised when the registry does not know the repository, tag or digest."""
+    pass
+
+
+class RegistryError(Exception):
+    """Raised for any other registry failure."""
+    pass
+
+
+class ImageReference:
+    """A parsed image reference such as nginx:1.25, ghcr.io/org/app@sha256:..."""
+
+    def __init__(self, registry: str, repository: str, tag: Optional[str], digest: Optional[str]):
+        self.registry = registry
+        self.repository = repository
+        self.tag = tag
+        self.digest = digest
+
+    @classmethod
+    def parse(cls, reference: str) -> "ImageReference":
+        reference = reference.strip()
+        digest = None
+        if "@" in reference:
+            reference, digest = reference.split("@", 1)
+
+        tag = None
+        last_component = reference.rsplit("/", 1)[-1]
+        if ":" in last_component:
+            reference, tag = reference.rsplit(":", 1)
+
+        # The first component is a registry if it looks like a host name, as the Docker CLI does
+        parts = reference.split("/", 1)
+        if len(parts) == 2 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+            registry, repository = parts
+        else:
+            registry, repository = "docker.io", reference
+
+        if registry in ("docker.io", "index.docker.io"):
+            registry = DOCKER_HUB_REGISTRY
+            if "/" not in repository:
+                repository = f"library/{repository}"
+
+        if not re.match(r"^[a-z0-9]+(?:[._/-][a-z0-9]+)*$", repository):
+            raise ValueError(f"Invalid image repository: {repository}")
+        if tag is None and digest is None:
+            tag = "latest"
+        return cls(registry, repository, tag, digest)
+
+    @property
+    def manifest_reference(self) -> str:
+        return self.digest or self.tag
+
+    @property
+    def repo_tag(self) -> Optional[str]:
+        """Name as docker load should tag it, None for pure digest references"""
+        if self.tag is None:
+            return None
+        if self.registry == DOCKER_HUB_REGISTRY:
+            name = self.repository[len("library/"):] if self.repository.startswith("library/") else self.repository
+        else:
+            name = f"{self.registry}/{self.repository}"
+        return f"{name}:{self.tag}"
+
+    def __str__(self):
+        text = f"{self.registry}/{self.repository}"
+        if self.tag:
+            text += f":{self.tag}"
+        if self.digest:
+            text += f"@{self.digest}"
+        return text
+
+
+class RegistryClient:
+    """Fetches manifests and blobs over the registry HTTP API, handling anonymous token auth"""
+
+    def __init__(self):
+        self.platform = os.getenv("DOCKER_PLATFORM", "linux/amd64")
+        self.insecure_registries = {
+            host.strip() for host in os.getenv("DOCKER_INSECURE_REGISTRIES", "").split(",") if host.strip()
+        }
+        self.username = os.getenv("DOCKER_REGISTRY_USERNAME")
+        self.password = os.getenv("DOCKER_REGISTRY_PASSWORD")
+        self.timeout = aiohttp.ClientTimeout(total=None, sock_connect=60, sock_read=300)
+        self._tokens: Dict[tuple, str] = {}
+
+    def _base_url(self, registry: str) -> str:
+        host = registry.split(":")[0]
+        plain_http = registry in self.insecure_registries or host in ("localhost", "127.0.0.1")
+        return f"{'http' if plain_http else 'https'}://{registry}/v2/"
+
+    async def get_manifest(self, image: ImageReference) -> dict:
+        """
+        Fetch the image manifest, resolving multi-platform indexes to the configured platform.
+
+        :return: Dict with the parsed "manifest", its "raw" bytes, "media_type" and "digest".
+        """
+        manifest, raw, media_type, digest = await self._fetch_manifest(image, image.manifest_reference)
+
+        if media_type in MANIFEST_LIST_TYPES or "manifests" in manifest:
+            os_name, _, architecture = self.platform.partition("/")
+            architecture, _, variant = architecture.partition("/")
+            for entry in manifest.get("manifests", []):
+                platform = entry.get("platform", {})
+                if (platform.get("os") == os_name and platform.get("architecture") == architecture
+                        and (not variant or platform.get("variant") == variant)):
+                    manifest, raw, media_type, digest = await self._fetch_manifest(image, entry["digest"])
+                    break
+            else:
+                raise RegistryNotFoundError(f"No {self.platform} image in {image}")
+
+        if "layers" not in manifest or "config" not in manifest:
+            raise RegistryError(f"Unsupported manifest type {media_type} for {image}")
+        return {
+            "manifest": manifest,
+            "raw": raw,
+            "media_type": manifest.get("mediaType") or media_type or MANIFEST_TYPES[0],
+            "digest": digest,
+        }
+
+    async def _fetch_manifest(self, image: ImageReference, reference: str):
+        url = f"{self._base_url(image.registry)}{image.repository}/manifests/{reference}"
+        headers = {"Accept": ", ".join(MANIFEST_LIST_TYPES + MANIFEST_TYPES)}
+        async with await self._request(image, url, headers) as response:
+            if response.status in (401, 403, 404):
+                raise RegistryNotFoundError(f"Image {image} not found (HTTP {response.status})")
+            if response.status != 200:
+                raise RegistryError(f"Error fetching manifest of {image}: HTTP {response.status}")
+            body = await response.read()
+            media_type = response.headers.get("Content-Type", "").split(";")[0]
+            digest = response.headers.get("Docker-Content-Digest") or f"sha256:{hashlib.sha256(body).hexdigest()}"
+        # Manifests requested by digest, e.g. the platform image of an index, must match it
+        if reference.startswith("sha256:") and f"sha256:{hashlib.sha256(body).hexdigest()}" != reference:
+            raise RegistryError(f"Digest mismatch for manifest {reference} of {image}")
+        return json.loads(body), body, media_type, digest
+
+    async def download_blob(self, image: ImageReference, digest: str, destination: str, on_chunk=None):
+        """Stream a blob to destination, verifying its digest on the way"""
+        algorithm, _, expected = digest.partition(":")
+        if algorithm != "sha256":
+            raise RegistryError(f"Unsupported digest algorithm in {digest}")
+
+        url = f"{self._base_url(image.registry)}{image.repository}/blobs/{digest}"
+        sha256 = hashlib.sha256()
+        partial_path = f"{destination}.part"
+
+        response = await self._request(image, url, allow_redirects=False)
+        try:
+            # Blob storage is often behind a redirect to a CDN that must not receive our token
+            while response.status in (301, 302, 303, 307, 308):
+                location = urljoin(str(response.url), response.headers["Location"])
+                response.release()
+                response = await http_client.session.get(location, timeout=self.timeout, allow_redirects=False)
+            if response.status == 404:
+                raise RegistryNotFoundError(f"Blob {digest} of {image} not found")
+            if response.status != 200:
+                raise RegistryError(f"Error fetching blob {digest} of {image}: HTTP {response.status}")
+
+            with open(partial_path, "wb") as blob_file:
+                async for chunk in response.content.iter_chunked(1024 * 1024):
+                    sha256.update(chunk)
+                    blob_file.write(chunk)
+                    if on_chunk is not None:
+                        on_chunk(len(chunk))
+        finally:
+            response.release()
+
+        if sha256.hexdigest() != expected:
+            os.remove(partial_path)
+            raise RegistryError(f"Digest mismatch for blob {digest} of {image}")
+        os.replace(partial_path, destination)
+
+    async def _request(self, image: ImageReference, url: str, headers: Optional[dict] = None, allow_redirects=True):
+        """GET with bearer token authentication, fetching a token on the first 401"""
+        headers = dict(headers or {})
+        token_key = (image.registry, image.repository)
+        if token_key in self._tokens:
+            headers["Authorization"] = f"Bearer {self._tokens[token_key]}"
+
+        response = await http_client.session.get(
+            url, headers=headers, timeout=self.timeout, allow_redirects=allow_redirects
+        )
+        if response.status != 401:
+            return response
+
+        challenge = response.headers.get("WWW-Authenticate", "")
+        response.release()
+        token = await self._fetch_token(challenge, image)
+        if token is None:
+            return await http_client.session.get(
+                url, headers=headers, timeout=self.timeout, allow_redirects=allow_redirects
+            )
+        self._tokens[token_key] = token
+        headers["Authorization"] = f"Bearer {token}"
+        return await http_client.session.get(
+            url, headers=headers, timeout=self.timeout, allow_redirects=allow_redirects
+        )
+
+    async def _fetch_token(self, challenge: str, image: ImageReference) -> Optional[str]:
+        if not challenge.lower().startswith("bearer "):
+            return None
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm", None)
+        if realm is None:
+            return None
+        params.setdefault("scope", f"repository:{image.repository}:pull")
+
+        auth = aiohttp.BasicAuth(self.username, self.password) if self.username else None
+        async with http_client.session.get(realm, params=params, auth=auth, timeout=self.timeout) as response:
+            if response.status != 200:
+                raise RegistryError(f"Registry token request failed: HTTP {response.status}")
+            body = await response.json(content_type=None)
+        return body.get("token") or body.get("access_token")
+
+
+def write_image_layout(package_dir: str, images: List[dict]):
+    """
+    Write the index files of an image archive that both `docker load` and OCI tools understand.
+
+    Every entry of images holds the resolved manifest (as returned by get_manifest) and the
+    repo tag; the config and layer blobs are expected under package_dir/blobs/sha256/ already.
+    """
+    docker_manifest = []
+    oci_index = {"schemaVersion": 2, "mediaType": "application/vnd.oci.image.index.v1+json", "manifests": []}
+
+    for image in images:
+        resolved = image["manifest"]
+        manifest = resolved["manifest"]
+        docker_manifest.append({
+            "Config": _blob_path(manifest["config"]["digest"]),
+            "RepoTags": [image["repo_tag"]] if image["repo_tag"] else [],
+            "Layers": [_blob_path(layer["digest"]) for layer in manifest["layers"]],
+        })
+
+        # The manifest itself is stored as a blob as well so the OCI index can reference it
+        manifest_digest = f"sha256:{hashlib.sha256(resolved['raw']).hexdigest()}"
+        with open(os.path.join(package_dir, _blob_path(manifest_digest)), "wb") as manifest_file:
+            manifest_file.write(resolved["raw"])
+        descriptor = {
+            "mediaType": resolved["media_type"],
+            "digest": manifest_digest,
+            "size": len(resolved["raw"]),
+        }
+        if image["repo_tag"]:
+            descriptor["annotations"] = {
+                "io.containerd.image.name": image["repo_tag"],
+                "org.opencontainers.image.ref.name": image["repo_tag"].rsplit(":", 1)[-1],
+            }
+        oci_index["manifests"].append(descriptor)
+
+    with open(os.path.join(package_dir, "manifest.json"), "w") as manifest_file:
+        json.dump(docker_manifest, manifest_file)
+    with open(os.path.join(package_dir, "index.json"), "w") as index_file:
+        json.dump(oci_index, index_file)
+    with open(os.path.join(package_dir, "oci-layout"), "w") as layout_file:
+        json.dump({"imageLayoutVersion": "1.0.0"}, layout_file)
+
+
+def _blob_path(digest: str) -> str:
+    algorithm, _, hex_digest = digest.partition(":")
+    return f"blobs/{algorithm}/{hex_digest}"
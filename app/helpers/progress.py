@@ -0,0 +1,127 @@
+"""
+Throttled byte-level progress events for downloads and uploads.
+"""
+
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+from app.models.hyperloop_download import HyperloopDownload
+
+# Seconds between two progress events of the same job, 0 disables them
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL_SECONDS", "1"))
+
+
+def _disk_usage(path: str) -> int:
+    """Bytes of the regular files below path, to be run in thread pool"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # Files come and go while a tool is writing
+                pass
+    return total
+
+
+class ProgressReporter:
+    """
+    Counts the bytes one phase of a job moves and publishes them with throughput and ETA.
+
+    Events go out at most once per interval and only when bytes moved since the last one,
+    so a stalled transfer shows up as the absence of updates rather than a flood of zeros.
+    Byte counts come from advance(), or from the size of a watched path for phases
+    driven by external tools.
+    """
+
+    def __init__(self, download: HyperloopDownload, phase: str,
+                 publish: Callable[[HyperloopDownload], Awaitable[None]],
+                 total: Optional[int] = None, interval: float = PROGRESS_INTERVAL):
+        self.download = download
+        self.phase = phase
+        self.publish = publish
+        self.total = total
+        self.interval = interval
+        self.bytes = 0
+        self.resumed = 0
+        self.started = time.monotonic()
+        self._watched: Optional[str] = None
+        self._last_time = self.started
+        self._last_bytes = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def advance(self, count: int):
+        """Record count more bytes, safe to call from the thread pool"""
+        self.bytes += count
+
+    def resume(self, count: int):
+        """Record count bytes left by an earlier attempt, they do not count towards the throughput"""
+        self.bytes += count
+        self.resumed += count
+        self._last_bytes += count
+
+    def expect(self, count: int):
+        """Add count bytes to the expected total, for phases that learn their size piecemeal"""
+        self.total = (self.total or 0) + count
+
+    def watch(self, path: str):
+        """Take the byte count from the size of path instead of advance() calls"""
+        self._watched = path
+
+    def snapshot(self) -> dict:
+        """Progress payload, the instantaneous rate covers the time since the previous event"""
+        now = time.monotonic()
+        elapsed = now - self.started
+        window = now - self._last_time
+        average = (self.bytes - self.resumed) / elapsed if elapsed > 0 else 0
+        progress = {
+            "phase": self.phase,
+            "bytes": self.bytes,
+            "bytes_per_second": round((self.bytes - self._last_bytes) / window) if window > 0 else 0,
+            "average_bytes_per_second": round(average),
+            "elapsed_seconds": round(elapsed, 1),
+        }
+        if self.total:
+            progress["total"] = self.total
+            progress["percent"] = round(min(self.bytes / self.total, 1.0) * 100, 1)
+            if average > 0:
+                progress["eta_seconds"] = round(max(self.total - self.bytes, 0) / average, 1)
+        return progress
+
+    async def __aenter__(self) -> "ProgressReporter":
+        if self.interval > 0:
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if exc_type is None and self._watched and os.path.exists(self._watched):
+            # The tool may have written more since the last tick
+            self.bytes = await asyncio.get_event_loop().run_in_executor(None, _disk_usage, self._watched)
+        # The final figures of a completed phase go out with its next status update
+        if exc_type is None and self.bytes and self.interval > 0:
+            self.download.progress = self.snapshot()
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if self._watched and os.path.exists(self._watched):
+                    self.bytes = await loop.run_in_executor(None, _disk_usage, self._watched)
+                if self.bytes == self._last_bytes:
+                    continue
+                self.download.progress = self.snapshot()
+                self._last_time, self._last_bytes = time.monotonic(), self.bytes
+                await self.publish(self.download)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Progress is informational and must never fail the job
+                print(f"Error publishing progress of {self.download.id}: {e}")
@@ -0,0 +1,35 @@
+"""
+Retry policy with exponential backoff and full jitter.
+"""
+
+import os
+import random
+from dataclasses import dataclass
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 5
+    base_delay: float = 1.0  # Seconds before the first retry, doubled for every attempt
+    max_delay: float = 60.0  # Upper bound for a single delay
+    time_budget: float = 600.0  # Total seconds that may be spent on attempts and delays
+
+    @classmethod
+    def from_env(cls, prefix: str) -> "RetryPolicy":
+        """Build a policy from <prefix>_MAX_ATTEMPTS, _BACKOFF_BASE, _BACKOFF_MAX and _TIME_BUDGET"""
+        return cls(
+            max_attempts=int(os.getenv(f"{prefix}_MAX_ATTEMPTS", str(cls.max_attempts))),
+            base_delay=float(os.getenv(f"{prefix}_BACKOFF_BASE", str(cls.base_delay))),
+            max_delay=float(os.getenv(f"{prefix}_BACKOFF_MAX", str(cls.max_delay))),
+            time_budget=float(os.getenv(f"{prefix}_TIME_BUDGET", str(cls.time_budget)))
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before the attempt following the given (1-based) failed attempt"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        # Full jitter spreads retries of many jobs hitting the same outage
+        return random.uniform(0, ceiling)
+
+    def should_retry(self, attempt: int, elapsed: float, delay: float) -> bool:
+        """Whether another attempt fits in the attempt count and time budget"""
+        return attempt < self.max_attempts and elapsed + delay < self.time_budget
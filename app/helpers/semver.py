@@ -0,0 +1,204 @@
+"""
+Minimal semantic versioning helpers for selecting chart and package versions.
+
+Supports the range syntax used by Helm and npm: comparators (>=1.2.0 <2.0.0), exact versions,
+wildcards (1.x, 1.2.*, *), caret (^1.2.3), tilde (~1.2.3), hyphen ranges (1.0.0 - 2.0.0)
+and alternatives separated by ||.
+"""
+
+import re
+from functools import total_ordering
+from typing import List, Optional, Tuple
+
+_VERSION = re.compile(
+    r"^\s*[v=]?\s*(\d+)\.(\d+)\.(\d+)"
+    r"(?:-([0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*))?"
+    r"(?:\+[0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*)?\s*$"
+)
+# Partial version as it may appear in a range, e.g. "1", "1.2", "1.x", "1.2.*"
+_PARTIAL = re.compile(
+    r"^[v=]?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?"
+    r"(?:-([0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*))?(?:\+[0-9A-Za-z.-]+)?$"
+)
+_COMPARATOR = re.compile(r"^(<=|>=|<|>|=|\^|~>?)?\s*(.*)$")
+
+
+@total_ordering
+class Version:
+    """A parsed semantic version, ordered according to the SemVer 2.0 precedence rules"""
+
+    def __init__(self, major: int, minor: int, patch: int, prerelease: Tuple = ()):
+        self.major = major
+        self.minor = minor
+        self.patch = patch
+        self.prerelease = prerelease
+
+    @classmethod
+    def parse(cls, text: str) -> Optional["Version"]:
+        """Parse a version string, returns None when it is not valid semver"""
+        match = _VERSION.match(str(text))
+        if not match:
+            return None
+        major, minor, patch, prerelease = match.groups()
+        return cls(int(major), int(minor), int(patch), _split_prerelease(prerelease))
+
+    @property
+    def release(self) -> Tuple[int, int, int]:
+        return (self.major, self.minor, self.patch)
+
+    def _key(self):
+        # A version without prerelease has higher precedence than one with
+        if not self.prerelease:
+            return (self.release, 1, ())
+        identifiers = tuple((0, p, "") if isinstance(p, int) else (1, 0, p) for p in self.prerelease)
+        return (self.release, 0, identifiers)
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self._key() == other._key()
+
+    def __lt__(self, other):
+        return self._key() < other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __str__(self):
+        text = f"{self.major}.{self.minor}.{self.patch}"
+        if self.prerelease:
+            text += "-" + ".".join(str(p) for p in self.prerelease)
+        return text
+
+    def __repr__(self):
+        return f"Version('{self}')"
+
+
+def _split_prerelease(prerelease: Optional[str]) -> Tuple:
+    if not prerelease:
+        return ()
+    return tuple(int(p) if p.isdigit() else p for p in prerelease.split("."))
+
+
+def _is_wildcard(part: Optional[str]) -> bool:
+    return part is None or part in ("x", "X", "*")
+
+
+def _desugar(operator: str, text: str) -> List[Tuple[str, Version]]:
+    """Turn a single range token into a list of primitive (operator, version) comparators"""
+    if text in ("", "*", "x", "X"):
+        return [(">=", Version(0, 0, 0))]
+
+    match = _PARTIAL.match(text)
+    if not match:
+        raise ValueError(f"Invalid version in range: {text}")
+    major, minor, patch, prerelease = match.groups()
+    pre = _split_prerelease(prerelease)
+
+    if _is_wildcard(major):
+        return [(">=", Version(0, 0, 0))] if operator in ("", "=", ">=", "<=", "^", "~", "~>") else [("<", Version(0, 0, 0))]
+    major = int(major)
+
+    if _is_wildcard(minor):
+        # "1" / "1.x" behave like a caret or tilde on the major version
+        low, high = Version(major, 0, 0), Version(major + 1, 0, 0)
+    elif _is_wildcard(patch):
+        minor = int(minor)
+        if operator == "^" and major == 0:
+            low, high = Version(0, minor, 0), Version(0, minor + 1, 0)
+        elif operator == "^":
+            low, high = Version(major, minor, 0), Version(major + 1, 0, 0)
+        else:
+            low, high = Version(major, minor, 0), Version(major, minor + 1, 0)
+    else:
+        version = Version(major, int(minor), int(patch), pre)
+        if operator in ("", "="):
+            return [("=", version)]
+        if operator in (">", ">=", "<", "<="):
+            return [(operator, version)]
+        if operator in ("~", "~>"):
+            return [(">=", version), ("<", Version(major, version.minor + 1, 0))]
+        # Caret: allow changes that do not modify the left-most non-zero component
+        if major > 0:
+            upper = Version(major + 1, 0, 0)
+        elif version.minor > 0:
+            upper = Version(0, version.minor + 1, 0)
+        else:
+            upper = Version(0, 0, version.patch + 1)
+        return [(">=", version), ("<", upper)]
+
+    # Partial versions with a comparison operator
+    if operator == ">":
+        return [(">=", high)]
+    if operator == ">=":
+        return [(">=", low)]
+    if operator == "<":
+        return [("<", low)]
+    if operator == "<=":
+        return [("<", high)]
+    return [(">=", low), ("<", high)]
+
+
+class VersionRange:
+    """A set of alternatives (||), each being a list of comparators that must all match"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.alternatives = [self._parse_set(part) for part in (text or "*").split("||")]
+
+    @staticmethod
+    def _parse_set(text: str) -> List[Tuple[str, Version]]:
+        text = text.strip()
+        hyphen = re.match(r"^(\S+)\s+-\s+(\S+)$", text)
+        if hyphen:
+            low = _desugar(">=", hyphen.group(1))
+            high = _desugar("<=", hyphen.group(2))
+            return low[:1] + high[-1:]
+
+        comparators = []
+        # Allow a space between the operator and the version, e.g. ">= 1.2.0"
+        text = re.sub(r"(<=|>=|<|>|=|\^|~>?)\s+", r"\1", text)
+        for token in text.split():
+            operator, version = _COMPARATOR.match(token).groups()
+            comparators.extend(_desugar(operator or "", version))
+        return comparators or [(">=", Version(0, 0, 0))]
+
+    def matches(self, version, include_prerelease: bool = False) -> bool:
+        """Check whether a Version (or version string) satisfies the range"""
+        if not isinstance(version, Version):
+            version = Version.parse(version)
+            if version is None:
+                return False
+        return any(self._matches_set(comparators, version, include_prerelease) for comparators in self.alternatives)
+
+    @staticmethod
+    def _matches_set(comparators, version: Version, include_prerelease: bool) -> bool:
+        for operator, bound in comparators:
+            if operator == "=" and not version == bound:
+                return False
+            if operator == ">" and not version > bound:
+                return False
+            if operator == ">=" and not version >= bound:
+                return False
+            if operator == "<" and not version < bound:
+                return False
+            if operator == "<=" and not version <= bound:
+                return False
+        if version.prerelease and not include_prerelease:
+            # Prereleases only match when a comparator opts into the same major.minor.patch
+            return any(bound.prerelease and bound.release == version.release for _, bound in comparators)
+        return True
+
+    def best_match(self, versions, include_prerelease: bool = False) -> Optional[Version]:
+        """Return the highest version that satisfies the range"""
+        candidates = [v for v in versions if self.matches(v, include_prerelease)]
+        return max(candidates, default=None)
+
+    def __str__(self):
+        return self.text
+
+
+def sort_versions(versions, reverse: bool = True) -> list:
+    """Sort version strings by semver precedence, unparsable versions keep their order at the end"""
+    parsed = [(Version.parse(v), i, v) for i, v in enumerate(versions)]
+    valid = sorted((p for p in parsed if p[0] is not None), key=lambda p: p[0], reverse=reverse)
+    invalid = [p for p in parsed if p[0] is None]
+    return [v for _, _, v in valid + invalid]
@@ -0,0 +1,82 @@
+"""
+Coalescing of identical download requests that are in flight at the same time.
+"""
+
+import asyncio
+import json
+from typing import Dict, List, Optional, Tuple
+
+from app.models.exceptions import InternalError
+from app.models.hyperloop_download import HyperloopDownload
+
+
+class Flight:
+    """A running download together with the requests waiting for its result"""
+
+    def __init__(self, leader: HyperloopDownload):
+        self.leader = leader
+        self.followers: List[HyperloopDownload] = []
+        self.done = asyncio.get_event_loop().create_future()
+
+
+class SingleFlight:
+    """
+    Runs a download once for all identical requests: the first request leads, later ones
+    follow it and receive the leader's status updates under their own id.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Tuple[str, str, str], Flight] = {}
+
+    def key(self, download: HyperloopDownload) -> Tuple[str, str, str]:
+        """Requests are identical when type, dependency and options match"""
+        return download.type, download.dependency.strip(), json.dumps(download.options or {}, sort_keys=True)
+
+    def follow(self, download: HyperloopDownload) -> Optional[Flight]:
+        """Attach to a running identical download, None when there is none"""
+        flight = self._flights.get(self.key(download))
+        if flight is None:
+            return None
+        flight.followers.append(download)
+        self._mirror(flight.leader, download)
+        return flight
+
+    def lead(self, download: HyperloopDownload) -> Flight:
+        flight = Flight(download)
+        self._flights[self.key(download)] = flight
+        return flight
+
+    def finish(self, flight: Flight, error: Optional[BaseException] = None):
+        """Release the followers with the leader's outcome"""
+        if self._flights.get(self.key(flight.leader)) is flight:
+            del self._flights[self.key(flight.leader)]
+        if flight.done.done():
+            return
+        if error is None:
+            flight.done.set_result(None)
+        else:
+            if not isinstance(error, Exception):
+                # Cancellation or shutdown of the leader, the followers are retried like any internal error
+                error = InternalError(f"Request {flight.leader.id} was interrupted")
+            flight.done.set_exception(error)
+            # Followers that already gave up must not cause "exception never retrieved" warnings
+            flight.done.exception()
+
+    def followers_of(self, download: HyperloopDownload) -> List[HyperloopDownload]:
+        """Followers of a leading download, updated to the leader's current status"""
+        flight = self._flights.get(self.key(download))
+        if flight is None or flight.leader is not download:
+            return []
+        for follower in flight.followers:
+            self._mirror(download, follower)
+        return list(flight.followers)
+
+    def _mirror(self, leader: HyperloopDownload, follower: HyperloopDownload):
+        follower.status = leader.status
+        follower.details = dict(leader.details)
+        follower.details["coalesced_with"] = leader.id
+        follower.progress = dict(leader.progress)
+
+
+# Shared instance used by the download router and the processors
+single_flight = SingleFlight()
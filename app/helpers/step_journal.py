@@ -0,0 +1,133 @@
+"""
+Durable journal of the completed pipeline steps, so redelivered messages resume where they stopped.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Callable, List, Optional, Set
+
+from app.models.hyperloop_download import HyperloopDownload
+
+
+class StepJournal:
+    """
+    Records, per request id and dependency, the last completed step of the pipeline and
+    the artifacts it left in the job workspace (package_dir, tarball_path, hashes).
+
+    Entries are written with fsync and an atomic rename, so a minion killed at any point
+    leaves either the previous or the new entry. Entries and their workspaces are dropped
+    once the request completes or after STEP_JOURNAL_MAX_AGE_SECONDS.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("STEP_JOURNAL_ENABLED", "true").lower() == "true"
+        self.journal_dir = os.getenv("STEP_JOURNAL_DIR", "/tmp/step-journal/")
+        self.max_age = float(os.getenv("STEP_JOURNAL_MAX_AGE_SECONDS", "3600"))
+        self.prune_interval = float(os.getenv("STEP_JOURNAL_PRUNE_INTERVAL_SECONDS", "600"))
+        if self.enabled and not os.path.exists(self.journal_dir):
+            os.makedirs(self.journal_dir)
+
+    def load(self, download: HyperloopDownload) -> Optional[dict]:
+        """The journal entry of the request, None if there is none or it expired"""
+        if not self.enabled:
+            return None
+        entry = self._read(self._path(download))
+        if entry is None or self._expired(entry):
+            return None
+        # Guard against a hash collision or an id reused for another dependency
+        if (entry.get("id"), entry.get("type"), entry.get("dependency")) != (str(download.id), download.type, download.dependency):
+            return None
+        return entry
+
+    def record(self, download: HyperloopDownload, step: str, workspace: str, artifacts: dict,
+               state: Optional[dict] = None, tmpfs_bytes: int = 0):
+        """Durably record that step completed, leaving artifacts in workspace"""
+        if not self.enabled:
+            return
+        entry = {
+            "id": str(download.id),
+            "type": download.type,
+            "dependency": download.dependency,
+            "step": step,
+            "workspace": workspace,
+            "tmpfs_bytes": tmpfs_bytes,
+            "artifacts": artifacts,
+            "details": dict(download.details),
+            "state": state or {},
+            "updated": time.time(),
+        }
+        path = self._path(download)
+        staging_path = f"{path}.tmp"
+        try:
+            with open(staging_path, "w") as journal_file:
+                json.dump(entry, journal_file)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(staging_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # Without an entry the redelivery starts from scratch, which is slower but correct
+            print(f"Error writing step journal for {download.id}: {e}")
+
+    def discard(self, download: HyperloopDownload):
+        if not self.enabled:
+            return
+        try:
+            os.remove(self._path(download))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error removing step journal entry of {download.id}: {e}")
+
+    def prune(self, in_use: Optional[Callable[[str], bool]] = None) -> List[dict]:
+        """
+        Remove the expired entries and return them, so their workspaces can be removed as well.
+
+        :param in_use: Tells whether a job still runs in a workspace, entries of those are kept.
+        """
+        expired = []
+        for path, entry in self._entries():
+            if entry is not None and in_use is not None and in_use(entry.get("workspace", "")):
+                continue
+            if entry is None or self._expired(entry):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                if entry is not None:
+                    expired.append(entry)
+        return expired
+
+    def workspaces(self) -> Set[str]:
+        """Workspaces a redelivered message may still resume from"""
+        return {entry["workspace"] for _, entry in self._entries() if entry is not None and not self._expired(entry)}
+
+    def _entries(self):
+        if not self.enabled or not os.path.isdir(self.journal_dir):
+            return
+        for name in os.listdir(self.journal_dir):
+            if name.endswith(".json"):
+                path = os.path.join(self.journal_dir, name)
+                yield path, self._read(path)
+
+    def _read(self, path: str) -> Optional[dict]:
+        try:
+            with open(path) as journal_file:
+                return json.load(journal_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Step journal entry {path} unreadable, ignoring it: {e}")
+            return None
+
+    def _expired(self, entry: dict) -> bool:
+        return time.time() - entry.get("updated", 0) > self.max_age
+
+    def _path(self, download: HyperloopDownload) -> str:
+        raw = json.dumps([str(download.id), download.type, download.dependency])
+        return os.path.join(self.journal_dir, f"{hashlib.sha256(raw.encode()).hexdigest()}.json")
+
+
+# Shared instance used by all processors
+step_journal = StepJournal()
@@ -0,0 +1,98 @@
+"""
+Helpers for producing a tarball incrementally so it can be uploaded while it is being packaged.
+"""
+
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, BinaryIO
+
+# Marker placed on the queue once the producer has written the last byte
+_EOF = object()
+
+
+class StreamAbortedError(Exception):
+    """Raised inside the packaging thread when the consumer stopped reading the stream."""
+    pass
+
+
+class _QueueWriter:
+    """Write-only file object that hands bytes from a worker thread to an asyncio queue"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, chunk_size: int):
+        self.loop = loop
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self.aborted = threading.Event()
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer.extend(data)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            self._put(chunk)
+
+    def finish(self):
+        """Flush remaining bytes and signal the end of the stream"""
+        self.flush()
+        self._put(_EOF)
+
+    def _put(self, item):
+        if self.aborted.is_set():
+            raise StreamAbortedError("Tarball stream consumer went away")
+        # Blocks the packaging thread while the queue is full, which gives us backpressure
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+
+
+async def iter_tarball_stream(
+    write_tarball: Callable[[BinaryIO], None],
+    chunk_size: int = 1024 * 1024,
+    max_buffered_chunks: int = 8
+) -> AsyncIterator[bytes]:
+    """
+    Run write_tarball in the thread pool and yield the bytes it writes as they become available.
+
+    :param write_tarball: Callable that writes a complete tar stream into the file object it is given.
+    :param chunk_size: Size of the chunks handed to the consumer.
+    :param max_buffered_chunks: Number of chunks that may be buffered before the producer blocks.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max_buffered_chunks)
+    writer = _QueueWriter(loop, queue, chunk_size)
+
+    def produce():
+        try:
+            write_tarball(writer)
+        except Exception:
+            if not writer.aborted.is_set():
+                # Wake up the consumer so it can surface the error
+                writer._put(_EOF)
+            raise
+        writer.finish()
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is _EOF:
+                break
+            yield chunk
+        # Re-raise any packaging error once the stream has ended
+        await producer
+    finally:
+        if not producer.done():
+            writer.aborted.set()
+            # Unblock a producer that is waiting on a full queue
+            while not queue.empty():
+                queue.get_nowait()
+            try:
+                await producer
+            except StreamAbortedError:
+                pass
+            except Exception as e:
+                print(f"Error while aborting tarball stream: {e}")
@@ -0,0 +1,211 @@
+"""
+Per-job workspaces inside the processor temp directories, with orphan sweeping.
+"""
+
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+from typing import Iterable, Optional
+
+from app.models.hyperloop_download import HyperloopDownload
+
+# Marker written into every workspace so a later process can tell whether its owner is gone
+OWNER_FILE = ".workspace.json"
+
+
+class Workspace:
+    """Directory owned by a single job"""
+
+    def __init__(self, path: str, tmpfs_bytes: int = 0):
+        self.path = path
+        # Bytes reserved on tmpfs, 0 for workspaces on disk
+        self.tmpfs_bytes = tmpfs_bytes
+
+    def __repr__(self):
+        return f"Workspace({self.path})"
+
+
+class WorkspaceManager:
+    """
+    Gives every job a unique directory under <temp_dir>/jobs/, so concurrent jobs for the
+    same dependency never share paths, and removes it when the job ends.
+
+    Jobs expected to stay below WORKSPACE_TMPFS_MAX_JOB_BYTES get their workspace on the
+    RAM-backed WORKSPACE_TMPFS_DIR, as long as the tmpfs budget allows. Workspaces left
+    behind by a crashed process are swept at startup.
+    """
+
+    def __init__(self):
+        self.tmpfs_dir = os.getenv("WORKSPACE_TMPFS_DIR", "")
+        self.tmpfs_max_job_bytes = int(os.getenv("WORKSPACE_TMPFS_MAX_JOB_BYTES", str(64 * 1024 ** 2)))
+        self.tmpfs_budget_bytes = int(os.getenv("WORKSPACE_TMPFS_BYTES", str(512 * 1024 ** 2)))
+        # Workspaces and stable files older than this are removed by the sweep even if their owner still runs
+        self.max_age = float(os.getenv("WORKSPACE_MAX_AGE_SECONDS", str(24 * 3600)))
+        self.tmpfs_reserved = 0
+        self.stable_dirs = set()
+        # Workspaces of the jobs running in this process
+        self.active = set()
+        self.hostname = socket.gethostname()
+        # Containers restart with the same pid, the token tells this process apart from its predecessor
+        self.token = uuid.uuid4().hex
+
+    def create(self, temp_dir: str, download: HyperloopDownload, estimate: Optional[int] = None) -> Workspace:
+        """Create the workspace of a job, on tmpfs when the estimate is small enough"""
+        name = f"{self._safe_name(download)}-{uuid.uuid4().hex[:8]}"
+        if self._fits_tmpfs(estimate):
+            path = os.path.join(self.tmpfs_dir, os.path.basename(temp_dir.rstrip(os.sep)), "jobs", name)
+            try:
+                self._make(path)
+                self.tmpfs_reserved += estimate
+                self.active.add(path)
+                return Workspace(path, estimate)
+            except OSError as e:
+                print(f"Cannot use tmpfs workspace {path}, falling back to disk: {e}")
+        path = os.path.join(temp_dir, "jobs", name)
+        self._make(path)
+        self.active.add(path)
+        return Workspace(path)
+
+    def adopt(self, path: str, tmpfs_bytes: int = 0) -> Workspace:
+        """Take over the workspace an earlier attempt of the job left behind"""
+        self._write_owner(path)
+        self.tmpfs_reserved += tmpfs_bytes
+        self.active.add(path)
+        return Workspace(path, tmpfs_bytes)
+
+    def detach(self, workspace: Workspace):
+        """Keep the workspace on disk for a later attempt, which adopts it again"""
+        self.tmpfs_reserved -= workspace.tmpfs_bytes
+        workspace.tmpfs_bytes = 0
+        self.active.discard(workspace.path)
+
+    def remove(self, workspace: Optional[Workspace]):
+        if workspace is None:
+            return
+        self.detach(workspace)
+        shutil.rmtree(workspace.path, ignore_errors=True)
+
+    def in_use(self, path: str) -> bool:
+        """Whether a running job may still use the workspace, in this process or in another live one"""
+        if path in self.active:
+            return True
+        owner = self._read_owner(path)
+        if owner is not None and owner.get("pid") == os.getpid() and owner.get("token") == self.token:
+            # Detached by this process for a redelivery, no job runs in it
+            return False
+        return os.path.isdir(path) and not self._is_orphan(path)
+
+    def stable_dir(self, temp_dir: str, name: str) -> str:
+        """Directory outliving single jobs, e.g. for partial downloads a redelivered message resumes"""
+        path = os.path.join(temp_dir, name)
+        os.makedirs(path, exist_ok=True)
+        self.stable_dirs.add(path)
+        return path
+
+    def sweep(self, temp_dirs: Iterable[str], keep: Iterable[str] = ()) -> int:
+        """
+        Remove workspaces whose owning process is gone and stable files past WORKSPACE_MAX_AGE_SECONDS.
+
+        :param keep: Workspaces to leave alone, e.g. the ones a redelivered message resumes from.
+
+        :return: Number of entries removed.
+        """
+        roots = list(temp_dirs)
+        if self.tmpfs_dir:
+            roots += [os.path.join(self.tmpfs_dir, os.path.basename(root.rstrip(os.sep))) for root in roots]
+        keep = set(keep)
+        removed = 0
+        for root in roots:
+            jobs_dir = os.path.join(root, "jobs")
+            if not os.path.isdir(jobs_dir):
+                continue
+            for name in os.listdir(jobs_dir):
+                path = os.path.join(jobs_dir, name)
+                if path not in keep and self._is_orphan(path):
+                    print(f"Removing orphaned workspace {path}")
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+        for stable_dir in sorted(self.stable_dirs):
+            if not os.path.isdir(stable_dir):
+                continue
+            for name in os.listdir(stable_dir):
+                path = os.path.join(stable_dir, name)
+                if self._age(path) > self.max_age:
+                    print(f"Removing stale {path}")
+                    self._remove_path(path)
+                    removed += 1
+        return removed
+
+    def _fits_tmpfs(self, estimate: Optional[int]) -> bool:
+        return (
+            bool(self.tmpfs_dir)
+            and estimate is not None
+            and estimate <= self.tmpfs_max_job_bytes
+            and self.tmpfs_reserved + estimate <= self.tmpfs_budget_bytes
+        )
+
+    def _make(self, path: str):
+        os.makedirs(path)
+        self._write_owner(path)
+
+    def _write_owner(self, path: str):
+        with open(os.path.join(path, OWNER_FILE), "w") as owner_file:
+            json.dump({"hostname": self.hostname, "pid": os.getpid(), "token": self.token, "created": time.time()}, owner_file)
+
+    def _read_owner(self, path: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(path, OWNER_FILE)) as owner_file:
+                return json.load(owner_file)
+        except (OSError, ValueError):
+            return None
+
+    def _is_orphan(self, path: str) -> bool:
+        owner = self._read_owner(path)
+        if owner is None:
+            # Crashed before the marker was written, or not a workspace at all
+            return self._age(path) > 60
+        if time.time() - owner.get("created", 0) > self.max_age:
+            return True
+        if owner.get("hostname") != self.hostname:
+            # Another host sharing the directory sweeps its own workspaces
+            return False
+        if owner.get("pid") == os.getpid():
+            return owner.get("token") != self.token
+        return not self._is_alive(owner.get("pid"))
+
+    def _is_alive(self, pid) -> bool:
+        if not isinstance(pid, int):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _age(self, path: str) -> float:
+        try:
+            return time.time() - os.path.getmtime(path)
+        except OSError:
+            return 0.0
+
+    def _remove_path(self, path: str):
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _safe_name(self, download: HyperloopDownload) -> str:
+        name = "".join(c if c.isalnum() or c in "-_" else "_" for c in str(download.id))
+        return name[:64] or "job"
+
+
+# Shared instance used by all processors
+workspace_manager = WorkspaceManager()
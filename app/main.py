@@ -1,7 +1,89 @@
 # app/main.py
+import asyncio
 import os
 from faststream import FastStream
-from app.processors.download_router import broker
+from app.helpers.browser_pool import browser_pool
+from app.helpers.http_client import http_client
+from app.helpers.graceful_shutdown import graceful_shutdown
+from app.helpers.metrics import start_metrics_server
+from app.helpers.step_journal import step_journal
+from app.helpers.workspace import Workspace, workspace_manager
+from app.processors.download_router import broker, processors
 
 # Create FastStream app using the broker from download_router
-app = FastStream(broker)
\ No newline at end of file
+app = FastStream(broker)
+
+# Periodic pruning of the step journal, cancelled on shutdown
+journal_pruning = None
+
+
+@app.on_startup
+async def start_http_client():
+    """Open the shared HTTP connection pool before consuming messages"""
+    await http_client.start()
+
+
+def prune_step_journal():
+    """Drop expired journal entries with their workspaces, except the ones a running job still uses"""
+    for expired in step_journal.prune(in_use=workspace_manager.in_use):
+        workspace_manager.remove(Workspace(expired["workspace"]))
+
+
+async def prune_step_journal_periodically():
+    """Expire the entries of messages that never came back while the minion keeps running"""
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(step_journal.prune_interval)
+        try:
+            # Removing workspaces can take a while, keep it off the event loop
+            await loop.run_in_executor(None, prune_step_journal)
+        except Exception as e:
+            print(f"Error pruning step journal: {e}")
+
+
+@app.on_startup
+async def sweep_workspaces():
+    """Remove the job workspaces a crashed or killed process left behind, except the ones to resume"""
+    prune_step_journal()
+    removed = workspace_manager.sweep(
+        (processor.temp_dir for processor in processors.values()), keep=step_journal.workspaces()
+    )
+    if removed:
+        print(f"Removed {removed} orphaned workspace(s)")
+
+
+@app.on_startup
+async def start_journal_pruning():
+    global journal_pruning
+    if step_journal.enabled:
+        journal_pruning = asyncio.ensure_future(prune_step_journal_periodically())
+
+
+@app.on_startup
+async def start_metrics():
+    """Expose the Prometheus metrics endpoint"""
+    start_metrics_server()
+
+
+@app.on_shutdown
+async def drain_jobs():
+    """Let running jobs finish before the broker stops, the rest are requeued and resume from the journal"""
+    await graceful_shutdown.drain()
+
+
+@app.after_shutdown
+async def stop_journal_pruning():
+    if journal_pruning is not None:
+        journal_pruning.cancel()
+
+
+@app.after_shutdown
+async def close_http_client():
+    """Close pooled connections once the broker has stopped"""
+    await http_client.close()
+
+
+@app.after_shutdown
+async def close_browser_pool():
+    """Close the shared headless browser"""
+    await browser_pool.close()
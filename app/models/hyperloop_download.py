@@ -10,16 +10,26 @@ class HyperloopDownload:
     dependency: str = field(default_factory=str)
     status: DownloadStatus = DownloadStatus.STARTED  # Default status is STARTED
     date: datetime = field(default_factory=datetime.now)  # Default is the current date/time
+    details: dict = field(default_factory=dict)  # Extra job information reported with status updates
+    options: dict = field(default_factory=dict)  # Optional processor specific request settings
+    progress: dict = field(default_factory=dict)  # Bytes and throughput of the running download or upload
 
     # Custom method to serialize to dict (for JSON serialization)
     def to_dict(self):
-        return {
+        data = {
             "id": self.id,
             "type": self.type,
             "dependency": self.dependency,
             "status": self.status.value,  # Convert enum to string
             "date": self.date.isoformat()  # Convert datetime to string in ISO format
         }
+        # Only include details when there are any, so existing consumers see the same payload
+        if self.details:
+            data["details"] = dict(self.details)
+        # Likewise progress is only present once bytes are moving
+        if self.progress:
+            data["progress"] = dict(self.progress)
+        return data
 
     # Custom method to deserialize from a dict (for JSON deserialization)
     @classmethod
@@ -29,5 +39,6 @@ class HyperloopDownload:
             type=data["type"],
             dependency=data["dependency"],
             status=DownloadStatus(data["status"]),  # Convert string back to enum
-            date=datetime.fromisoformat(data["date"])  # Parse ISO formatted date string
+            date=datetime.fromisoformat(data["date"]),  # Parse ISO formatted date string
+            options=data.get("options") or {}
         )
\ No newline at end of file
@@ -8,6 +8,7 @@ import os
 import shutil
 import tarfile
 import tempfile
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
 from typing import Dict, Any, Optional
@@ -15,12 +16,29 @@ from typing import Dict, Any, Optional
 from faststream import Logger
 from faststream.rabbit import RabbitBroker, RabbitQueue, RabbitMessage
 
+from app.helpers.artifact_cache import artifact_cache
+from app.helpers.compression import EXTENSIONS, compression_policy
+from app.helpers.content_hash import ContentManifest, HashingReader, HashingWriter
+from app.helpers.delivery_index import delivery_index
+from app.helpers.metrics import step_duration, transferred_bytes
 from app.helpers.nifi_uploader import NiFiUploader
+from app.helpers.progress import ProgressReporter
+from app.helpers.retry_policy import RetryPolicy
+from app.helpers.single_flight import single_flight
+from app.helpers.tar_stream import iter_tarball_stream
+from app.helpers.step_journal import step_journal
+from app.helpers.workspace import workspace_manager
 from app.models.download_status import DownloadStatus
 from app.models.hyperloop_download import HyperloopDownload
 from app.models.exceptions import UserInputError, DependencyNotFoundError, InternalError
 
 
+# Dynamic attributes of a download that describe its artifacts, journaled after every step
+JOURNALED_ATTRIBUTES = (
+    "package_dir", "package_flat", "file_path", "tarball_path", "codec", "content_sha256", "tarball_sha256"
+)
+
+
 class BaseProcessor(ABC):
     """Base class for all download processors with common functionality"""
     
@@ -29,6 +47,10 @@ class BaseProcessor(ABC):
         self.status_queue = status_queue
         self.temp_dir = temp_dir
         self.tarball_sender = NiFiUploader()
+        # Stream the tarball straight into the upload instead of staging it on disk first
+        self.stream_uploads = os.getenv("NIFI_STREAM_UPLOADS", "false").lower() == "true"
+        # Retry uploads in place before falling back to a full pipeline requeue
+        self.send_retry_policy = RetryPolicy.from_env("NIFI_SEND")
         
         # Ensure the temp directory exists
         if not os.path.exists(self.temp_dir):
@@ -36,20 +58,135 @@ class BaseProcessor(ABC):
 
     async def process(self, download: HyperloopDownload):
         """Main processing pipeline - same for all processors"""
+        # A redelivered message continues after the last step its earlier attempt completed
+        resumed_step = self._resume(download)
+        if resumed_step is None:
+            # Every path of the job lives in its own workspace, concurrent jobs never share files
+            download.workspace = workspace_manager.create(self.temp_dir, download, getattr(download, 'disk_estimate', None))
+            # SHA-256 of files hashed while downloading, by path, so packaging does not read them twice
+            download.file_hashes = {}
+        error = None
         try:
-            await self.download_step(download)
-            if download.status == DownloadStatus.FAILED:
-                return
-            
-            await self.packaging_step(download)
-            if download.status == DownloadStatus.FAILED:
-                return
-            
-            await self.sending_step(download)
-            
+            if resumed_step == "packaged":
+                download.status = DownloadStatus.SENDING
+                await self.publish_status_update(download)
+            # Pinned dependencies that were packaged before go straight to sending
+            elif resumed_step == "downloaded" or not await self.cache_step(download):
+                if resumed_step is None:
+                    with step_duration.labels(download.type, "download").time():
+                        await self.download_step(download)
+                    if download.status == DownloadStatus.FAILED:
+                        return
+                    if download.status == DownloadStatus.DONE:
+                        # Nothing new to package, e.g. an unchanged Helm repository
+                        await self.publish_status_update(download)
+                        return
+                    self._journal(download, "downloaded")
+
+                with step_duration.labels(download.type, "packaging").time():
+                    await self.packaging_step(download)
+                if download.status == DownloadStatus.FAILED:
+                    return
+                if hasattr(download, 'tarball_path') and download.tarball_path:
+                    self._journal(download, "packaged")
+
+            with step_duration.labels(download.type, "sending").time():
+                await self.sending_step(download)
+
+        except BaseException as e:
+            error = e
+            raise
         finally:
-            # Always cleanup, even if there was an error
-            self.cleanup_temp_files(download)
+            if self._keep_for_redelivery(download, error):
+                print(f"Keeping workspace {download.workspace.path} of {download.id} for the redelivery")
+                workspace_manager.detach(download.workspace)
+            else:
+                # Always cleanup, even if there was an error
+                self.cleanup_temp_files(download)
+                workspace_manager.remove(download.workspace)
+                step_journal.discard(download)
+
+    def _journal(self, download: HyperloopDownload, step: str):
+        """Record the completed step with everything a redelivery needs to continue after it"""
+        artifacts = {name: getattr(download, name) for name in JOURNALED_ATTRIBUTES if hasattr(download, name)}
+        artifacts["file_hashes"] = download.file_hashes
+        tarball_path = artifacts.get("tarball_path")
+        if tarball_path and os.path.exists(tarball_path):
+            stat = os.stat(tarball_path)
+            artifacts["tarball_size"] = stat.st_size
+            artifacts["tarball_mtime_ns"] = stat.st_mtime_ns
+        step_journal.record(
+            download, step, download.workspace.path, artifacts, self.journal_state(download), download.workspace.tmpfs_bytes
+        )
+
+    def _resume(self, download: HyperloopDownload) -> Optional[str]:
+        """Restore the job from its journal entry, returns the completed step or None to start over"""
+        entry = step_journal.load(download)
+        if entry is None:
+            return None
+        artifacts = entry["artifacts"]
+        if entry["step"] == "packaged":
+            tarball_path = artifacts.get("tarball_path")
+            # Cheap validity check, the tarball is only written before the step is recorded
+            valid = bool(tarball_path) and os.path.isfile(tarball_path) and (
+                os.stat(tarball_path).st_size == artifacts.get("tarball_size")
+                and os.stat(tarball_path).st_mtime_ns == artifacts.get("tarball_mtime_ns")
+            )
+        else:
+            valid = any(
+                artifacts.get(name) and os.path.exists(artifacts[name]) for name in ("package_dir", "file_path", "tarball_path")
+            )
+        if not valid or not os.path.isdir(entry["workspace"]):
+            print(f"Journaled artifacts of {download.id} are gone or changed, starting over")
+            shutil.rmtree(entry["workspace"], ignore_errors=True)
+            step_journal.discard(download)
+            return None
+
+        download.workspace = workspace_manager.adopt(entry["workspace"], entry.get("tmpfs_bytes", 0))
+        download.file_hashes = artifacts.get("file_hashes") or {}
+        for name in JOURNALED_ATTRIBUTES:
+            if name in artifacts:
+                setattr(download, name, artifacts[name])
+        download.details.update(entry.get("details") or {})
+        self.restore_journal_state(download, entry.get("state") or {})
+        print(f"Resuming {download.id} after its {entry['step']} step from {entry['workspace']}")
+        download.details["resumed_after"] = entry["step"]
+        return entry["step"]
+
+    def _keep_for_redelivery(self, download: HyperloopDownload, error: Optional[BaseException]) -> bool:
+        """Requeued jobs keep their journaled workspace, completed and rejected ones do not"""
+        if error is None or isinstance(error, (UserInputError, DependencyNotFoundError)):
+            return False
+        return step_journal.load(download) is not None
+
+    def journal_state(self, download: HyperloopDownload) -> dict:
+        """Processor specific state to journal with the completed steps, must be JSON serializable"""
+        return {}
+
+    def restore_journal_state(self, download: HyperloopDownload, state: dict):
+        """Restore what journal_state returned when a redelivered message resumes"""
+        pass
+
+    async def cache_step(self, download: HyperloopDownload) -> bool:
+        """Look up the packaged tarball in the artifact cache, returns True on a hit"""
+        cache_key = self.cache_key(download)
+        if cache_key is None:
+            return False
+
+        # The cached tarball keeps the codec it was packaged with
+        metadata = artifact_cache.metadata(cache_key)
+        download.codec = metadata.get("codec", "none")
+        tarball_path = self.workspace_path(download, self._tarball_name(download))
+        if not await artifact_cache.fetch(cache_key, tarball_path):
+            download.codec = "none"
+            return False
+
+        download.tarball_path = tarball_path
+        download.tarball_sha256 = artifact_cache.digest(cache_key)
+        download.content_sha256 = metadata.get("content_sha256")
+        download.status = DownloadStatus.SENDING
+        await self.publish_status_update(download)
+        return True
 
     async def download_step(self, download: HyperloopDownload):
         """Download step with common error handling"""
@@ -57,7 +194,11 @@ class BaseProcessor(ABC):
         await self.publish_status_update(download)
         
         try:
-            await self._download_dependency(download)
+            # Processors count their bytes through download.progress_reporter
+            async with self.progress_reporter(download, "download") as progress:
+                download.progress_reporter = progress
+                await self._download_dependency(download)
+            transferred_bytes.labels(download.type, "downloaded").inc(progress.bytes)
         except DependencyNotFoundError:
             # Re-raise dependency not found errors
             raise
@@ -73,44 +214,136 @@ class BaseProcessor(ABC):
         await self.publish_status_update(download)
         
         try:
+            cache_key = self.cache_key(download)
             # Skip packaging if tarball already exists (e.g., Docker processor)
-            if not hasattr(download, 'tarball_path') or not download.tarball_path:
-                tarball_path = await self._create_tarball(download)
-                download.tarball_path = tarball_path
-            else:
+            if hasattr(download, 'tarball_path') and download.tarball_path:
+                download.codec = "none"
                 print(f"Tarball already created at {download.tarball_path}, skipping packaging step")
+            else:
+                # Fails early if there is nothing to package
+                content_path = self._tarball_content(download)
+                loop = asyncio.get_event_loop()
+                download.codec = await loop.run_in_executor(
+                    None, compression_policy.choose, download.type, content_path
+                )
+                if self.stream_uploads and cache_key is None:
+                    # The tarball itself is built while sending, so its content hash is only
+                    # known up front when every file was hashed on download
+                    print(f"Streaming mode enabled, {download.type} tarball will be packaged during upload")
+                    download.content_sha256 = self._known_content_sha256(download, content_path)
+                else:
+                    tarball_path = await self._create_tarball(download)
+                    download.tarball_path = tarball_path
+                    transferred_bytes.labels(download.type, "packaged").inc(os.path.getsize(tarball_path))
+
+            if cache_key is not None and hasattr(download, 'tarball_path') and download.tarball_path:
+                await artifact_cache.store(
+                    cache_key, download.tarball_path,
+                    {"codec": download.codec, "content_sha256": getattr(download, 'content_sha256', None)},
+                    getattr(download, 'tarball_sha256', None)
+                )
         except Exception as e:
             download.status = DownloadStatus.FAILED
             await self.publish_status_update(download)
             raise InternalError(f"Packaging error: {str(e)}")
 
     async def sending_step(self, download: HyperloopDownload):
-        """Sending step with common error handling"""
+        """Sending step, transient failures are retried in place so the tarball is not rebuilt"""
+        started = time.monotonic()
+        attempt = 0
         try:
-            response = await self.tarball_sender.send_tarball(download.tarball_path, download)
-            if response.status_code == 200:
-                download.status = DownloadStatus.DONE
-                # Clean up tarball only after successful upload
-                self.cleanup_tarball(download)
-            else:
-                download.status = DownloadStatus.FAILED
-                raise InternalError(f"NiFi upload failed with status code: {response.status_code}")
+            if self._deduplicated(download):
+                return
+            while True:
+                attempt += 1
+                try:
+                    response = await self._send(download)
+                    if response.status_code == 200:
+                        download.status = DownloadStatus.DONE
+                        self._record_delivery(download)
+                        # Clean up tarball only after successful upload
+                        self.cleanup_tarball(download)
+                        return
+                    error = f"NiFi upload failed with status code: {response.status_code}"
+                    retryable = response.status_code >= 500 or response.status_code in (408, 429)
+                except Exception as e:
+                    error = str(e)
+                    retryable = True
+
+                delay = self.send_retry_policy.backoff(attempt)
+                if not retryable or not self.send_retry_policy.should_retry(attempt, time.monotonic() - started, delay):
+                    download.status = DownloadStatus.FAILED
+                    raise InternalError(f"Sending error after {attempt} attempt(s): {error}")
+
+                print(f"Upload attempt {attempt} for {download.dependency} failed ({error}), retrying in {delay:.1f}s")
+                download.details["send_retries"] = attempt
+                download.details["send_retry_delay"] = round(delay, 2)
+                await self.publish_status_update(download)
+                await asyncio.sleep(delay)
+        except InternalError:
+            raise
         except Exception as e:
             download.status = DownloadStatus.FAILED
             raise InternalError(f"Sending error: {str(e)}")
         finally:
+            # A failed upload keeps its tarball, the workspace is kept for the redelivery or removed with the job
             await self.publish_status_update(download)
-            # Clean up tarball in case of failure (if it still exists)
-            if download.status == DownloadStatus.FAILED:
-                self.cleanup_tarball(download)
+
+    async def _send(self, download: HyperloopDownload):
+        """Upload the packaged tarball, from disk or streamed while packaging"""
+        if hasattr(download, 'tarball_path') and download.tarball_path:
+            total = os.path.getsize(download.tarball_path)
+            async with self.progress_reporter(download, "upload", total) as progress:
+                response = await self.tarball_sender.send_tarball(
+                    download.tarball_path, download, on_chunk=progress.advance
+                )
+        else:
+            # The size of a streamed tarball is only known once it is complete
+            async with self.progress_reporter(download, "upload") as progress:
+                response = await self.tarball_sender.send_stream(
+                    self._stream_tarball(download), self._tarball_name(download), download, on_chunk=progress.advance
+                )
+            if response.status_code == 200:
+                # Streamed tarballs are packaged exactly once, by the upload that succeeded
+                transferred_bytes.labels(download.type, "packaged").inc(progress.bytes)
+        if response.status_code == 200:
+            transferred_bytes.labels(download.type, "uploaded").inc(progress.bytes)
+        return response
+
+    def _deduplicated(self, download: HyperloopDownload) -> bool:
+        """Skip the upload when the same content was delivered to the endpoint before, returns True if skipped"""
+        content_sha256 = getattr(download, 'content_sha256', None)
+        if content_sha256 is None or download.options.get("force_upload", False):
+            return False
+        delivery = delivery_index.lookup(self.tarball_sender.endpoint_url, download.type, content_sha256)
+        if delivery is None:
+            return False
+
+        print(f"Content {content_sha256[:12]} of {download.dependency} was delivered before as "
+              f"{delivery['dependency']}, skipping the upload")
+        if hasattr(download, 'tarball_path') and download.tarball_path and os.path.exists(download.tarball_path):
+            transferred_bytes.labels(download.type, "deduplicated").inc(os.path.getsize(download.tarball_path))
+        download.status = DownloadStatus.DONE
+        download.details["deduplicated"] = True
+        download.details["content_sha256"] = content_sha256
+        self.cleanup_tarball(download)
+        return True
+
+    def _record_delivery(self, download: HyperloopDownload):
+        # Streamed tarballs are hashed while uploading, the digest is complete once the upload is
+        content_sha256 = getattr(download, 'content_sha256', None)
+        if content_sha256 is not None:
+            delivery_index.record(self.tarball_sender.endpoint_url, download.type, content_sha256, download.dependency)
+
+    def progress_reporter(self, download: HyperloopDownload, phase: str, total: Optional[int] = None) -> ProgressReporter:
+        """Throttled progress events of one phase, published as regular status updates"""
+        return ProgressReporter(download, phase, self.publish_status_update, total)
 
     async def _create_tarball(self, download: HyperloopDownload) -> str:
         """Create a tarball from the downloaded content"""
-        sanitized_name = self.sanitize_filename(download.dependency)
-        tarball_name = f"{sanitized_name}.tar"
-        tarball_path = os.path.join(self.temp_dir, tarball_name)
+        tarball_path = self.workspace_path(download, self._tarball_name(download))
         
-        print(f"Creating tarball for {download.type} dependency...")
+        print(f"Creating tarball for {download.type} dependency (codec: {getattr(download, 'codec', 'none')})...")
         
         # Run tarball creation in thread pool to avoid blocking
         loop = asyncio.get_event_loop()
@@ -121,15 +354,92 @@ class BaseProcessor(ABC):
 
     def _create_tarball_sync(self, tarball_path: str, download: HyperloopDownload):
         """Synchronous tarball creation to be run in thread pool"""
-        with tarfile.open(tarball_path, "w") as tarball:
-            if hasattr(download, 'package_dir') and os.path.exists(download.package_dir):
-                # Directory-based content
-                tarball.add(download.package_dir, arcname=os.path.basename(download.package_dir))
-            elif hasattr(download, 'file_path') and os.path.exists(download.file_path):
-                # Single file content
-                tarball.add(download.file_path, arcname=os.path.basename(download.file_path))
-            else:
-                raise InternalError("No content to package into tarball")
+        with open(tarball_path, "wb") as tarball_file:
+            self._write_tarball(tarball_file, self._tarball_content(download), download)
+
+    def _stream_tarball(self, download: HyperloopDownload):
+        """Produce the tarball incrementally as an async iterator of bytes"""
+        content_path = self._tarball_content(download)
+        return iter_tarball_stream(lambda fileobj: self._write_tarball(fileobj, content_path, download))
+
+    def _write_tarball(self, fileobj, content_path: str, download: HyperloopDownload):
+        """Write the tarball into fileobj, hashing the files and the tarball in the same pass"""
+        manifest = ContentManifest()
+        hashed = HashingWriter(fileobj)
+        # "w|" writes a pure stream, the file object is never seeked
+        with compression_policy.writer(hashed, getattr(download, 'codec', 'none')) as compressed:
+            with tarfile.open(fileobj=compressed, mode="w|") as tarball:
+                self._add_to_tarball(tarball, content_path, download, manifest)
+        manifest.tarball_sha256 = hashed.hexdigest()
+        self._set_manifest(download, manifest)
+
+    def _add_to_tarball(self, tarball: tarfile.TarFile, content_path: str, download: HyperloopDownload,
+                        manifest: ContentManifest):
+        """Add the content to the tarball and its files to the manifest"""
+        for path, arcname in self._archive_entries(content_path, download):
+            tarinfo = tarball.gettarinfo(path, arcname)
+            if tarinfo.islnk() and tarinfo.linkname in manifest.files:
+                # Hard links are stored once, e.g. blobs linked from a cache
+                manifest.files[arcname] = dict(manifest.files[tarinfo.linkname])
+            if not tarinfo.isreg():
+                tarball.addfile(tarinfo)
+                continue
+            with open(path, "rb") as source:
+                if path in download.file_hashes:
+                    tarball.addfile(tarinfo, source)
+                    sha256 = download.file_hashes[path]
+                else:
+                    reader = HashingReader(source)
+                    tarball.addfile(tarinfo, reader)
+                    sha256 = reader.hexdigest()
+            manifest.add(arcname, sha256, tarinfo.size)
+
+    def _archive_entries(self, content_path: str, download: HyperloopDownload):
+        """(path, arcname) of everything packaged, in the order tarfile.add would add them"""
+        if getattr(download, 'package_flat', False) and os.path.isdir(content_path):
+            # Flat packages put the directory entries at the archive root
+            roots = [(os.path.join(content_path, entry), entry) for entry in sorted(os.listdir(content_path))]
+        else:
+            roots = [(content_path, os.path.basename(content_path))]
+        for path, arcname in roots:
+            yield from self._walk_entry(path, arcname)
+
+    def _walk_entry(self, path: str, arcname: str):
+        yield path, arcname
+        if os.path.isdir(path) and not os.path.islink(path):
+            for entry in sorted(os.listdir(path)):
+                yield from self._walk_entry(os.path.join(path, entry), f"{arcname}/{entry}")
+
+    def _known_content_sha256(self, download: HyperloopDownload, content_path: str) -> Optional[str]:
+        """Content digest from the hashes taken while downloading, None unless every file was hashed"""
+        manifest = ContentManifest()
+        for path, arcname in self._archive_entries(content_path, download):
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            if path not in download.file_hashes:
+                return None
+            manifest.add(arcname, download.file_hashes[path], os.path.getsize(path))
+        return manifest.content_sha256
+
+    def _set_manifest(self, download: HyperloopDownload, manifest: ContentManifest):
+        """Keep the hashes with the job and in the manifest file of its workspace"""
+        download.content_sha256 = manifest.content_sha256
+        download.tarball_sha256 = manifest.tarball_sha256
+        manifest.write(self.workspace_path(download, "manifest.json"))
+
+    def _tarball_content(self, download: HyperloopDownload) -> str:
+        """Return the directory or file that should be packaged into the tarball"""
+        if hasattr(download, 'package_dir') and os.path.exists(download.package_dir):
+            # Directory-based content
+            return download.package_dir
+        elif hasattr(download, 'file_path') and os.path.exists(download.file_path):
+            # Single file content
+            return download.file_path
+        raise InternalError("No content to package into tarball")
+
+    def _tarball_name(self, download: HyperloopDownload) -> str:
+        """File name used for the packaged tarball"""
+        return f"{self.sanitize_filename(download.dependency)}{EXTENSIONS[getattr(download, 'codec', 'none')]}"
 
     def cleanup_temp_files(self, download: HyperloopDownload):
         """Clean up temporary files and directories"""
@@ -162,16 +472,49 @@ class BaseProcessor(ABC):
         except Exception as e:
             print(f"Error cleaning up tarball: {e}")
 
+    def cache_key(self, download: HyperloopDownload) -> Optional[str]:
+        """
+        Normalized artifact cache key for immutable dependencies.
+
+        Returns None when the dependency may change upstream and must not be cached.
+        Processors override this for the coordinates they know to be pinned.
+        """
+        return None
+
+    async def disk_estimate(self, download: HyperloopDownload) -> Optional[int]:
+        """
+        Expected peak disk usage of the job for admission control, None when unknown.
+
+        The tarball takes about the size of the downloaded content again, unless it is streamed.
+        """
+        try:
+            size = await self.estimate_content_size(download)
+        except Exception as e:
+            print(f"Could not estimate the size of {download.dependency}: {e}")
+            return None
+        if size is None:
+            return None
+        return size if self.stream_uploads and self.cache_key(download) is None else 2 * size
+
+    async def estimate_content_size(self, download: HyperloopDownload) -> Optional[int]:
+        """Bytes the download step will write, processors override this when they can tell cheaply"""
+        return None
+
+    def workspace_path(self, download: HyperloopDownload, name: str) -> str:
+        """Path of a file or directory inside the workspace of the job"""
+        return os.path.join(download.workspace.path, name)
+
     def sanitize_filename(self, filename: str) -> str:
         """Sanitize filename for safe file saving"""
         return filename.replace("/", "_").replace(":", "_").replace(".", "_")
 
     async def publish_status_update(self, download: HyperloopDownload):
-        """Publish status updates using FastStream broker"""
-        await self.broker.publish(
-            download.to_dict(),
-            queue=self.status_queue
-        )
+        """Publish status updates using FastStream broker, also on behalf of coalesced requests"""
+        for update in [download] + single_flight.followers_of(download):
+            await self.broker.publish(
+                update.to_dict(),
+                queue=self.status_queue
+            )
 
     @abstractmethod
     async def _download_dependency(self, download: HyperloopDownload):
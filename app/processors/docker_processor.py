@@ -1,14 +1,37 @@
 import os
 import asyncio
+import hashlib
+import aiohttp
 import docker
+import requests
+from app.helpers.content_hash import ContentManifest
+from app.helpers.docker_layer_cache import (
+    DockerImageCache, layer_cache_dir, layer_cache_max_bytes, registry_layer_cache
+)
+from app.helpers.oci_registry import (
+    ImageReference, RegistryClient, RegistryError, RegistryNotFoundError, write_image_layout
+)
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
+# docker save writes layers uncompressed, registries report them gzip compressed
+UNCOMPRESSED_LAYER_RATIO = 2.5
+
 
 class DockerProcessor(BaseProcessor):
     def __init__(self, broker, status_queue):
         super().__init__(broker, status_queue, "/tmp/docker-images/")
         self.docker_client = None  # Initialize lazily when first needed
+        # "daemon" pulls through the Docker engine, "registry" talks to the registry directly
+        self.backend = os.getenv("DOCKER_BACKEND", "daemon").lower()
+        self.registry_client = RegistryClient()
+        self.max_concurrent_blobs = int(os.getenv("DOCKER_REGISTRY_MAX_CONCURRENT_BLOBS", "4"))
+        # Pulled images stay in the engine for later jobs until the layer cache budget is exceeded
+        self.image_cache = DockerImageCache(layer_cache_dir, layer_cache_max_bytes) if self.backend != "registry" else None
+        # Size estimates read the image manifests, which Docker Hub counts towards the pull rate limit.
+        # The registry backend reuses them for the download, the daemon fetches them again when pulling
+        estimate_default = "true" if self.backend == "registry" else "false"
+        self.estimate_from_registry = os.getenv("DOCKER_ESTIMATE_FROM_REGISTRY", estimate_default).lower() == "true"
 
     def _get_docker_client(self):
         """Lazy initialization of Docker client"""
@@ -16,10 +39,62 @@ class DockerProcessor(BaseProcessor):
             self.docker_client = docker.from_env(timeout=300)  # 5 minute timeout for Docker operations
         return self.docker_client
 
+    def cache_key(self, download):
+        """Only digest references are immutable, tags can be moved"""
+        references = self._image_references(download)
+        if not references or any("@sha256:" not in reference for reference in references):
+            return None
+        return f"DOCKER:{','.join(sorted(references))}"
+
+    async def disk_estimate(self, download):
+        """Layer sizes from the image manifests, the daemon saves them uncompressed straight into the tarball"""
+        if not self.estimate_from_registry:
+            return None
+        try:
+            images = [ImageReference.parse(reference) for reference in self._image_references(download)]
+            manifests = await asyncio.gather(*(self._get_manifest(download, image) for image in images))
+        except Exception as e:
+            print(f"Could not estimate the size of {download.dependency}: {e}")
+            return None
+        sizes = {}
+        for resolved in manifests:
+            manifest = resolved["manifest"]
+            for descriptor in [manifest["config"]] + manifest["layers"]:
+                sizes[descriptor["digest"]] = descriptor.get("size", 0)
+        size = sum(sizes.values())
+        if self.backend != "registry":
+            return int(size * UNCOMPRESSED_LAYER_RATIO)
+        return size if self.stream_uploads and self.cache_key(download) is None else 2 * size
+
+    async def _get_manifest(self, download, image):
+        """Manifest of the image, fetched once per job for the estimate and the download"""
+        if not hasattr(download, 'docker_manifests'):
+            download.docker_manifests = {}
+        if str(image) not in download.docker_manifests:
+            download.docker_manifests[str(image)] = await self.registry_client.get_manifest(image)
+        return download.docker_manifests[str(image)]
+
+    def _image_references(self, download):
+        """
+        Images of the request: options.images lists full references, options.tags lists tags
+        of the repository named by dependency, otherwise dependency is the single image.
+        """
+        options = download.options or {}
+        if options.get("images"):
+            return list(dict.fromkeys(str(reference).strip() for reference in options["images"]))
+        if options.get("tags"):
+            return list(dict.fromkeys(f"{download.dependency.strip()}:{str(tag).strip()}" for tag in options["tags"]))
+        return [download.dependency.strip()]
+
     async def _download_dependency(self, download):
-        """Download Docker image and save it as a tarball"""
-        docker_image = download.dependency
-        print(f"Pulling Docker image {docker_image}...")
+        """Download Docker images and save them as a single tarball"""
+        if self.backend == "registry":
+            await self._download_from_registry(download)
+            return
+
+        docker_images = self._image_references(download)
+        print(f"Pulling Docker images {', '.join(docker_images)}...")
+        docker_image = docker_images[0]
 
         try:
             # Get Docker client (lazy initialization)
@@ -28,51 +103,159 @@ class DockerProcessor(BaseProcessor):
             # Run Docker operations in thread pool to avoid blocking
             loop = asyncio.get_event_loop()
             
-            # Pull the image
-            await loop.run_in_executor(None, client.images.pull, docker_image)
-            print(f"Docker image {docker_image} downloaded successfully.")
-            
-            # Save the image to a tarball
-            sanitized_name = self.sanitize_filename(docker_image)
-            tarball_name = f"{sanitized_name}.tar"
-            tarball_path = os.path.join(self.temp_dir, tarball_name)
-            
-            print(f"Saving Docker image {docker_image} to tarball {tarball_path}...")
-            
-            # Run the save operation in thread pool
-            await loop.run_in_executor(None, self._save_docker_image, docker_image, tarball_path)
-            
-            print(f"Docker image {docker_image} saved to tarball {tarball_path}.")
+            known_layers = self.image_cache.known_layers()
+            for docker_image in docker_images:
+                self.image_cache.pin(docker_image)
+            try:
+                hits = total = 0
+                for docker_image in docker_images:
+                    # Pull the image
+                    image = await loop.run_in_executor(None, client.images.pull, docker_image)
+                    print(f"Docker image {docker_image} downloaded successfully.")
+                    layers = self.image_cache.record(docker_image, image)
+                    hits += sum(1 for layer in layers if layer in known_layers)
+                    total += len(layers)
+                    known_layers.update(layers)
+                self._report_layer_cache(download, hits, total)
+
+                # Save the images to a single tarball
+                sanitized_name = self.sanitize_filename(download.dependency)
+                tarball_name = f"{sanitized_name}.tar"
+                tarball_path = self.workspace_path(download, tarball_name)
+
+                print(f"Saving Docker images to tarball {tarball_path}...")
+
+                # Run the save operation in thread pool, its progress is the growing tarball
+                download.progress_reporter.watch(tarball_path)
+                tarball_sha256 = await loop.run_in_executor(None, self._save_docker_image, docker_images, tarball_path)
+
+                print(f"Docker images saved to tarball {tarball_path}.")
+            finally:
+                for reference in docker_images:
+                    self.image_cache.unpin(reference)
+                await loop.run_in_executor(None, self._evict_images)
             
             # Store the tarball path directly - Docker creates final tarball, no need for packaging step
             download.tarball_path = tarball_path
+            manifest = ContentManifest()
+            manifest.add(tarball_name, tarball_sha256, os.path.getsize(tarball_path))
+            manifest.tarball_sha256 = tarball_sha256
+            self._set_manifest(download, manifest)
             
         except docker.errors.NotFound:
             raise DependencyNotFoundError(f"Docker image {docker_image} does not exist")
         except docker.errors.APIError as e:
             raise InternalError(f"Docker API error: {str(e)}")
 
-    def _save_docker_image(self, docker_image: str, tarball_path: str):
-        """Synchronous Docker image save to be run in thread pool"""
-        client = self._get_docker_client()
-        image = client.images.get(docker_image)
-        with open(tarball_path, "wb") as tarball_file:
-            for chunk in image.save(named=True):
-                tarball_file.write(chunk)
+    async def _download_from_registry(self, download):
+        """Fetch the images over the OCI distribution API into a docker load compatible layout"""
+        try:
+            images = [ImageReference.parse(reference) for reference in self._image_references(download)]
+        except ValueError as e:
+            raise DependencyNotFoundError(f"Invalid Docker image reference in {download.dependency}: {str(e)}")
+
+        package_dir = self.workspace_path(download, self.sanitize_filename(download.dependency))
+        blob_dir = os.path.join(package_dir, "blobs", "sha256")
+        if not os.path.exists(blob_dir):
+            os.makedirs(blob_dir)
+
+        print(f"Fetching Docker images {', '.join(str(image) for image in images)} from registry...")
+
+        try:
+            manifests = await asyncio.gather(*(self._get_manifest(download, image) for image in images))
+            # Layers repeat within and across images, fetch and package every blob only once
+            blobs = {}
+            sizes = {}
+            for image, resolved in zip(images, manifests):
+                manifest = resolved["manifest"]
+                for descriptor in [manifest["config"]] + manifest["layers"]:
+                    blobs.setdefault(descriptor["digest"], image)
+                    sizes[descriptor["digest"]] = descriptor.get("size", 0)
+            hits = await self._fetch_blobs(
+                list(blobs.items()), blob_dir, sizes, download.progress_reporter, download.file_hashes
+            )
+            self._report_layer_cache(download, hits, len(blobs))
+            write_image_layout(package_dir, [
+                {"manifest": resolved, "repo_tag": image.repo_tag} for image, resolved in zip(images, manifests)
+            ])
+        except RegistryNotFoundError as e:
+            raise DependencyNotFoundError(f"Docker image {download.dependency} does not exist: {str(e)}")
+        except (RegistryError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise InternalError(f"Docker registry error: {str(e)}")
+
+        print(f"Docker images of {download.dependency} fetched ({len(blobs)} unique blobs).")
+        # The layout directory is packaged at the archive root, exactly as docker load expects
+        download.package_dir = package_dir
+        download.package_flat = True
+
+    async def _fetch_blobs(self, blobs, blob_dir, sizes, progress, file_hashes) -> int:
+        """
+        Download (digest, image) blobs concurrently, bounded by max_concurrent_blobs.
+
+        Only blobs missing from the layer cache count towards the progress total. Blobs are
+        verified against their digest, which is recorded in file_hashes without hashing them again.
+
+        :return: Number of blobs served from the layer cache.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_blobs)
+
+        async def fetch(digest, image):
+            destination = os.path.join(blob_dir, digest.split(":", 1)[1])
+            file_hashes[destination] = digest.split(":", 1)[1]
+            if await registry_layer_cache.fetch_blob(digest, destination):
+                return True
+            progress.expect(sizes.get(digest, 0))
+            async with semaphore:
+                await self.registry_client.download_blob(image, digest, destination, on_chunk=progress.advance)
+            await registry_layer_cache.add_blob(digest, destination)
+            return False
 
-    def cleanup_temp_files(self, download):
-        """Override cleanup to also remove Docker images"""
+        tasks = [asyncio.ensure_future(fetch(digest, image)) for digest, image in blobs]
         try:
-            # Remove the Docker image (only if Docker client was initialized)
-            if self.docker_client is not None:
-                client = self._get_docker_client()
-                image = client.images.get(download.dependency)
-                client.images.remove(image.id)
-                print(f"Docker image {download.dependency} removed.")
-        except docker.errors.ImageNotFound:
-            print(f"Docker image {download.dependency} not found, skipping removal.")
+            return sum(await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def _report_layer_cache(self, download, hits: int, total: int):
+        """Expose how much of the image was already on this minion"""
+        download.details["layer_cache_hits"] = hits
+        download.details["layer_cache_hit_ratio"] = round(hits / total, 3) if total else 0.0
+        print(f"Docker layer cache served {hits}/{total} layers of {download.dependency}")
+
+    def _evict_images(self):
+        """Keep the engine within the layer cache budget, to be run in thread pool"""
+        try:
+            self.image_cache.evict(self._get_docker_client())
         except Exception as e:
-            print(f"Error removing Docker image: {e}")
-        
-        # Call parent cleanup
-        super().cleanup_temp_files(download) 
\ No newline at end of file
+            print(f"Error evicting Docker images: {e}")
+
+    def _save_docker_image(self, docker_images, tarball_path: str):
+        """
+        Synchronous Docker image save to be run in thread pool.
+
+        Several images are exported in one call so the engine writes shared layers only once.
+
+        :return: SHA-256 of the tarball, hashed while it is written.
+        """
+        client = self._get_docker_client()
+        if len(docker_images) == 1:
+            chunks = client.images.get(docker_images[0]).save(named=True)
+        else:
+            # docker-py only exposes the single image export, the engine endpoint takes a list of names.
+            # APIClient is a requests session bound to the engine, so it is called through the requests API
+            url = f"{client.api.base_url}/v{client.api.api_version}/images/get"
+            response = client.api.get(url, params={"names": docker_images}, stream=True)
+            try:
+                response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                raise docker.errors.create_api_error_from_http_exception(e)
+            chunks = response.iter_content(chunk_size=2 * 1024 * 1024)
+        sha256 = hashlib.sha256()
+        with open(tarball_path, "wb") as tarball_file:
+            for chunk in chunks:
+                tarball_file.write(chunk)
+                sha256.update(chunk)
+        return sha256.hexdigest()
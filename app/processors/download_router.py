@@ -9,8 +9,13 @@ import json
 from typing import Dict, Any
 
 from faststream import Logger, ContextRepo
-from faststream.rabbit import RabbitBroker, RabbitQueue, RabbitMessage
+from faststream.rabbit import RabbitBroker, RabbitQueue, RabbitMessage, Channel
 
+from app.helpers.disk_budget import disk_budget
+from app.helpers.graceful_shutdown import graceful_shutdown
+from app.helpers.job_scheduler import JobScheduler
+from app.helpers.metrics import jobs_in_flight, messages, observe_completion, temp_dir_collector
+from app.helpers.single_flight import single_flight
 from app.models.hyperloop_download import HyperloopDownload
 from app.models.exceptions import UserInputError, DependencyNotFoundError, InternalError
 from app.processors.docker_processor import DockerProcessor
@@ -46,7 +51,27 @@ file_download_processor = FileDownloadProcessor(broker, download_status_queue.na
 helm_chart_processor = HelmChartProcessor(broker, download_status_queue.name)
 website_pdf_processor = WebsitePdfProcessor(broker, download_status_queue.name)
 
-@broker.subscriber(download_request_queue)
+processors = {
+    "DOCKER": docker_processor,
+    "MAVEN": maven_processor,
+    "PYTHON": python_package_processor,
+    "NPM": npm_package_processor,
+    "FILE": file_download_processor,
+    "HELM": helm_chart_processor,
+    "WEBSITE": website_pdf_processor,
+}
+
+temp_dir_collector.temp_dirs.update({
+    download_type: processor.temp_dir for download_type, processor in processors.items()
+})
+
+# Per-type concurrency limits, the prefetch lets every type fill its own slots
+job_scheduler = JobScheduler()
+
+@broker.subscriber(
+    download_request_queue,
+    channel=Channel(prefetch_count=job_scheduler.prefetch_count)
+)
 async def handle_download_request(
     message: str,
     logger: Logger,
@@ -54,6 +79,7 @@ async def handle_download_request(
     raw_message: RabbitMessage
 ):
     """Handle download requests from the queue with proper error handling"""
+    download = None
     try:
         # Parse the message
         if isinstance(message, str):
@@ -69,40 +95,110 @@ async def handle_download_request(
         if download.type not in valid_types:
             raise UserInputError(f"Invalid download type: {download.type}. Valid types: {valid_types}")
         
-        # Route to appropriate processor based on type
-        if download.type == "DOCKER":
-            await docker_processor.process(download)
-        elif download.type == "MAVEN":
-            await maven_processor.process(download)
-        elif download.type == "PYTHON":
-            await python_package_processor.process(download)
-        elif download.type == "NPM":
-            await npm_package_processor.process(download)
-        elif download.type == "FILE":
-            await file_download_processor.process(download)
-        elif download.type == "HELM":
-            await helm_chart_processor.process(download)
-        elif download.type == "WEBSITE":
-            await website_pdf_processor.process(download)
-            
+        # Messages delivered while shutting down are left to the next consumer, after a pause so the
+        # broker does not redeliver them to this consumer in a tight loop until it stops
+        if graceful_shutdown.draining:
+            await asyncio.sleep(job_scheduler.requeue_delay)
+            await raw_message.nack(requeue=True)
+            messages.labels(download.type, "requeue").inc()
+            return
+
+        # An identical request already in flight is followed instead of downloading again
+        flight = single_flight.follow(download)
+        if flight is not None:
+            logger.info(f"Coalescing {download.id} with in-flight request {flight.leader.id} for {download.dependency}")
+            await publish_status_update(download)
+            try:
+                await asyncio.shield(flight.done)
+            except (UserInputError, DependencyNotFoundError, InternalError) as e:
+                # Settle this message the same way as the leader's, under its own id
+                raise type(e)(str(e))
+            except Exception as e:
+                raise InternalError(f"Coalesced request {flight.leader.id} failed: {str(e)}")
+            _settled(download, "ack")
+            return
+
+        # A saturated type hands its message back so it does not hold a prefetch slot other types could use
+        if job_scheduler.is_saturated(download.type):
+            logger.info(f"{download.type} workers saturated, requeueing {download.id}: {job_scheduler.gauges()[download.type]}")
+            await asyncio.sleep(job_scheduler.requeue_delay)
+            await raw_message.nack(requeue=True)
+            messages.labels(download.type, "requeue").inc()
+            return
+
+        # Lead before anything is awaited, so identical requests arriving meanwhile follow this one
+        flight = single_flight.lead(download)
+        reservation = None
+        try:
+            # A job that would not fit on disk waits for running jobs to free space, then goes back to the broker
+            estimate = await processors[download.type].disk_estimate(download)
+            # Small jobs get their workspace on tmpfs when configured
+            download.disk_estimate = estimate
+            reservation = await disk_budget.admit(download.type, estimate, on_wait=lambda: publish_deferred(download))
+            download.details.pop("deferred", None)
+            if reservation is None:
+                logger.info(f"Not enough disk space for {download.id} (estimate: {estimate or 'type default'}), requeueing it")
+                # Followers go back to the broker with the leader
+                single_flight.finish(flight, InternalError(f"Not enough disk space for {download.id}"))
+                await raw_message.nack(requeue=True)
+                messages.labels(download.type, "defer").inc()
+                return
+
+            # Route to appropriate processor based on type, within that type's concurrency limit
+            async with job_scheduler.slot(download.type):
+                if graceful_shutdown.draining:
+                    await asyncio.sleep(job_scheduler.requeue_delay)
+                    raise InternalError(f"Shutting down before {download.id} started")
+                with graceful_shutdown.track(), jobs_in_flight.labels(download.type).track_inprogress():
+                    await processors[download.type].process(download)
+        except BaseException as e:
+            single_flight.finish(flight, e)
+            raise
+        finally:
+            await disk_budget.release(reservation)
+        single_flight.finish(flight)
+        _settled(download, "ack")
+
     except (UserInputError, DependencyNotFoundError) as e:
         # Reject message - don't retry for user input errors
         logger.error(f"User input error - rejecting message: {str(e)}")
         await raw_message.reject(requeue=False)
+        _settled(download, "reject")
         raise
         
     except InternalError as e:
         # Negative acknowledgment - message will be retried
         logger.error(f"Internal error - will retry: {str(e)}")
         await raw_message.nack(requeue=True)
+        _settled(download, "nack")
         raise
         
+    except asyncio.CancelledError:
+        # Cancelled by the shutdown drain, the redelivery resumes from the step journal
+        logger.warning(f"Interrupted by shutdown - will retry: {download.id if download else 'unparsed message'}")
+        await raw_message.nack(requeue=True)
+        _settled(download, "nack")
+        raise
+
     except Exception as e:
         # Unexpected error - treat as internal error and retry
         logger.error(f"Unexpected error - will retry: {str(e)}")
         await raw_message.nack(requeue=True)
+        _settled(download, "nack")
         raise
 
+def _settled(download: HyperloopDownload, outcome: str):
+    """Count how the message was settled, acked and rejected requests are complete"""
+    download_type = download.type if download is not None and download.type in processors else "UNKNOWN"
+    messages.labels(download_type, outcome).inc()
+    if outcome != "nack" and download_type != "UNKNOWN":
+        observe_completion(download, "DONE" if outcome == "ack" else "FAILED")
+
+async def publish_deferred(download: HyperloopDownload):
+    """Tell the requester the job waits for disk space instead of leaving it silent"""
+    download.details["deferred"] = "disk_space"
+    await publish_status_update(download)
+
 async def publish_status_update(download: HyperloopDownload):
     """Publish status updates to the status queue"""
     await broker.publish(
@@ -1,40 +1,260 @@
 import os
+import json
+import time
+import shutil
+import hashlib
 import asyncio
 import aiohttp
+from app.helpers.content_hash import file_sha256
+from app.helpers.http_client import http_client
+from app.helpers.workspace import workspace_manager
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
 
+class RangesIgnoredError(Exception):
+    """Raised when a server answers a range request with the full file."""
+    pass
+
+
 class FileDownloadProcessor(BaseProcessor):
     def __init__(self, broker, status_queue):
         super().__init__(broker, status_queue, "/tmp/file-downloads/")
+        self.max_segments = int(os.getenv("FILE_DOWNLOAD_SEGMENTS", "4"))
+        self.min_segment_size = int(os.getenv("FILE_DOWNLOAD_MIN_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+        self.min_chunk_size = int(os.getenv("FILE_DOWNLOAD_MIN_CHUNK_BYTES", str(64 * 1024)))
+        self.max_chunk_size = int(os.getenv("FILE_DOWNLOAD_MAX_CHUNK_BYTES", str(4 * 1024 * 1024)))
+        self.checkpoint_interval = float(os.getenv("FILE_DOWNLOAD_CHECKPOINT_SECONDS", "2"))
+        # Ranged downloads outlive the job workspace, so a redelivered message resumes them
+        self.partial_dir = workspace_manager.stable_dir(self.temp_dir, "partial")
 
     async def _download_dependency(self, download):
         """Download the file from the provided URL"""
         url = download.dependency
         file_name = os.path.basename(url) or "downloaded_file"
         sanitized_name = self.sanitize_filename(file_name)
-        download_path = os.path.join(self.temp_dir, sanitized_name)
+        download_path = self.workspace_path(download, sanitized_name)
 
         print(f"Downloading file from {url}...")
 
         try:
             timeout = aiohttp.ClientTimeout(total=600)  # 10 minute timeout for large files
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    
-                    with open(download_path, "wb") as file:
-                        async for chunk in response.content.iter_chunked(8192):
-                            file.write(chunk)
-                            
+            remote = await self._remote(download, timeout)
+            progress = download.progress_reporter
+            progress.total = remote["size"]
+
+            if remote["ranges"] and remote["size"]:
+                # Keyed by request as well, a redelivery resumes its own partial file while concurrent
+                # requests for the same URL never write into each other's
+                partial_key = hashlib.sha256(json.dumps([str(download.id), url]).encode()).hexdigest()[:16]
+                partial_base = os.path.join(self.partial_dir, f"{partial_key}-{sanitized_name}")
+                sha256 = await self._download_ranged(url, download_path, partial_base, remote, timeout, progress)
+            else:
+                sha256 = await self._download_single(url, download_path, timeout, progress)
+            download.file_hashes[download_path] = sha256
+
             print(f"File downloaded and saved as {download_path}.")
             download.file_path = download_path
-            
+
         except aiohttp.ClientResponseError as e:
             if e.status == 404:
                 raise DependencyNotFoundError(f"File not found at URL: {url}")
             else:
                 raise InternalError(f"HTTP error downloading file: {str(e)}")
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-            raise InternalError(f"Network error downloading file: {str(e)}") 
\ No newline at end of file
+            raise InternalError(f"Network error downloading file: {str(e)}")
+
+    async def estimate_content_size(self, download):
+        """Content-Length of the file, from the same probe the download starts with"""
+        remote = await self._remote(download, aiohttp.ClientTimeout(total=30))
+        return remote["size"]
+
+    async def _remote(self, download, timeout):
+        """Probe of the file, made once per job for the estimate and the download"""
+        if getattr(download, 'remote_probe', None) is None:
+            download.remote_probe = await self._probe(download.dependency, timeout)
+        return download.remote_probe
+
+    async def _probe(self, url, timeout):
+        """Find out the size of the file and whether the server supports range requests"""
+        remote = {"size": None, "ranges": False, "etag": None, "last_modified": None}
+        async with http_client.session.head(url, timeout=timeout, allow_redirects=True) as response:
+            if response.status == 404:
+                response.raise_for_status()
+            if response.status >= 400:
+                # Some servers do not implement HEAD, fall back to a plain GET
+                return remote
+            remote["size"] = response.content_length
+            remote["ranges"] = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            remote["etag"] = response.headers.get("ETag")
+            remote["last_modified"] = response.headers.get("Last-Modified")
+        return remote
+
+    async def _download_single(self, url, download_path, timeout, progress):
+        """Stream the whole file with a single GET request, returns its SHA-256"""
+        partial_path = f"{download_path}.part"
+        sha256 = hashlib.sha256()
+        async with http_client.session.get(url, timeout=timeout) as response:
+            response.raise_for_status()
+            progress.bytes = progress.resumed = 0
+            progress.total = response.content_length or progress.total
+
+            with open(partial_path, "wb") as file:
+                async for chunk in self._iter_adaptive(response):
+                    file.write(chunk)
+                    sha256.update(chunk)
+                    progress.advance(len(chunk))
+        os.replace(partial_path, download_path)
+        return sha256.hexdigest()
+
+    async def _download_ranged(self, url, download_path, partial_base, remote, timeout, progress):
+        """
+        Download the file as parallel byte ranges, resuming from a previous checkpoint if possible.
+
+        :return: SHA-256 of the file. A single segment downloaded from the start is hashed as it
+            arrives; out of order segments and resumed downloads are hashed once the file is complete.
+        """
+        partial_path = f"{partial_base}.part"
+        checkpoint_path = f"{partial_base}.part.json"
+
+        checkpoint = self._load_checkpoint(checkpoint_path, partial_path, url, remote)
+        if checkpoint is None:
+            checkpoint = self._new_checkpoint(url, remote)
+            # Pre-allocate the partial file so every segment can write at its own offset
+            with open(partial_path, "wb") as file:
+                file.truncate(remote["size"])
+            self._save_checkpoint(checkpoint_path, checkpoint)
+        else:
+            done = sum(segment["done"] for segment in checkpoint["segments"])
+            print(f"Resuming download of {url} at {done} of {remote['size']} bytes.")
+            progress.resume(done)
+
+        # Only bytes arriving in file order can be hashed on the way
+        segments = checkpoint["segments"]
+        sha256 = hashlib.sha256() if len(segments) == 1 and segments[0]["done"] == 0 else None
+
+        fd = os.open(partial_path, os.O_WRONLY)
+        try:
+            last_checkpoint = [time.monotonic()]
+
+            def on_progress(count):
+                progress.advance(count)
+                if time.monotonic() - last_checkpoint[0] >= self.checkpoint_interval:
+                    last_checkpoint[0] = time.monotonic()
+                    self._save_checkpoint(checkpoint_path, checkpoint)
+
+            tasks = [
+                asyncio.ensure_future(self._download_segment(url, fd, segment, remote, timeout, on_progress, sha256))
+                for segment in checkpoint["segments"]
+                if segment["start"] + segment["done"] <= segment["end"]
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop the other segments before the file descriptor is closed
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+        except RangesIgnoredError:
+            os.close(fd)
+            fd = None
+            print(f"Server ignored range requests for {url}, downloading it as a single stream.")
+            os.remove(checkpoint_path)
+            os.remove(partial_path)
+            return await self._download_single(url, download_path, timeout, progress)
+        finally:
+            if fd is not None:
+                os.close(fd)
+                # Persist progress even when a segment failed, so a redelivery resumes from here
+                self._save_checkpoint(checkpoint_path, checkpoint)
+
+        # The workspace may be on another file system, e.g. tmpfs
+        shutil.move(partial_path, download_path)
+        os.remove(checkpoint_path)
+        if sha256 is not None:
+            return sha256.hexdigest()
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, file_sha256, download_path)
+
+    async def _download_segment(self, url, fd, segment, remote, timeout, on_progress, sha256=None):
+        """Fetch the remaining bytes of one segment and write them at their offset, hashing them if sha256 is given"""
+        offset = segment["start"] + segment["done"]
+        headers = {"Range": f"bytes={offset}-{segment['end']}"}
+        validator = remote["etag"] or remote["last_modified"]
+        if validator:
+            # Makes the server send the full file instead of a range if it changed meanwhile
+            headers["If-Range"] = validator
+
+        async with http_client.session.get(url, headers=headers, timeout=timeout) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise RangesIgnoredError(url)
+
+            async for chunk in self._iter_adaptive(response):
+                remaining = segment["end"] + 1 - (segment["start"] + segment["done"])
+                chunk = chunk[:remaining]
+                os.pwrite(fd, chunk, segment["start"] + segment["done"])
+                if sha256 is not None:
+                    sha256.update(chunk)
+                segment["done"] += len(chunk)
+                on_progress(len(chunk))
+
+        if segment["start"] + segment["done"] <= segment["end"]:
+            raise InternalError(f"Incomplete range {segment['start']}-{segment['end']} for {url}")
+
+    async def _iter_adaptive(self, response):
+        """Yield body chunks, growing the read size while the connection keeps buffers full"""
+        chunk_size = self.min_chunk_size
+        while True:
+            chunk = await response.content.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+            if len(chunk) == chunk_size and chunk_size < self.max_chunk_size:
+                chunk_size = min(chunk_size * 2, self.max_chunk_size)
+
+    def _new_checkpoint(self, url, remote):
+        size = remote["size"]
+        count = max(1, min(self.max_segments, size // self.min_segment_size))
+        segment_size = -(-size // count)  # Ceiling division
+        segments = [
+            {"start": start, "end": min(start + segment_size, size) - 1, "done": 0}
+            for start in range(0, size, segment_size)
+        ]
+        print(f"Downloading {url} ({size} bytes) in {len(segments)} ranged segments.")
+        return {
+            "url": url,
+            "size": size,
+            "etag": remote["etag"],
+            "last_modified": remote["last_modified"],
+            "segments": segments
+        }
+
+    def _load_checkpoint(self, checkpoint_path, partial_path, url, remote):
+        """Return the saved segment map if it still describes the same remote file"""
+        if not os.path.exists(checkpoint_path) or not os.path.exists(partial_path):
+            return None
+        try:
+            with open(checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (OSError, ValueError):
+            return None
+
+        same_file = (
+            checkpoint.get("url") == url
+            and checkpoint.get("size") == remote["size"]
+            and checkpoint.get("etag") == remote["etag"]
+            and checkpoint.get("last_modified") == remote["last_modified"]
+            and os.path.getsize(partial_path) == remote["size"]
+        )
+        if not same_file:
+            print(f"Discarding stale partial download of {url}.")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint_path, checkpoint):
+        staging_path = f"{checkpoint_path}.tmp"
+        with open(staging_path, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(staging_path, checkpoint_path)
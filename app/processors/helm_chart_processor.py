@@ -1,7 +1,14 @@
 import os
 import asyncio
+import hashlib
+import uuid
 import aiohttp
 import yaml
+from urllib.parse import urljoin
+from app.helpers.helm_sync_state import HelmSyncState
+from app.helpers.http_client import http_client
+from app.helpers.semver import VersionRange, sort_versions
+from app.models.download_status import DownloadStatus
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
@@ -9,49 +16,108 @@ from app.models.exceptions import DependencyNotFoundError, InternalError
 class HelmChartProcessor(BaseProcessor):
     def __init__(self, broker, status_queue):
         super().__init__(broker, status_queue, "/tmp/helm-charts/")
+        self.max_concurrent_downloads = int(os.getenv("HELM_MAX_CONCURRENT_DOWNLOADS", "8"))
+        # Only fetch charts that are new or changed since the last successful sync of an index
+        self.incremental_sync = os.getenv("HELM_INCREMENTAL_SYNC", "true").lower() == "true"
+        self.sync_state = HelmSyncState()
+        # Typical packaged chart size, used with the chart count of the last sync to estimate disk usage
+        self.chart_size_estimate = int(os.getenv("HELM_CHART_SIZE_ESTIMATE_BYTES", str(256 * 1024)))
 
     async def _download_dependency(self, download):
-        """Download Helm chart index and charts"""
+        """Download Helm chart index and the charts that changed since the last sync"""
         index_url = download.dependency
-        chart_dir = os.path.join(self.temp_dir, "charts")
+        chart_dir = self.workspace_path(download, "charts")
 
         if not os.path.exists(chart_dir):
             os.makedirs(chart_dir)
 
+        selection = self._selection(download)
+        incremental = self.incremental_sync and not download.options.get("full_sync", False)
+        state_key = self.sync_state.state_key(index_url, selection)
+        state = self.sync_state.load(state_key, index_url)
+
         print(f"Downloading Helm chart index from {index_url}...")
 
         try:
             timeout = aiohttp.ClientTimeout(total=600)  # 10 minute timeout for large files
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                # Download the index.yaml file
-                async with session.get(index_url) as response:
-                    response.raise_for_status()
-                    index_text = await response.text()
-
-                # Parse the index.yaml file
-                index_data = yaml.safe_load(index_text)
-
-                # Download the latest version of each Helm chart
-                for chart_name, chart_versions in index_data.get('entries', {}).items():
-                    if chart_versions:
-                        latest_version_info = chart_versions[0]  # Latest version is the first
-                        chart_url = latest_version_info['urls'][0]
-                        chart_filename = os.path.join(chart_dir, f"{chart_name}-{latest_version_info['version']}.tgz")
-
-                        print(f"Downloading Helm chart {chart_name} (version {latest_version_info['version']})...")
-
-                        # Download the Helm chart tarball
-                        async with session.get(chart_url) as chart_response:
-                            chart_response.raise_for_status()
-
-                            # Save the Helm chart tarball
-                            with open(chart_filename, "wb") as chart_file:
-                                async for chunk in chart_response.content.iter_chunked(8192):
-                                    chart_file.write(chunk)
-                        print(f"Helm chart {chart_name} saved.")
+            headers = {}
+            if incremental and state["etag"]:
+                headers["If-None-Match"] = state["etag"]
+            if incremental and state["last_modified"]:
+                headers["If-Modified-Since"] = state["last_modified"]
+
+            # Download the index.yaml file
+            async with http_client.session.get(index_url, headers=headers, timeout=timeout) as response:
+                if response.status == 304:
+                    print(f"Helm chart index {index_url} not modified since last sync.")
+                    download.details["up_to_date"] = True
+                    download.status = DownloadStatus.DONE
+                    return
+                response.raise_for_status()
+                index_text = await response.text()
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            # Parse the index.yaml file
+            index_data = yaml.safe_load(index_text)
+
+            # Select the requested versions of each chart and drop the ones already delivered
+            charts = []
+            skipped = 0
+            for chart_name, chart_versions in index_data.get('entries', {}).items():
+                delivered = state["charts"].get(chart_name, {}) if incremental else {}
+                for version_info in self._select_versions(chart_name, chart_versions or [], selection):
+                    fingerprint = self._fingerprint(version_info)
+                    if fingerprint and delivered.get(str(version_info['version'])) == fingerprint:
+                        skipped += 1
+                    else:
+                        charts.append((chart_name, version_info))
+
+            semaphore = asyncio.Semaphore(self.max_concurrent_downloads)
+            results = await asyncio.gather(
+                *(self._download_chart(semaphore, index_url, chart_dir, chart_name, version_info, timeout,
+                                       download.progress_reporter, download.file_hashes)
+                  for chart_name, version_info in charts),
+                return_exceptions=True
+            )
+
+            # Collect per-chart failures instead of aborting the whole index
+            failed_charts = sorted(
+                f"{chart_name}-{version_info['version']}"
+                for (chart_name, version_info), result in zip(charts, results) if isinstance(result, Exception)
+            )
+            download.details["charts_succeeded"] = len(charts) - len(failed_charts)
+            download.details["charts_failed"] = len(failed_charts)
+            download.details["charts_unchanged"] = skipped
+            if failed_charts:
+                download.details["failed_charts"] = failed_charts
+            print(f"Downloaded {len(charts) - len(failed_charts)} Helm charts, {len(failed_charts)} failed, {skipped} unchanged.")
 
+            if charts and len(failed_charts) == len(charts) and not skipped:
+                raise InternalError(f"All {len(charts)} Helm charts failed to download from {index_url}")
+
+            delivered = {}
+            for (chart_name, version_info), result in zip(charts, results):
+                if not isinstance(result, Exception):
+                    delivered.setdefault(chart_name, {})[str(version_info['version'])] = self._fingerprint(version_info)
+            # Only trust the index validators when every chart made it, failed charts are retried next sync
+            new_state = self.sync_state.merged(
+                state, delivered,
+                etag=etag if not failed_charts else None,
+                last_modified=last_modified if not failed_charts else None
+            )
+
+            if not delivered:
+                print(f"No new Helm charts to send from {index_url}.")
+                self.sync_state.save(state_key, new_state)
+                download.details["up_to_date"] = not failed_charts
+                download.status = DownloadStatus.DONE
+                return
+
+            # The state is only persisted once the charts were sent successfully
+            download.helm_sync_update = (state_key, new_state)
             download.package_dir = chart_dir
-            
+
         except aiohttp.ClientResponseError as e:
             if e.status == 404:
                 raise DependencyNotFoundError(f"Helm chart index not found at URL: {index_url}")
@@ -60,4 +126,91 @@ class HelmChartProcessor(BaseProcessor):
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             raise InternalError(f"Network error downloading Helm charts: {str(e)}")
         except yaml.YAMLError as e:
-            raise InternalError(f"Error parsing Helm chart index: {str(e)}") 
\ No newline at end of file
+            raise InternalError(f"Error parsing Helm chart index: {str(e)}")
+
+    async def estimate_content_size(self, download):
+        """Charts delivered by the last sync of the index, unknown before the first one"""
+        state = self.sync_state.load(self.sync_state.state_key(download.dependency, self._selection(download)), download.dependency)
+        charts = sum(len(versions) for versions in state["charts"].values())
+        return charts * self.chart_size_estimate if charts else None
+
+    def _selection(self, download):
+        return {
+            key: download.options[key]
+            for key in ("latest_versions", "version_range", "version_ranges")
+            if key in download.options
+        }
+
+    async def sending_step(self, download):
+        """Send the charts and record them as delivered for the next incremental sync"""
+        await super().sending_step(download)
+        if download.status == DownloadStatus.DONE and getattr(download, 'helm_sync_update', None):
+            state_key, new_state = download.helm_sync_update
+            self.sync_state.save(state_key, new_state)
+
+    def journal_state(self, download):
+        """A resumed sync still records its charts as delivered"""
+        sync_update = getattr(download, 'helm_sync_update', None)
+        return {"helm_sync_update": list(sync_update)} if sync_update else {}
+
+    def restore_journal_state(self, download, state):
+        if state.get("helm_sync_update"):
+            download.helm_sync_update = tuple(state["helm_sync_update"])
+
+    def _select_versions(self, chart_name, chart_versions, selection):
+        """Pick the chart versions to mirror, by default only the latest one"""
+        by_version = {}
+        for version_info in chart_versions:
+            by_version.setdefault(str(version_info.get('version')), version_info)
+        ordered = sort_versions(list(by_version))
+
+        version_ranges = selection.get("version_ranges") or {}
+        version_range = version_ranges.get(chart_name, version_ranges.get("*", selection.get("version_range")))
+        if version_range:
+            try:
+                matcher = VersionRange(version_range)
+            except ValueError as e:
+                raise DependencyNotFoundError(f"Invalid version range for Helm chart {chart_name}: {e}")
+            ordered = [version for version in ordered if matcher.matches(version)]
+            # A range selects every matching version unless a count was requested as well
+            if "latest_versions" not in selection:
+                return [by_version[version] for version in ordered]
+
+        latest_versions = int(selection.get("latest_versions", 1))
+        return [by_version[version] for version in ordered[:latest_versions]]
+
+    def _fingerprint(self, version_info):
+        """The index digest identifies chart content, fall back to the creation timestamp"""
+        return version_info.get('digest') or version_info.get('created')
+
+    async def _download_chart(self, semaphore, index_url, chart_dir, chart_name, version_info, timeout, progress,
+                              file_hashes):
+        """Download a single chart tarball, bounded by the shared semaphore, and record its SHA-256"""
+        async with semaphore:
+            # Chart URLs may be relative to the index
+            chart_url = urljoin(index_url, version_info['urls'][0])
+            chart_filename = os.path.join(chart_dir, f"{chart_name}-{version_info['version']}.tgz")
+            # Write to a private file first so concurrent writers never see a half written chart
+            partial_filename = f"{chart_filename}.{uuid.uuid4().hex}.part"
+
+            print(f"Downloading Helm chart {chart_name} (version {version_info['version']})...")
+
+            try:
+                async with http_client.session.get(chart_url, timeout=timeout) as chart_response:
+                    chart_response.raise_for_status()
+
+                    # Save the Helm chart tarball
+                    sha256 = hashlib.sha256()
+                    with open(partial_filename, "wb") as chart_file:
+                        async for chunk in chart_response.content.iter_chunked(8192):
+                            chart_file.write(chunk)
+                            sha256.update(chunk)
+                            progress.advance(len(chunk))
+                os.replace(partial_filename, chart_filename)
+                file_hashes[chart_filename] = sha256.hexdigest()
+            except Exception as e:
+                print(f"Failed to download Helm chart {chart_name}: {e}")
+                if os.path.exists(partial_filename):
+                    os.remove(partial_filename)
+                raise
+            print(f"Helm chart {chart_name} saved.") 
\ No newline at end of file
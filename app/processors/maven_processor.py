@@ -1,57 +1,270 @@
 import os
+import re
 import asyncio
+import shutil
+import xml.etree.ElementTree as ElementTree
+import aiohttp
+from app.helpers.maven_resolver import ArtifactNotFoundError, MavenResolver, ResolutionError
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
+# Concurrent Maven processes coordinate through file locks in the shared repository (Maven 3.9+)
+SYNC_CONTEXT_FLAGS = [
+    "-Daether.syncContext.named.factory=file-lock",
+    "-Daether.syncContext.named.nameMapper=file-gav",
+]
+
+# Resolver bookkeeping that is local to a repository and must not be exported
+EXPORT_SKIPPED_SUFFIXES = (".lastUpdated", ".part", ".lock", "resolver-status.properties")
+
+DEPENDENCY_LINE = re.compile(
+    r"^\s*(?P<group>[^:\s]+):(?P<artifact>[^:\s]+):(?P<type>[^:\s]+)(?::(?P<classifier>[^:\s]+))?"
+    r":(?P<version>[^:\s]+):(?P<scope>compile|runtime|provided|system|test)\b"
+)
+
+GENERATED_POM = """<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>hyperloop.resolve</groupId>
+  <artifactId>resolve</artifactId>
+  <version>1</version>
+  <packaging>pom</packaging>
+  <dependencies>
+    <dependency>
+      <groupId>{group_id}</groupId>
+      <artifactId>{artifact_id}</artifactId>
+      <version>{version}</version>
+    </dependency>
+  </dependencies>
+</project>
+"""
+
 
 class MavenProcessor(BaseProcessor):
     def __init__(self, broker, status_queue):
         super().__init__(broker, status_queue, "/tmp/maven-packages/")
+        # Long-lived local repository reused by every job, empty for a fresh repository per job
+        self.shared_repo = os.getenv("MAVEN_SHARED_REPO", "/tmp/maven-repository/")
+        if self.shared_repo and not os.path.exists(self.shared_repo):
+            os.makedirs(self.shared_repo)
+        # "mvn" runs Maven per job, "native" resolves in process without a JVM
+        self.resolver = os.getenv("MAVEN_RESOLVER", "mvn").lower()
+        self.native_resolver = MavenResolver(
+            os.getenv("MAVEN_REPOSITORY_URL", "https://repo.maven.apache.org/maven2/"),
+            local_repository=self.shared_repo or None,
+            max_concurrent=int(os.getenv("MAVEN_MAX_CONCURRENT_DOWNLOADS", "8")),
+        )
+
+    def cache_key(self, download):
+        """Release coordinates are immutable, SNAPSHOTs and version ranges are not"""
+        parts = download.dependency.strip().split(":")
+        if len(parts) != 3 or not all(parts):
+            return None
+        version = parts[2]
+        if version.endswith("-SNAPSHOT") or any(c in version for c in "[](),"):
+            return None
+        return f"MAVEN:{download.dependency.strip()}"
 
     async def _download_dependency(self, download):
         """Download Maven artifact and its dependencies"""
         dependency = download.dependency  # Maven coordinate, e.g., "group:artifact:version"
-        
+
         # Validate Maven coordinate format
         if dependency.count(":") != 2:
             raise DependencyNotFoundError(f"Invalid Maven coordinate format: {dependency}. Expected format: group:artifact:version")
-        
+
         group_id, artifact_id, version = dependency.split(":")
-        
+
         # Create a directory for this artifact
-        download_dir = os.path.join(self.temp_dir, self.sanitize_filename(dependency))
+        download_dir = self.workspace_path(download, self.sanitize_filename(dependency))
         if not os.path.exists(download_dir):
             os.makedirs(download_dir)
 
         print(f"Downloading Maven artifact and dependencies for {dependency}...")
+        # Resolved artifacts land in download_dir as they arrive, except for the shared repository export
+        download.progress_reporter.watch(download_dir)
 
         try:
-            # Use asyncio.create_subprocess_exec for non-blocking subprocess calls
-            process = await asyncio.create_subprocess_exec(
-                "mvn",
+            if self.resolver == "native":
+                artifacts = await self.native_resolver.resolve(group_id, artifact_id, version, download_dir)
+                print(f"Resolved {artifacts} Maven artifacts for {dependency}")
+                download.package_dir = download_dir
+                return
+
+            if self.shared_repo:
+                await self._resolve_shared(download, group_id, artifact_id, version, download_dir)
+                return
+
+            await self._run_maven(
+                dependency,
                 "dependency:get",
                 "-Dartifact=" + dependency,
                 "-Dmaven.repo.local=" + download_dir,
                 "-DincludeScope=runtime",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
             )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                stderr_text = stderr.decode()
-                # Check if it's a "not found" error
-                if "Could not find artifact" in stderr_text or "not found" in stderr_text.lower():
-                    raise DependencyNotFoundError(f"Maven artifact {dependency} does not exist")
-                else:
-                    raise InternalError(f"Maven download error: {stderr_text}")
-
             download.package_dir = download_dir
-            
+
+        except ArtifactNotFoundError as e:
+            raise DependencyNotFoundError(str(e))
+        except (ResolutionError, aiohttp.ClientError) as e:
+            raise InternalError(f"Maven resolution error: {str(e)}")
         except asyncio.TimeoutError:
             raise InternalError(f"Maven download timeout for {dependency}")
         except Exception as e:
             if isinstance(e, (DependencyNotFoundError, InternalError)):
                 raise
-            raise InternalError(f"Maven download error: {str(e)}") 
\ No newline at end of file
+            raise InternalError(f"Maven download error: {str(e)}")
+
+    async def _run_maven(self, dependency: str, *args: str):
+        """Run mvn and map its failures onto the processor exceptions"""
+        # Use asyncio.create_subprocess_exec for non-blocking subprocess calls
+        process = await asyncio.create_subprocess_exec(
+            "mvn",
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        stdout, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            # Maven reports resolution errors on stdout
+            error_lines = [line for line in stdout.decode().splitlines() if line.startswith("[ERROR]")]
+            output = stderr.decode() + "\n".join(error_lines)
+            # Check if it's a "not found" error
+            if "Could not find artifact" in output or "not found" in output.lower():
+                raise DependencyNotFoundError(f"Maven artifact {dependency} does not exist")
+            else:
+                raise InternalError(f"Maven download error: {output}")
+
+    async def _resolve_shared(self, download, group_id: str, artifact_id: str, version: str, download_dir: str):
+        """
+        Resolve into the shared local repository, then export only the artifact closure.
+
+        The runtime closure is listed through a generated POM depending on the artifact;
+        the version directories of the listed artifacts and the parent and imported POMs
+        they need are hard linked into download_dir, which keeps the local repository layout.
+        """
+        work_dir = f"{download_dir.rstrip(os.sep)}-resolve"
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            await self._resolve_closure(download, group_id, artifact_id, version, work_dir, download_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    async def _resolve_closure(self, download, group_id, artifact_id, version, work_dir, package_dir):
+        """List the runtime closure with maven-dependency-plugin and export it into package_dir"""
+        pom_path = os.path.join(work_dir, "pom.xml")
+        with open(pom_path, "w") as pom_file:
+            pom_file.write(GENERATED_POM.format(group_id=group_id, artifact_id=artifact_id, version=version))
+        listing_path = os.path.join(work_dir, "dependencies.txt")
+
+        await self._run_maven(
+            download.dependency,
+            "-B",
+            "-f", pom_path,
+            "dependency:list",
+            "-Dmaven.repo.local=" + self.shared_repo,
+            "-DincludeScope=runtime",
+            "-DoutputFile=" + listing_path,
+            *SYNC_CONTEXT_FLAGS,
+        )
+
+        loop = asyncio.get_event_loop()
+        exported = await loop.run_in_executor(None, self._export_closure, listing_path, package_dir)
+        print(f"Exported {exported} Maven artifact versions for {download.dependency} from the shared repository")
+        download.package_dir = package_dir
+
+    def _export_closure(self, listing_path: str, package_dir: str) -> int:
+        """Hard link the listed artifacts and their POM ancestry into package_dir, to be run in thread pool"""
+        with open(listing_path) as listing:
+            coordinates = [
+                (match.group("group"), match.group("artifact"), match.group("version"))
+                for match in map(DEPENDENCY_LINE.match, listing)
+                if match
+            ]
+        if not coordinates:
+            raise InternalError("Maven resolved no artifacts")
+
+        exported = set()
+        pending = list(coordinates)
+        while pending:
+            coordinate = pending.pop()
+            if coordinate in exported:
+                continue
+            version_dir = self._version_dir(*coordinate)
+            if version_dir is None:
+                continue
+            exported.add(coordinate)
+            self._link_version_dir(version_dir, package_dir)
+            # Parents and imported BOMs are needed to read the POMs offline
+            pending.extend(self._pom_references(version_dir, *coordinate))
+        return len(exported)
+
+    def _version_dir(self, group_id: str, artifact_id: str, version: str):
+        path = os.path.join(self.shared_repo, *group_id.split("."), artifact_id, version)
+        if not os.path.isdir(path):
+            # Timestamped snapshots live under their base version
+            base_version = re.sub(r"-\d{8}\.\d{6}-\d+$", "-SNAPSHOT", version)
+            path = os.path.join(self.shared_repo, *group_id.split("."), artifact_id, base_version)
+        return path if os.path.isdir(path) else None
+
+    def _link_version_dir(self, version_dir: str, package_dir: str):
+        destination_dir = os.path.join(package_dir, os.path.relpath(version_dir, self.shared_repo))
+        os.makedirs(destination_dir, exist_ok=True)
+        for name in os.listdir(version_dir):
+            source = os.path.join(version_dir, name)
+            if name.endswith(EXPORT_SKIPPED_SUFFIXES) or not os.path.isfile(source):
+                continue
+            destination = os.path.join(destination_dir, name)
+            if os.path.exists(destination):
+                continue
+            try:
+                os.link(source, destination)
+            except OSError:
+                shutil.copyfile(source, destination)
+
+    def _pom_references(self, version_dir: str, group_id: str, artifact_id: str, version: str):
+        """Parent and scope=import coordinates declared by the artifact's POM"""
+        pom_path = os.path.join(version_dir, f"{artifact_id}-{os.path.basename(version_dir)}.pom")
+        try:
+            root = ElementTree.parse(pom_path).getroot()
+        except (OSError, ElementTree.ParseError):
+            return []
+
+        namespace = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+
+        def text(element, name):
+            child = element.find(namespace + name) if element is not None else None
+            return child.text.strip() if child is not None and child.text else None
+
+        references = []
+        parent = root.find(namespace + "parent")
+        if parent is not None and text(parent, "groupId") and text(parent, "version"):
+            references.append((text(parent, "groupId"), text(parent, "artifactId"), text(parent, "version")))
+
+        properties = {
+            "project.version": version,
+            "project.groupId": group_id,
+            "project.parent.version": text(parent, "version"),
+        }
+        properties_element = root.find(namespace + "properties")
+        if properties_element is not None:
+            for prop in properties_element:
+                properties[prop.tag[len(namespace):]] = (prop.text or "").strip()
+
+        managed = root.find(f"{namespace}dependencyManagement/{namespace}dependencies")
+        for managed_dependency in managed if managed is not None else []:
+            if text(managed_dependency, "scope") != "import":
+                continue
+            coordinate = [
+                text(managed_dependency, name) or "" for name in ("groupId", "artifactId", "version")
+            ]
+            # Properties inherited from parents are not followed, those BOMs are skipped
+            coordinate = [
+                re.sub(r"\$\{([^}]+)\}", lambda m: properties.get(m.group(1)) or m.group(0), value)
+                for value in coordinate
+            ]
+            if all(coordinate) and not any("${" in value for value in coordinate):
+                references.append(tuple(coordinate))
+        return references
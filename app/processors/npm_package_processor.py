@@ -1,23 +1,57 @@
 import os
 import asyncio
+import re
+import aiohttp
+from app.helpers.npm_resolver import NpmResolver, PackageNotFoundError, ResolutionError
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
 
+# name@x.y.z (optionally scoped) with an exact semver version, e.g. "express@4.18.2"
+EXACT_PACKAGE_SPEC = re.compile(r"^((?:@[a-z0-9._~-]+/)?[a-z0-9._~-]+)@(\d+\.\d+\.\d+(?:[-+][0-9A-Za-z.+-]+)?)$")
+
+
 class NpmPackageProcessor(BaseProcessor):
     def __init__(self, broker, status_queue):
         super().__init__(broker, status_queue, "/tmp/npm-packages/")
+        # "package" packs only the requested tarball, "tree" adds the full production dependency tree
+        self.default_mode = os.getenv("NPM_DEPENDENCY_MODE", "package").lower()
+        self.resolver = NpmResolver(
+            os.getenv("NPM_REGISTRY_URL", "https://registry.npmjs.org/"),
+            os.getenv("NPM_PACKUMENT_CACHE_DIR", "/tmp/npm-packument-cache/") or None,
+            max_concurrent=int(os.getenv("NPM_MAX_CONCURRENT_DOWNLOADS", "16")),
+            memory_ttl=float(os.getenv("NPM_PACKUMENT_TTL", "300")),
+            memory_max_entries=int(os.getenv("NPM_PACKUMENT_MEMORY_MAX_ENTRIES", "1000")),
+        )
+
+    def _mode(self, download):
+        return str((download.options or {}).get("mode") or self.default_mode).lower()
+
+    def cache_key(self, download):
+        """Published npm versions are immutable, tags and ranges are not"""
+        if self._mode(download) == "tree":
+            # Ranges inside the tree resolve to newer versions over time
+            return None
+        match = EXACT_PACKAGE_SPEC.match(download.dependency.strip())
+        if not match:
+            return None
+        return f"NPM:{match.group(1)}@{match.group(2)}"
 
     async def _download_dependency(self, download):
         """Download NPM package tarballs using npm pack"""
         package_spec = download.dependency
         sanitized_name = self.sanitize_filename(package_spec)
-        download_dir = os.path.join(self.temp_dir, sanitized_name)
+        download_dir = self.workspace_path(download, sanitized_name)
 
         if not os.path.exists(download_dir):
             os.makedirs(download_dir)
 
+        if self._mode(download) == "tree":
+            await self._download_tree(download, download_dir)
+            return
+
         print(f"Downloading NPM package {package_spec}...")
+        download.progress_reporter.watch(download_dir)
 
         try:
             # Use asyncio.create_subprocess_exec for non-blocking subprocess calls
@@ -45,4 +79,24 @@ class NpmPackageProcessor(BaseProcessor):
         except Exception as e:
             if isinstance(e, (DependencyNotFoundError, InternalError)):
                 raise
-            raise InternalError(f"NPM package download error: {str(e)}") 
\ No newline at end of file
+            raise InternalError(f"NPM package download error: {str(e)}")
+
+    async def _download_tree(self, download, download_dir):
+        """Resolve the production dependency tree from the registry and fetch every tarball"""
+        package_spec = download.dependency
+        print(f"Downloading NPM package {package_spec} with its dependency tree...")
+
+        try:
+            result = await self.resolver.resolve(
+                package_spec, download_dir, on_chunk=download.progress_reporter.advance, file_hashes=download.file_hashes
+            )
+        except PackageNotFoundError as e:
+            raise DependencyNotFoundError(str(e))
+        except (ResolutionError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise InternalError(f"NPM dependency tree error: {str(e)}")
+
+        print(f"NPM package {result['root']} downloaded with {len(result['packages'])} packages.")
+        download.details["packages"] = len(result["packages"])
+        if result["unresolved"]:
+            download.details["unresolved"] = result["unresolved"]
+        download.package_dir = download_dir
@@ -1,34 +1,128 @@
 import os
 import asyncio
+import re
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
 
+# name[extras]==version with an exact version, e.g. "requests==2.31.0"
+PINNED_REQUIREMENT = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?==([A-Za-z0-9.!+_-]+)$")
+
+# Interpreter and platform used when the request has no target matrix
+DEFAULT_TARGET = {"python_version": "3.11", "platform": "manylinux2014_x86_64"}
+
+
 class PythonPackageProcessor(BaseProcessor):
     def __init__(self, broker, status_queue):
         super().__init__(broker, status_queue, "/tmp/python-packages/")
+        # Persistent pip cache shared by all jobs and matrix targets, empty to run pip without a cache
+        self.pip_cache_dir = os.getenv("PIP_SHARED_CACHE_DIR", "/tmp/pip-cache/")
+        self.max_concurrent_targets = int(os.getenv("PYTHON_MAX_CONCURRENT_TARGETS", "4"))
+
+    def cache_key(self, download):
+        """Only exact == pins are cacheable, the project name is normalized as in PEP 503"""
+        match = PINNED_REQUIREMENT.match(download.dependency.replace(" ", ""))
+        if not match:
+            return None
+        name, extras, version = match.groups()
+        name = re.sub(r"[-_.]+", "-", name).lower()
+        if extras:
+            extras = "[" + ",".join(sorted(e.strip().lower() for e in extras[1:-1].split(",") if e.strip())) + "]"
+        if download.details.get("targets_failed"):
+            # Wheels for the missing targets may still be published, do not pin the partial result
+            return None
+        key = f"PYTHON:{name}{extras or ''}=={version}"
+        if (download.options or {}).get("targets"):
+            key += "|" + ",".join(sorted(self._target_name(target) for target in self._targets(download)))
+        return key
+
+    def _targets(self, download):
+        """
+        Target matrix of the request, each entry a python_version and one or more platforms.
+
+        Without options.targets the single default target is used.
+        """
+        targets = []
+        for target in (download.options or {}).get("targets") or [DEFAULT_TARGET]:
+            platforms = target.get("platform") or DEFAULT_TARGET["platform"]
+            targets.append({
+                "python_version": str(target.get("python_version") or DEFAULT_TARGET["python_version"]),
+                "platform": [platforms] if isinstance(platforms, str) else list(platforms),
+            })
+        return targets
+
+    def _target_name(self, target) -> str:
+        return f"py{target['python_version']}-{'+'.join(target['platform'])}"
 
     async def _download_dependency(self, download):
-        """Download Python package as .whl files using pip"""
+        """Download Python package as .whl files using pip, once per target of the matrix"""
         package_name = download.dependency
         sanitized_name = self.sanitize_filename(package_name)
-        download_dir = os.path.join(self.temp_dir, sanitized_name)
+        download_dir = self.workspace_path(download, sanitized_name)
 
         if not os.path.exists(download_dir):
             os.makedirs(download_dir)
 
         print(f"Downloading Python package {package_name} and its dependencies...")
+        # pip reports no byte counts we could use, the growing download directory does
+        download.progress_reporter.watch(download_dir)
+
+        targets = self._targets(download)
+        matrix = bool((download.options or {}).get("targets"))
+        semaphore = asyncio.Semaphore(self.max_concurrent_targets)
+
+        async def run(target):
+            # A single default target keeps the flat layout, matrix targets get a directory each
+            dest = os.path.join(download_dir, self._target_name(target)) if matrix else download_dir
+            async with semaphore:
+                await self._pip_download(package_name, target, dest)
+
+        results = await asyncio.gather(*(run(target) for target in targets), return_exceptions=True)
+
+        failed = []
+        for target, result in zip(targets, results):
+            if isinstance(result, DependencyNotFoundError) and len(targets) > 1:
+                # Not every project publishes wheels for every platform, report the gap and carry on
+                failed.append(self._target_name(target))
+            elif isinstance(result, BaseException):
+                raise result
+        if failed and len(failed) == len(targets):
+            raise DependencyNotFoundError(f"Python package {package_name} does not exist for any target")
+        if matrix:
+            common = await asyncio.get_event_loop().run_in_executor(
+                None, self._deduplicate_pure_wheels, download_dir,
+                [self._target_name(target) for target in targets if self._target_name(target) not in failed]
+            )
+            download.details["targets_succeeded"] = len(targets) - len(failed)
+            download.details["targets_failed"] = failed
+            download.details["common_wheels"] = common
+
+        print(f"Python package {package_name} downloaded successfully.")
+        download.package_dir = download_dir
+
+    async def _pip_download(self, package_name, target, dest):
+        """Run pip download for one target"""
+        command = [
+            "pip", "download", package_name,
+            "--python-version", target["python_version"],
+            "--dest", dest,
+            "--only-binary=:all:",
+        ]
+        for platform in target["platform"]:
+            command += ["--platform", platform]
+        env = dict(os.environ)
+        if self.pip_cache_dir:
+            # The image disables pip's cache globally, the shared cache has to be enabled explicitly
+            env.pop("PIP_NO_CACHE_DIR", None)
+            command += ["--cache-dir", self.pip_cache_dir]
 
         try:
             # Use asyncio.create_subprocess_exec for non-blocking subprocess calls
             process = await asyncio.create_subprocess_exec(
-                "pip", "download", package_name, 
-                "--python-version", "3.11", 
-                "--dest", download_dir, 
-                "--only-binary=:all:", 
-                "--platform", "manylinux2014_x86_64",
+                *command,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                env=env
             )
             
             stdout, stderr = await process.communicate()
@@ -36,16 +130,34 @@ class PythonPackageProcessor(BaseProcessor):
             if process.returncode != 0:
                 stderr_text = stderr.decode()
                 if "Could not find a version" in stderr_text or "No matching distribution" in stderr_text:
-                    raise DependencyNotFoundError(f"Python package {package_name} does not exist")
+                    raise DependencyNotFoundError(
+                        f"Python package {package_name} does not exist for {self._target_name(target)}"
+                    )
                 else:
                     raise InternalError(f"Python package download error: {stderr_text}")
-                    
-            print(f"Python package {package_name} downloaded successfully.")
-            download.package_dir = download_dir
             
         except asyncio.TimeoutError:
             raise InternalError(f"Python package download timeout for {package_name}")
         except Exception as e:
             if isinstance(e, (DependencyNotFoundError, InternalError)):
                 raise
-            raise InternalError(f"Python package download error: {str(e)}") 
\ No newline at end of file
+            raise InternalError(f"Python package download error: {str(e)}")
+
+    def _deduplicate_pure_wheels(self, download_dir, target_names) -> int:
+        """Move py3-none-any wheels present for every target into common/, to be run in thread pool"""
+        if not target_names:
+            return 0
+        wheel_sets = [
+            {name for name in os.listdir(os.path.join(download_dir, target_name)) if name.endswith("-none-any.whl")}
+            for target_name in target_names
+        ]
+        common = set.intersection(*wheel_sets)
+        if not common:
+            return 0
+        common_dir = os.path.join(download_dir, "common")
+        os.makedirs(common_dir, exist_ok=True)
+        for name in common:
+            os.replace(os.path.join(download_dir, target_names[0], name), os.path.join(common_dir, name))
+            for target_name in target_names[1:]:
+                os.remove(os.path.join(download_dir, target_name, name))
+        return len(common)
@@ -1,6 +1,4 @@
-import os
-from urllib.parse import urlparse
-from pyppeteer import launch
+from app.helpers.browser_pool import browser_pool
 from app.processors.base_processor import BaseProcessor
 from app.models.exceptions import DependencyNotFoundError, InternalError
 
@@ -13,31 +11,25 @@ class WebsitePdfProcessor(BaseProcessor):
         """Convert website to PDF using pyppeteer"""
         url = download.dependency
         sanitized_name = self.sanitize_filename(url)
-        pdf_path = os.path.join(self.temp_dir, f"{sanitized_name}.pdf")
+        pdf_path = self.workspace_path(download, f"{sanitized_name}.pdf")
 
         print(f"Converting website {url} to PDF...")
 
         try:
-            # Launch browser with longer timeout for page loads
-            browser = await launch({
-                'args': ['--no-sandbox', '--disable-setuid-sandbox'],
-                'timeout': 60000  # 1 minute timeout for browser launch
-            })
-            page = await browser.newPage()
-            
-            # Set longer timeout for page navigation
-            await page.goto(url, {
-                'waitUntil': 'networkidle0',
-                'timeout': 120000  # 2 minute timeout for page load
-            })
-            
-            await page.pdf({
-                'path': pdf_path, 
-                'format': 'A4',
-                'timeout': 60000  # 1 minute timeout for PDF generation
-            })
-            await browser.close()
-            
+            # Render in a private page of the shared browser, closed even if navigation fails
+            async with browser_pool.page() as page:
+                # Set longer timeout for page navigation
+                await page.goto(url, {
+                    'waitUntil': 'networkidle0',
+                    'timeout': 120000  # 2 minute timeout for page load
+                })
+
+                await page.pdf({
+                    'path': pdf_path,
+                    'format': 'A4',
+                    'timeout': 60000  # 1 minute timeout for PDF generation
+                })
+
             print(f"Website {url} converted to PDF successfully.")
             download.file_path = pdf_path
             
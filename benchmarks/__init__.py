@@ -0,0 +1,3 @@
+"""
+End-to-end benchmarks of the minion against local stand-ins for RabbitMQ, NiFi and the upstream sources.
+"""
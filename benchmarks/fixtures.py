@@ -0,0 +1,346 @@
+"""
+Local stand-ins for the upstream sources and the NiFi ListenHTTP endpoint.
+
+One aiohttp application serves every ecosystem under its own prefix:
+
+- /files/<name>                      FILE downloads with HEAD and byte range support
+- /helm/<repo>/index.yaml            Helm repositories with their chart tarballs
+- /maven/                            Maven repository layout with POMs, jars and SHA-1 files
+- /npm/                              npm registry packuments and tarballs
+- /pypi/simple/                      PEP 503 simple index with py3-none-any wheels
+- /v2/                               OCI distribution API with anonymous token auth
+- /nifi                              Upload sink counting the received bytes
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Tuple
+
+import yaml
+from aiohttp import web
+
+
+@dataclass
+class FixtureSettings:
+    file_size: int = 8 * 1024 * 1024
+    package_size: int = 256 * 1024
+    latency: float = 0.0  # Seconds before an upstream response starts
+    bandwidth: int = 0  # Bytes per second of every upstream response, 0 is unlimited
+    nifi_latency: float = 0.0
+    nifi_bandwidth: int = 0
+    dependencies: int = 8  # Transitive dependencies of every Maven, npm and Python package
+    helm_charts: int = 4  # Charts in every Helm repository
+
+
+OCI_INDEX = "application/vnd.oci.image.index.v1+json"
+OCI_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+REGISTRY_TOKEN = "bench-token"
+# Every registry image tag points to an index with one image per architecture
+REGISTRY_ARCHITECTURES = ("amd64", "arm64")
+
+
+@lru_cache(maxsize=None)
+def payload(size: int, seed: str = "") -> bytes:
+    """Incompressible bytes, like the archives the minion usually moves"""
+    return hashlib.shake_256(seed.encode()).digest(size)
+
+
+def sha256_digest(content: bytes) -> str:
+    return f"sha256:{hashlib.sha256(content).hexdigest()}"
+
+
+class FixtureServer:
+    """Serves the fixtures on 127.0.0.1 and counts what arrives at the NiFi stand-in"""
+
+    def __init__(self, settings: FixtureSettings):
+        self.settings = settings
+        self.base_url = ""
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self._runner = None
+
+    async def start(self, port: int = 0):
+        app = web.Application(client_max_size=0)
+        app.router.add_route("*", "/files/{name}", self._file)
+        app.router.add_get("/helm/{repo}/index.yaml", self._helm_index)
+        app.router.add_get("/helm/{repo}/charts/{name}", self._helm_chart)
+        app.router.add_get("/maven/{path:.+}", self._maven)
+        app.router.add_get("/npm/-/{name}", self._npm_tarball)
+        app.router.add_get("/npm/{name}", self._npm_packument)
+        app.router.add_get("/pypi/simple/{name}/", self._pypi_project)
+        app.router.add_get("/pypi/files/{name}", self._pypi_file)
+        app.router.add_get("/v2/{repository:.+}/manifests/{reference}", self._registry_manifest)
+        app.router.add_get("/v2/{repository:.+}/blobs/{digest}", self._registry_blob)
+        app.router.add_get("/token", self._registry_token)
+        app.router.add_post("/nifi", self._nifi)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def reset_counters(self):
+        self.uploads = 0
+        self.uploaded_bytes = 0
+
+    async def _send(self, request, body: bytes, status: int = 200, headers: Dict[str, str] = None):
+        """Answer after the configured latency, throttled to the configured bandwidth"""
+        if self.settings.latency:
+            await asyncio.sleep(self.settings.latency)
+        response = web.StreamResponse(status=status, headers=headers or {})
+        response.content_length = len(body)
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+        chunk_size = 256 * 1024
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset:offset + chunk_size]
+            await response.write(chunk)
+            if self.settings.bandwidth:
+                await asyncio.sleep(len(chunk) / self.settings.bandwidth)
+        await response.write_eof()
+        return response
+
+    async def _file(self, request):
+        # Every file name serves the same bytes, so large files are generated only once
+        body = payload(self.settings.file_size)
+        headers = {"Accept-Ranges": "bytes", "ETag": '"bench"'}
+        range_header = request.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            start, _, end = range_header[len("bytes="):].partition("-")
+            start, end = int(start), min(int(end or len(body) - 1), len(body) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            return await self._send(request, body[start:end + 1], 206, headers)
+        return await self._send(request, body, headers=headers)
+
+    # Helm
+
+    async def _helm_index(self, request):
+        repo = request.match_info["repo"]
+        entries = {
+            f"chart-{j}": [{
+                "name": f"chart-{j}",
+                "version": "1.0.0",
+                "digest": hashlib.sha256(f"{repo}/{j}".encode()).hexdigest(),
+                "urls": [f"charts/chart-{j}-1.0.0.tgz"],
+            }]
+            for j in range(self.settings.helm_charts)
+        }
+        body = yaml.safe_dump({"apiVersion": "v1", "entries": entries}).encode()
+        return await self._send(request, body)
+
+    async def _helm_chart(self, request):
+        name = f"{request.match_info['repo']}/{request.match_info['name']}"
+        return await self._send(request, payload(self.settings.package_size, name))
+
+    # Maven, group "bench" with applications app-<i> depending on the shared lib-<k>
+
+    def _maven_dependencies(self, artifact_id: str):
+        if not artifact_id.startswith("app-"):
+            return []
+        return [f"lib-{k}" for k in range(self.settings.dependencies)]
+
+    async def _maven(self, request):
+        parts = request.match_info["path"].split("/")
+        if len(parts) != 4 or parts[0] != "bench":
+            raise web.HTTPNotFound()
+        _, artifact_id, version, file_name = parts
+        base = f"{artifact_id}-{version}"
+        if file_name == f"{base}.pom":
+            dependencies = "".join(
+                f"<dependency><groupId>bench</groupId><artifactId>{dependency}</artifactId>"
+                f"<version>1.0</version></dependency>"
+                for dependency in self._maven_dependencies(artifact_id)
+            )
+            body = (
+                f'<project xmlns="http://maven.apache.org/POM/4.0.0"><modelVersion>4.0.0</modelVersion>'
+                f"<groupId>bench</groupId><artifactId>{artifact_id}</artifactId><version>{version}</version>"
+                f"<dependencies>{dependencies}</dependencies></project>"
+            ).encode()
+        elif file_name == f"{base}.jar":
+            body = payload(self.settings.package_size, base)
+        elif file_name == f"{base}.jar.sha1":
+            body = hashlib.sha1(payload(self.settings.package_size, base)).hexdigest().encode()
+        else:
+            raise web.HTTPNotFound()
+        return await self._send(request, body)
+
+    # npm, root packages pkg-<i> depending on the shared dep-<k>
+
+    def _npm_tarball_bytes(self, name: str) -> bytes:
+        return payload(self.settings.package_size, f"npm/{name}")
+
+    async def _npm_packument(self, request):
+        name = request.match_info["name"]
+        if not name.startswith(("pkg-", "dep-")):
+            raise web.HTTPNotFound()
+        dependencies = {f"dep-{k}": "^1.0.0" for k in range(self.settings.dependencies)} if name.startswith("pkg-") else {}
+        tarball = self._npm_tarball_bytes(name)
+        integrity = "sha512-" + base64.b64encode(hashlib.sha512(tarball).digest()).decode()
+        packument = {
+            "name": name,
+            "dist-tags": {"latest": "1.0.0"},
+            "versions": {"1.0.0": {
+                "name": name,
+                "version": "1.0.0",
+                "dependencies": dependencies,
+                "dist": {"tarball": f"{self.base_url}/npm/-/{name}-1.0.0.tgz", "integrity": integrity},
+            }},
+        }
+        return await self._send(request, json.dumps(packument).encode(), headers={"Content-Type": "application/json"})
+
+    async def _npm_tarball(self, request):
+        name = request.match_info["name"]
+        if not name.endswith("-1.0.0.tgz"):
+            raise web.HTTPNotFound()
+        return await self._send(request, self._npm_tarball_bytes(name[:-len("-1.0.0.tgz")]))
+
+    # PyPI, projects bench-pkg-<i> requiring the shared bench-dep-<k>
+
+    def _wheel_name(self, project: str) -> str:
+        return f"{project.replace('-', '_')}-1.0.0-py3-none-any.whl"
+
+    @lru_cache(maxsize=None)
+    def _wheel(self, project: str) -> bytes:
+        module = project.replace("-", "_")
+        requires = (
+            "".join(f"Requires-Dist: bench-dep-{k}\n" for k in range(self.settings.dependencies))
+            if project.startswith("bench-pkg-") else ""
+        )
+        files = {
+            f"{module}/__init__.py": b"",
+            f"{module}/data.bin": payload(self.settings.package_size, f"pypi/{project}"),
+            f"{module}-1.0.0.dist-info/METADATA": (
+                f"Metadata-Version: 2.1\nName: {project}\nVersion: 1.0.0\n{requires}"
+            ).encode(),
+            f"{module}-1.0.0.dist-info/WHEEL": b"Wheel-Version: 1.0\nGenerator: bench\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+        }
+        record = "".join(
+            f"{path},sha256={base64.urlsafe_b64encode(hashlib.sha256(content).digest()).rstrip(b'=').decode()},{len(content)}\n"
+            for path, content in files.items()
+        ) + f"{module}-1.0.0.dist-info/RECORD,,\n"
+        files[f"{module}-1.0.0.dist-info/RECORD"] = record.encode()
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as wheel:
+            for path, content in files.items():
+                wheel.writestr(path, content)
+        return buffer.getvalue()
+
+    async def _pypi_project(self, request):
+        project = request.match_info["name"]
+        if not project.startswith(("bench-pkg-", "bench-dep-")):
+            raise web.HTTPNotFound()
+        wheel_name = self._wheel_name(project)
+        digest = hashlib.sha256(self._wheel(project)).hexdigest()
+        body = f'<html><body><a href="../../files/{wheel_name}#sha256={digest}">{wheel_name}</a></body></html>'
+        return await self._send(request, body.encode(), headers={"Content-Type": "text/html"})
+
+    async def _pypi_file(self, request):
+        name = request.match_info["name"]
+        project = name.split("-1.0.0-", 1)[0].replace("_", "-")
+        if self._wheel_name(project) != name:
+            raise web.HTTPNotFound()
+        return await self._send(request, self._wheel(project))
+
+    # OCI registry, repositories bench/image-<i> tagged 1.0, bench/corrupt whose layers do not match their
+    # digests and bench/tampered whose platform manifests do not match the digests in the index
+
+    @lru_cache(maxsize=None)
+    def _registry_repository(self, repository: str) -> Tuple[Dict[str, Tuple[bytes, str]], Dict[str, bytes]]:
+        """Raw manifests with their media type by tag and digest, and the served blobs by digest"""
+        manifests, blobs = {}, {}
+        index = {"schemaVersion": 2, "mediaType": OCI_INDEX, "manifests": []}
+        for architecture in REGISTRY_ARCHITECTURES:
+            config = json.dumps({
+                "architecture": architecture, "os": "linux", "rootfs": {"type": "layers", "diff_ids": []},
+            }).encode()
+            layer = payload(self.settings.package_size, f"registry/{repository}/{architecture}")
+            blobs[sha256_digest(config)] = config
+            blobs[sha256_digest(layer)] = layer[::-1] if repository == "bench/corrupt" else layer
+            manifest = json.dumps({
+                "schemaVersion": 2,
+                "mediaType": OCI_MANIFEST,
+                "config": {
+                    "mediaType": "application/vnd.oci.image.config.v1+json",
+                    "digest": sha256_digest(config),
+                    "size": len(config),
+                },
+                "layers": [{
+                    "mediaType": "application/vnd.oci.image.layer.v1.tar",
+                    "digest": sha256_digest(layer),
+                    "size": len(layer),
+                }],
+            }).encode()
+            served_manifest = manifest + b" " if repository == "bench/tampered" else manifest
+            manifests[sha256_digest(manifest)] = (served_manifest, OCI_MANIFEST)
+            index["manifests"].append({
+                "mediaType": OCI_MANIFEST,
+                "digest": sha256_digest(manifest),
+                "size": len(manifest),
+                "platform": {"os": "linux", "architecture": architecture},
+            })
+        manifests["1.0"] = (json.dumps(index).encode(), OCI_INDEX)
+        return manifests, blobs
+
+    def _registry_challenge(self, request):
+        """401 with a Bearer challenge unless the request carries the token, as Docker Hub answers"""
+        if request.headers.get("Authorization") == f"Bearer {REGISTRY_TOKEN}":
+            return None
+        repository = request.match_info["repository"]
+        challenge = f'Bearer realm="{self.base_url}/token",service="bench",scope="repository:{repository}:pull"'
+        return web.Response(status=401, headers={"WWW-Authenticate": challenge})
+
+    async def _registry_token(self, request):
+        return web.json_response({"token": REGISTRY_TOKEN})
+
+    async def _registry_manifest(self, request):
+        challenge = self._registry_challenge(request)
+        if challenge is not None:
+            return challenge
+        repository = request.match_info["repository"]
+        if not repository.startswith(("bench/image-", "bench/corrupt", "bench/tampered")):
+            raise web.HTTPNotFound()
+        manifests, _ = self._registry_repository(repository)
+        if request.match_info["reference"] not in manifests:
+            raise web.HTTPNotFound()
+        raw, media_type = manifests[request.match_info["reference"]]
+        return await self._send(request, raw, headers={"Content-Type": media_type, "Docker-Content-Digest": sha256_digest(raw)})
+
+    async def _registry_blob(self, request):
+        challenge = self._registry_challenge(request)
+        if challenge is not None:
+            return challenge
+        repository = request.match_info["repository"]
+        if not repository.startswith(("bench/image-", "bench/corrupt", "bench/tampered")):
+            raise web.HTTPNotFound()
+        _, blobs = self._registry_repository(repository)
+        if request.match_info["digest"] not in blobs:
+            raise web.HTTPNotFound()
+        return await self._send(request, blobs[request.match_info["digest"]])
+
+    # NiFi
+
+    async def _nifi(self, request):
+        if self.settings.nifi_latency:
+            await asyncio.sleep(self.settings.nifi_latency)
+        received = 0
+        async for chunk in request.content.iter_chunked(256 * 1024):
+            received += len(chunk)
+            if self.settings.nifi_bandwidth:
+                await asyncio.sleep(len(chunk) / self.settings.nifi_bandwidth)
+        self.uploads += 1
+        self.uploaded_bytes += received
+        return web.Response(text="OK")
@@ -0,0 +1,298 @@
+"""
+End-to-end throughput benchmark of the download pipeline.
+
+Every processor type runs in its own worker process that drives handle_download_request
+through FastStream's in-memory test broker, against the local fixtures served by this
+process. Results can be written as JSON and compared against a run from another commit:
+
+    python -m benchmarks.run --types FILE,NPM --jobs 50 --output new.json --baseline old.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from benchmarks.fixtures import FixtureServer, FixtureSettings
+
+TYPES = ("FILE", "HELM", "MAVEN", "NPM", "PYTHON")
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def request_for(download_type: str, index: int, base_url: str) -> dict:
+    """A distinct request per job, identical ones would be coalesced into a single download"""
+    if download_type == "FILE":
+        dependency, options = f"{base_url}/files/bench-{index}.bin", {}
+    elif download_type == "HELM":
+        dependency, options = f"{base_url}/helm/repo-{index}/index.yaml", {"full_sync": True}
+    elif download_type == "MAVEN":
+        dependency, options = f"bench:app-{index}:1.0", {}
+    elif download_type == "NPM":
+        dependency, options = f"pkg-{index}@1.0.0", {"mode": "tree"}
+    else:
+        dependency, options = f"bench-pkg-{index}==1.0.0", {}
+    return {
+        "id": f"bench-{download_type.lower()}-{index}",
+        "type": download_type,
+        "dependency": dependency,
+        "status": "STARTED",
+        "date": datetime.now().isoformat(),
+        "options": options,
+    }
+
+
+def worker_environment(base_url: str, scratch_dir: str) -> Dict[str, str]:
+    """Point the minion at the fixtures and keep its shared state out of the real locations"""
+    env = dict(os.environ)
+    env.update({
+        "NIFI_LISTEN_HTTP_ENDPONT": f"{base_url}/nifi",
+        "METRICS_PORT": "0",
+        # Every job must do the work, not replay it from a previous run
+        "ARTIFACT_CACHE_ENABLED": "false",
+        "UPLOAD_DEDUP_ENABLED": "false",
+        "HELM_INCREMENTAL_SYNC": "false",
+        "HELM_SYNC_STATE_DIR": os.path.join(scratch_dir, "helm-sync-state"),
+        "STEP_JOURNAL_DIR": os.path.join(scratch_dir, "step-journal"),
+        "DELIVERY_INDEX_PATH": os.path.join(scratch_dir, "delivery-index.json"),
+        "MAVEN_RESOLVER": "native",
+        "MAVEN_REPOSITORY_URL": f"{base_url}/maven/",
+        "MAVEN_SHARED_REPO": os.path.join(scratch_dir, "maven-repository"),
+        "NPM_REGISTRY_URL": f"{base_url}/npm/",
+        "NPM_PACKUMENT_CACHE_DIR": os.path.join(scratch_dir, "npm-packument-cache"),
+        "PIP_INDEX_URL": f"{base_url}/pypi/simple/",
+        "PIP_SHARED_CACHE_DIR": os.path.join(scratch_dir, "pip-cache"),
+    })
+    return env
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+async def run_worker(download_type: str, base_url: str, jobs: int, concurrency: int) -> dict:
+    """Run the jobs of one type through the test broker, the app modules read the environment on import"""
+    from faststream.rabbit import TestRabbitBroker
+
+    from app.helpers.http_client import http_client
+    import app.processors.download_router as router
+
+    statuses: Dict[str, str] = {}
+
+    @router.broker.subscriber(router.download_status_queue)
+    async def record_status(message: dict):
+        statuses[message["id"]] = message["status"]
+
+    temp_dir = router.processors[download_type].temp_dir
+    # Importing the app already runs short-lived helpers such as ldconfig, only jobs' tools count
+    child_rss_baseline = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    temp_baseline = directory_size(temp_dir)
+    peak_temp = 0
+    latencies: List[float] = []
+    failures: Dict[str, int] = {}
+    requeues = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def sample_temp_dir():
+        nonlocal peak_temp
+        loop = asyncio.get_event_loop()
+        while True:
+            size = await loop.run_in_executor(None, directory_size, temp_dir)
+            peak_temp = max(peak_temp, size - temp_baseline)
+            await asyncio.sleep(0.05)
+
+    async def run_job(broker, index: int):
+        nonlocal requeues
+        message = request_for(download_type, index, base_url)
+        async with semaphore:
+            started = time.monotonic()
+            while True:
+                try:
+                    await broker.publish(json.dumps(message), queue=router.download_request_queue)
+                except Exception as e:
+                    failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+                    return
+                if statuses.get(message["id"]) in ("DONE", "FAILED"):
+                    break
+                # A saturated type nacked the message, the real broker would redeliver it
+                requeues += 1
+            latencies.append(time.monotonic() - started)
+
+    await http_client.start()
+    sampler = asyncio.ensure_future(sample_temp_dir())
+    try:
+        async with TestRabbitBroker(router.broker) as broker:
+            started = time.monotonic()
+            await asyncio.gather(*(run_job(broker, index) for index in range(jobs)))
+            elapsed = time.monotonic() - started
+    finally:
+        sampler.cancel()
+        await asyncio.gather(sampler, return_exceptions=True)
+        await http_client.close()
+
+    # ru_maxrss is in KiB on Linux
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "type": download_type,
+        "jobs": jobs,
+        "succeeded": len(latencies),
+        "failures": failures,
+        "requeues": requeues,
+        "elapsed_seconds": round(elapsed, 3),
+        "jobs_per_second": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50_seconds": round(percentile(latencies, 0.50), 3),
+        "p99_seconds": round(percentile(latencies, 0.99), 3),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "peak_child_rss_bytes": child_rss * 1024 if child_rss > child_rss_baseline else 0,
+        "peak_temp_bytes": peak_temp,
+    }
+
+
+async def run_benchmark(args) -> List[dict]:
+    settings = FixtureSettings(
+        file_size=args.file_size,
+        package_size=args.package_size,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        nifi_latency=args.nifi_latency,
+        nifi_bandwidth=args.nifi_bandwidth,
+        dependencies=args.dependencies,
+        helm_charts=args.helm_charts,
+    )
+    server = FixtureServer(settings)
+    await server.start()
+    scratch_dir = tempfile.mkdtemp(prefix="minion-benchmark-")
+    results = []
+    try:
+        for download_type in args.types:
+            server.reset_counters()
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-m", "benchmarks.run",
+                "--worker", download_type,
+                "--base-url", server.base_url,
+                "--jobs", str(args.jobs),
+                "--concurrency", str(args.concurrency),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=None if args.verbose else asyncio.subprocess.DEVNULL,
+                env=worker_environment(server.base_url, scratch_dir),
+            )
+            result = None
+            async for line in process.stdout:
+                text = line.decode(errors="replace")
+                if text.startswith(RESULT_PREFIX):
+                    result = json.loads(text[len(RESULT_PREFIX):])
+                elif args.verbose:
+                    sys.stdout.write(text)
+            await process.wait()
+            if result is None:
+                raise RuntimeError(f"{download_type} benchmark worker exited with {process.returncode} without a result")
+            result["uploaded_bytes"] = server.uploaded_bytes
+            results.append(result)
+    finally:
+        await server.stop()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return results
+
+
+def format_bytes(count: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(count) < 1024 or unit == "GiB":
+            return f"{count:.1f} {unit}" if unit != "B" else f"{int(count)} B"
+        count /= 1024
+
+
+def print_results(results: List[dict], baseline: Optional[Dict[str, dict]]):
+    header = f"{'TYPE':<8}{'OK':>8}{'JOBS/S':>10}{'P50 S':>9}{'P99 S':>9}{'PEAK RSS':>13}{'CHILD RSS':>13}{'PEAK TEMP':>13}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        print(
+            f"{result['type']:<8}{result['succeeded']:>4}/{result['jobs']:<3}{result['jobs_per_second']:>10.2f}"
+            f"{result['p50_seconds']:>9.2f}{result['p99_seconds']:>9.2f}{format_bytes(result['peak_rss_bytes']):>13}"
+            f"{format_bytes(result['peak_child_rss_bytes']):>13}{format_bytes(result['peak_temp_bytes']):>13}"
+        )
+        if result["failures"] or result["requeues"]:
+            print(f"{'':<8}failures: {result['failures'] or 'none'}, requeues: {result['requeues']}")
+        previous = (baseline or {}).get(result["type"])
+        if previous:
+            deltas = []
+            for key, label in (("jobs_per_second", "jobs/s"), ("p50_seconds", "p50"), ("p99_seconds", "p99"),
+                               ("peak_rss_bytes", "rss"), ("peak_temp_bytes", "temp")):
+                if previous.get(key):
+                    deltas.append(f"{label} {(result[key] - previous[key]) / previous[key]:+.1%}")
+            print(f"{'':<8}vs baseline: {', '.join(deltas)}")
+
+
+def parse_size(value: str) -> int:
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    value = value.strip().lower().rstrip("ib").rstrip("b")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the minion pipeline against local fixtures")
+    parser.add_argument("--types", default=",".join(TYPES), help="Comma separated processor types to benchmark")
+    parser.add_argument("--jobs", type=int, default=20, help="Requests per type")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once, like the prefetch")
+    parser.add_argument("--file-size", type=parse_size, default="8M", help="Size of FILE downloads")
+    parser.add_argument("--package-size", type=parse_size, default="256K", help="Size of charts, jars, tarballs and wheels")
+    parser.add_argument("--dependencies", type=int, default=8, help="Transitive dependencies of every package")
+    parser.add_argument("--helm-charts", type=int, default=4, help="Charts in every Helm repository")
+    parser.add_argument("--latency", type=float, default=0.0, help="Upstream response latency in seconds")
+    parser.add_argument("--bandwidth", type=parse_size, default="0", help="Upstream bytes per second per response, 0 is unlimited")
+    parser.add_argument("--nifi-latency", type=float, default=0.0, help="NiFi response latency in seconds")
+    parser.add_argument("--nifi-bandwidth", type=parse_size, default="0", help="NiFi bytes per second per upload, 0 is unlimited")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the workers")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = asyncio.run(run_worker(args.worker, args.base_url, args.jobs, args.concurrency))
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+        return
+
+    args.types = [download_type.strip().upper() for download_type in args.types.split(",") if download_type.strip()]
+    unknown = [download_type for download_type in args.types if download_type not in TYPES]
+    if unknown:
+        parser.error(f"Unsupported types {unknown}, the benchmark covers {list(TYPES)}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = {result["type"]: result for result in json.load(baseline_file)["results"]}
+
+    results = asyncio.run(run_benchmark(args))
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"settings": {key: value for key, value in vars(args).items() if key not in ("worker", "base_url")},
+                       "results": results}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
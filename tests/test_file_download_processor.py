@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app.helpers.delivery_index import delivery_index
+from app.helpers.http_client import http_client
+from app.helpers.step_journal import step_journal
+from app.helpers.workspace import workspace_manager
+from app.models.download_status import DownloadStatus
+from app.models.hyperloop_download import HyperloopDownload
+from app.processors.file_download_processor import FileDownloadProcessor
+from benchmarks.fixtures import FixtureServer, FixtureSettings
+
+
+class StatusBroker:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, message, queue):
+        self.published.append(message)
+
+
+@pytest.fixture
+def isolated_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(delivery_index, "enabled", True)
+    monkeypatch.setattr(delivery_index, "path", str(tmp_path / "delivery-index.json"))
+    monkeypatch.setattr(delivery_index, "_entries", {})
+    monkeypatch.setattr(step_journal, "journal_dir", str(tmp_path / "journal"))
+    (tmp_path / "journal").mkdir()
+
+
+def download(request_id, url):
+    return HyperloopDownload.from_dict({
+        "id": request_id, "type": "FILE", "dependency": url, "status": "STARTED", "date": "2026-01-01T00:00:00",
+    })
+
+
+@pytest.mark.parametrize("segment_bytes", [16 * 1024 * 1024, 64 * 1024], ids=["single-segment", "multi-segment"])
+def test_identical_streamed_ranged_downloads_are_uploaded_once(tmp_path, isolated_state, segment_bytes):
+    async def main():
+        server = FixtureServer(FixtureSettings(file_size=256 * 1024))
+        await server.start()
+        try:
+            processor = FileDownloadProcessor(StatusBroker(), "status")
+            processor.temp_dir = str(tmp_path / "file-downloads")
+            processor.partial_dir = workspace_manager.stable_dir(processor.temp_dir, "partial")
+            processor.min_segment_size = segment_bytes
+            processor.stream_uploads = True
+            processor.tarball_sender.endpoint_url = f"{server.base_url}/nifi"
+
+            first, second = (download(request_id, f"{server.base_url}/files/data.bin") for request_id in ("1", "2"))
+            for job in (first, second):
+                await processor.process(job)
+            return first, second, server.uploads
+        finally:
+            await http_client.close()
+            await server.stop()
+
+    first, second, uploads = asyncio.run(main())
+
+    assert uploads == 1
+    assert first.status == second.status == DownloadStatus.DONE
+    assert second.details["deduplicated"] is True
+    assert second.content_sha256 == first.content_sha256
@@ -0,0 +1,74 @@
+import asyncio
+import os
+
+from app.helpers.http_client import http_client
+from app.helpers.maven_resolver import MavenResolver
+from benchmarks.fixtures import FixtureServer, FixtureSettings
+
+
+def write_pom(repository, group_id, artifact_id, version, body=""):
+    path = os.path.join(repository, *group_id.split("."), artifact_id, version)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, f"{artifact_id}-{version}.pom"), "w") as pom_file:
+        pom_file.write(
+            '<project xmlns="http://maven.apache.org/POM/4.0.0"><modelVersion>4.0.0</modelVersion>'
+            f"{body}<groupId>{group_id}</groupId><artifactId>{artifact_id}</artifactId><version>{version}</version>"
+            "</project>"
+        )
+    with open(os.path.join(path, f"{artifact_id}-{version}.jar"), "wb") as jar_file:
+        jar_file.write(f"{artifact_id}-{version}".encode())
+
+
+def jars(destination):
+    return sorted(name for _, _, names in os.walk(destination) for name in names if name.endswith(".jar"))
+
+
+def test_parent_declarations_use_child_properties(tmp_path):
+    repository = str(tmp_path / "repository")
+    for version in ("1.0", "2.0"):
+        write_pom(repository, "test", "lib", version)
+        write_pom(repository, "test", "util", version)
+    write_pom(repository, "test", "parent", "1", (
+        "<packaging>pom</packaging>"
+        "<properties><lib.version>1.0</lib.version><util.version>1.0</util.version></properties>"
+        "<dependencyManagement><dependencies>"
+        "<dependency><groupId>test</groupId><artifactId>lib</artifactId><version>${lib.version}</version></dependency>"
+        "</dependencies></dependencyManagement>"
+        "<dependencies>"
+        "<dependency><groupId>test</groupId><artifactId>util</artifactId><version>${util.version}</version></dependency>"
+        "</dependencies>"
+    ))
+    write_pom(repository, "test", "app", "1", (
+        "<parent><groupId>test</groupId><artifactId>parent</artifactId><version>1</version></parent>"
+        "<properties><lib.version>2.0</lib.version><util.version>2.0</util.version></properties>"
+        "<dependencies><dependency><groupId>test</groupId><artifactId>lib</artifactId></dependency></dependencies>"
+    ))
+    resolver = MavenResolver(f"file://{repository}")
+    destination = str(tmp_path / "destination")
+
+    artifacts = asyncio.run(resolver.resolve("test", "app", "1", destination))
+
+    assert artifacts == 3
+    assert jars(destination) == ["app-1.jar", "lib-2.0.jar", "util-2.0.jar"]
+    assert os.path.exists(os.path.join(destination, "test", "parent", "1", "parent-1.pom"))
+
+
+def test_concurrent_resolutions_share_the_resolver(tmp_path):
+    async def resolve_all(server):
+        resolver = MavenResolver(f"{server.base_url}/maven/", local_repository=str(tmp_path / "shared"), max_concurrent=2)
+        return await asyncio.gather(*(
+            resolver.resolve("bench", f"app-{i}", "1.0", str(tmp_path / f"app-{i}")) for i in range(3)
+        ))
+
+    async def main():
+        server = FixtureServer(FixtureSettings(package_size=1024, dependencies=4))
+        await server.start()
+        try:
+            return await resolve_all(server)
+        finally:
+            await http_client.close()
+            await server.stop()
+
+    assert asyncio.run(main()) == [5, 5, 5]
+    for i in range(3):
+        assert jars(tmp_path / f"app-{i}") == [f"app-{i}-1.0.jar"] + [f"lib-{k}-1.0.jar" for k in range(4)]
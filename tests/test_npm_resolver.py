@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import os
+
+from app.helpers.http_client import http_client
+from app.helpers.npm_resolver import NpmResolver
+from benchmarks.fixtures import FixtureServer, FixtureSettings
+
+
+def run_with_fixtures(make_coroutine, settings=None):
+    async def main():
+        server = FixtureServer(settings or FixtureSettings(package_size=1024, dependencies=3))
+        await server.start()
+        try:
+            return await make_coroutine(server)
+        finally:
+            await http_client.close()
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def counting_fetches(resolver):
+    fetched = []
+    fetch_packument = resolver._fetch_packument
+
+    async def counted(name, semaphore):
+        fetched.append(name)
+        return await fetch_packument(name, semaphore)
+
+    resolver._fetch_packument = counted
+    return fetched
+
+
+def test_resolves_the_tree_and_hashes_the_tarballs(tmp_path):
+    file_hashes = {}
+
+    async def resolve(server):
+        resolver = NpmResolver(f"{server.base_url}/npm/", str(tmp_path / "cache"))
+        return await resolver.resolve("pkg-0@^1.0.0", str(tmp_path / "out"), file_hashes=file_hashes)
+
+    result = run_with_fixtures(resolve)
+
+    assert result["root"] == "pkg-0@1.0.0"
+    assert result["packages"] == ["dep-0@1.0.0", "dep-1@1.0.0", "dep-2@1.0.0", "pkg-0@1.0.0"]
+    assert result["unresolved"] == []
+    assert len(file_hashes) == 4
+    for path, digest in file_hashes.items():
+        assert os.path.dirname(path) == str(tmp_path / "out")
+        with open(path, "rb") as tarball:
+            assert hashlib.sha256(tarball.read()).hexdigest() == digest
+
+
+def test_packuments_in_memory_are_capped_least_recently_used_first(tmp_path):
+    async def resolve(server):
+        resolver = NpmResolver(f"{server.base_url}/npm/", None, memory_max_entries=2)
+        fetched = counting_fetches(resolver)
+        for name in ("dep-0", "dep-1", "dep-0", "dep-2"):
+            await resolver.resolve(name, str(tmp_path / name))
+        return resolver, fetched
+
+    resolver, fetched = run_with_fixtures(resolve)
+
+    # dep-0 was used again before dep-2 arrived, so dep-1 was dropped
+    assert fetched == ["dep-0", "dep-1", "dep-2"]
+    assert list(resolver._packuments) == ["dep-0", "dep-2"]
+
+
+def test_expired_packuments_are_dropped_and_fetched_again(tmp_path):
+    async def resolve(server):
+        resolver = NpmResolver(f"{server.base_url}/npm/", None, memory_ttl=0.05)
+        fetched = counting_fetches(resolver)
+        await resolver.resolve("dep-0", str(tmp_path / "first"))
+        await asyncio.sleep(0.1)
+        await resolver.resolve("dep-0", str(tmp_path / "second"))
+        return fetched
+
+    assert run_with_fixtures(resolve) == ["dep-0", "dep-0"]
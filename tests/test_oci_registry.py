@@ -0,0 +1,90 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import pytest
+
+from app.helpers.http_client import http_client
+from app.helpers.oci_registry import ImageReference, RegistryClient, RegistryError, RegistryNotFoundError
+from benchmarks.fixtures import FixtureServer, FixtureSettings
+
+
+def run_with_registry(make_coroutine):
+    async def main():
+        server = FixtureServer(FixtureSettings(package_size=64 * 1024))
+        await server.start()
+        try:
+            return await make_coroutine(ImageReference.parse, server.base_url[len("http://"):])
+        finally:
+            await http_client.close()
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("architecture", ["amd64", "arm64"])
+def test_selects_the_configured_platform_from_the_index(tmp_path, architecture):
+    client = RegistryClient()
+    client.platform = f"linux/{architecture}"
+
+    async def fetch(parse, registry):
+        image = parse(f"{registry}/bench/image-0:1.0")
+        resolved = await client.get_manifest(image)
+        config_path = str(tmp_path / "config.json")
+        await client.download_blob(image, resolved["manifest"]["config"]["digest"], config_path)
+        return resolved
+
+    resolved = run_with_registry(fetch)
+
+    with open(tmp_path / "config.json") as config_file:
+        assert json.load(config_file)["architecture"] == architecture
+    assert resolved["media_type"] == "application/vnd.oci.image.manifest.v1+json"
+    assert resolved["digest"] == f"sha256:{hashlib.sha256(resolved['raw']).hexdigest()}"
+    # The anonymous token from the challenge is reused for the repository
+    assert list(client._tokens.values()) == ["bench-token"]
+
+
+def test_missing_platform_is_not_found():
+    client = RegistryClient()
+    client.platform = "linux/s390x"
+
+    async def fetch(parse, registry):
+        with pytest.raises(RegistryNotFoundError):
+            await client.get_manifest(parse(f"{registry}/bench/image-0:1.0"))
+
+    run_with_registry(fetch)
+
+
+def test_platform_manifests_are_verified_against_the_index_digest():
+    client = RegistryClient()
+
+    async def fetch(parse, registry):
+        with pytest.raises(RegistryError, match="Digest mismatch"):
+            await client.get_manifest(parse(f"{registry}/bench/tampered:1.0"))
+
+    run_with_registry(fetch)
+
+
+def test_blobs_are_verified_against_their_digest(tmp_path):
+    client = RegistryClient()
+
+    async def fetch(parse, registry):
+        digests = {}
+        for repository in ("image-0", "corrupt"):
+            image = parse(f"{registry}/bench/{repository}:1.0")
+            layer = (await client.get_manifest(image))["manifest"]["layers"][0]["digest"]
+            destination = str(tmp_path / repository)
+            if repository == "corrupt":
+                with pytest.raises(RegistryError):
+                    await client.download_blob(image, layer, destination)
+            else:
+                await client.download_blob(image, layer, destination)
+            digests[repository] = layer
+        return digests
+
+    digests = run_with_registry(fetch)
+
+    with open(tmp_path / "image-0", "rb") as layer_file:
+        assert f"sha256:{hashlib.sha256(layer_file.read()).hexdigest()}" == digests["image-0"]
+    assert sorted(os.listdir(tmp_path)) == ["image-0"]